@@ -28,11 +28,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'delivery',
+    'delivery.apps.DeliveryConfig',
     'rest_framework',
 ]
 
 MIDDLEWARE = [
+    'delivery.middleware.ProfilingMiddleware',
+    'delivery.middleware.MetricsMiddleware',
+    'delivery.middleware.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,6 +101,99 @@ REST_FRAMEWORK = {
 }
 
 
+# Cache
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # The details of couriers. The in-process LRU cache by default,
+    # a shared backend (e.g. memcached) can be set for many workers.
+    'couriers': {
+        'BACKEND': config(
+            'COURIER_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('COURIER_CACHE_LOCATION', default='couriers'),
+        'TIMEOUT': config('COURIER_CACHE_TIMEOUT', default=300, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config(
+                'COURIER_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+}
+
+
+# Delivery settings
+
+# The strategy of packing orders into an assigned order set:
+# 'greedy', 'first_fit_decreasing', 'knapsack' or dotted path to a callable
+ORDER_ASSIGNMENT_STRATEGY = config(
+    'ORDER_ASSIGNMENT_STRATEGY', default='first_fit_decreasing')
+
+# Keep the pending orders in memory of the process for the assignment
+# (see delivery/pool.py), it's meant for a single process deployment
+ORDER_POOL_ENABLED = config('ORDER_POOL_ENABLED', default=False, cast=bool)
+
+# Keep the pool of pending orders in shared memory, it's filled by
+# the master process of gunicorn and shared by the workers (see
+# gunicorn.conf.py). The size is the maximum number of pending orders,
+# NumPy has to be installed
+ORDER_POOL_SHARED = config('ORDER_POOL_SHARED', default=False, cast=bool)
+ORDER_POOL_SHARED_SIZE = config(
+    'ORDER_POOL_SHARED_SIZE', default=100000, cast=int)
+
+# The overflowed pool in shared memory is filled from the database again
+# at most once in this number of seconds
+ORDER_POOL_REBUILD_INTERVAL = config(
+    'ORDER_POOL_REBUILD_INTERVAL', default=60, cast=int)
+
+# Match the orders with the couriers by the vectorized operations of NumPy
+# (see delivery/matching.py), NumPy has to be installed
+ORDER_MATCHING_VECTORIZED = config(
+    'ORDER_MATCHING_VECTORIZED', default=False, cast=bool)
+
+
+# Monitoring
+
+# Log the SQL queries of each request and send their statistics in
+# Server-Timing header (see delivery/middleware.py)
+QUERY_STATS_ENABLED = config('QUERY_STATS_ENABLED', default=False, cast=bool)
+
+# Collect the metrics of the requests and the orders and expose them
+# at /metrics for Prometheus (see delivery/metrics.py)
+METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+
+# Profile the requests with cProfile and dump the statistics to
+# PROFILING_DIR (see delivery/middleware.py): 1 in PROFILING_SAMPLE_RATE
+# requests (0 - only the requests with X-Profile header). The header is
+# honoured with DEBUG or if it's equal to PROFILING_SECRET. The oldest
+# profiles are removed when they take more than PROFILING_MAX_SIZE bytes.
+PROFILING_DIR = config('PROFILING_DIR', default='')
+PROFILING_SECRET = config('PROFILING_SECRET', default='')
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0, cast=int)
+PROFILING_MAX_SIZE = config('PROFILING_MAX_SIZE', default=100 * 1024 * 1024,
+                            cast=int)
+
+
+# Logging
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'delivery': {
+            'handlers': ['console'],
+            'level': config('DELIVERY_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
+
 # Internationalization
 
 LANGUAGE_CODE = 'en-us'
@@ -7,21 +7,60 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.http import Http404
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.http import parse_etags, quote_etag
 
 from .serializers import (
     CourierItemPostSerializer,
     CourierItemPatchSerializer,
     CourierDetailSerializer,
     CourierIdSerializer,
+    CourierIdListSerializer,
     OrderSerializer,
     OrderIdSerializer,
     AssignOrderSetSerializer,
-    CompleteOrderSerializer)
+    CourierOrderSetSerializer,
+    CompleteOrderSerializer,
+    CompleteOrderResultSerializer)
 from .models import Courier, Order
+from .cache import (get_courier_detail, invalidate_courier_detail,
+                    set_courier_detail)
 from .exceptions import (OrderAssignBadRequest,
                          NoDataProvidedBadRequest)
 
 
+def get_etag(object_id, version) -> str:
+    """
+    Return ETag of the object with the version.
+    """
+
+    return quote_etag(f'{object_id}-{version}')
+
+
+def is_not_modified(request, etag) -> bool:
+    """
+    Check if the client has the same version of the object,
+    i.e. If-None-Match header has ETag of the object.
+    """
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    # If-None-Match uses the weak comparison
+    etags = {tag[2:] if tag.startswith('W/') else tag
+             for tag in parse_etags(if_none_match)}
+    return '*' in etags or etag in etags
+
+
+def not_modified_response(etag, headers=None) -> Response:
+    """
+    Return HTTP 304 without the body.
+    """
+
+    return Response(status=status.HTTP_304_NOT_MODIFIED,
+                    headers={'ETag': etag, **(headers or {})})
+
+
 class CourierListAPI(APIView):
     """
     Api for creating couriers.
@@ -51,16 +90,21 @@ class CourierItemAPI(APIView):
     Get courier properties, valide them and update the courier.
     """
 
-    def get_object(self, pk):
+    def get_object(self, pk, for_update=False):
+        couriers = Courier.objects.all()
+        if for_update:
+            couriers = couriers.select_for_update()
         try:
-            courier = Courier.objects.get(courier_id=pk)
+            courier = couriers.get(courier_id=pk)
         except Courier.DoesNotExist:
             raise Http404
         return courier
 
     @transaction.atomic
     def patch(self, request, pk):
-        courier = self.get_object(pk=pk)
+        # Lock the courier like the assignment does, so his current set
+        # of orders can't be changed until the patch is saved
+        courier = self.get_object(pk=pk, for_update=True)
         serializer = CourierItemPatchSerializer(courier, data=request.data)
         if serializer.is_valid(raise_exception=False):
             serializer.save()
@@ -68,9 +112,46 @@ class CourierItemAPI(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request, pk):
+        # The details are read from the cache, the X-Cache header
+        # tells whether they were there. Only the version is cached
+        # if the details haven't been serialized yet.
+        entry = get_courier_detail(pk)
+        if entry is not None:
+            etag = get_etag(pk, entry['version'])
+            if is_not_modified(request, etag):
+                return not_modified_response(etag, {'X-Cache': 'HIT'})
+            if entry['data'] is not None:
+                headers = {'ETag': etag, 'X-Cache': 'HIT'}
+                return Response(entry['data'], status=status.HTTP_200_OK,
+                                headers=headers)
+
         courier = self.get_object(pk=pk)
-        serializer = CourierDetailSerializer(courier)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        etag = get_etag(courier.courier_id, courier.version)
+        # The client has the actual details - don't serialize them
+        if is_not_modified(request, etag):
+            self.cache_detail(courier, None)
+            return not_modified_response(etag, {'X-Cache': 'MISS'})
+        data = dict(CourierDetailSerializer(courier).data)
+        self.cache_detail(courier, data)
+
+        headers = {'ETag': etag, 'X-Cache': 'MISS'}
+        return Response(data, status=status.HTTP_200_OK, headers=headers)
+
+    def cache_detail(self, courier, data):
+        """
+        Cache the details of the courier read from the database.
+
+        A patch committed after the courier was read could have removed
+        his details from the cache before they are set, so the version
+        is checked after setting them and they are removed if it has
+        changed.
+        """
+
+        set_courier_detail(courier.courier_id, courier.version, data)
+        if not Courier.objects.filter(
+                courier_id=courier.courier_id,
+                version=courier.version).exists():
+            invalidate_courier_detail(courier.courier_id)
 
 
 class OrderListAPI(APIView):
@@ -118,8 +199,48 @@ class OrdersAssignAPI(APIView):
             order_set = courier.assign_orders()
             if order_set is None:
                 return Response([], status=status.HTTP_400_BAD_REQUEST)
+            # The client has the actual set - don't serialize it
+            etag = get_etag(order_set.id, order_set.version)
+            if is_not_modified(request, etag):
+                return not_modified_response(etag)
             data = AssignOrderSetSerializer(order_set).data
-            return Response(data, status=status.HTTP_200_OK)
+            return Response(data, status=status.HTTP_200_OK,
+                            headers={'ETag': etag})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class OrdersBatchAssignAPI(APIView):
+    """
+    Api for assigning orders to many couriers in one pass.
+
+    return the list of couriers with their AssignOrderSets.
+    """
+
+    def get_queryset(self, data):
+        if data['all_idle']:
+            return Courier.objects.idle()
+
+        courier_ids = set(data['courier_ids'])
+        couriers = Courier.objects.filter(courier_id__in=courier_ids)
+        if couriers.count() != len(courier_ids):
+            raise OrderAssignBadRequest
+        return couriers
+
+    @transaction.atomic
+    def post(self, request):
+        serializer = CourierIdListSerializer(data=request.data)
+        if serializer.is_valid():
+            couriers = self.get_queryset(serializer.validated_data)
+            order_sets = couriers.assign_orders()
+            prefetch_related_objects(
+                [order_set for order_set in order_sets.values() if order_set],
+                Prefetch('orders',
+                         queryset=Order.objects.filter(status='assigned'),
+                         to_attr='prefetched_notstarted_orders'))
+            items = sorted(order_sets.items(),
+                           key=lambda item: item[0].courier_id)
+            data = CourierOrderSetSerializer(items, many=True).data
+            return Response({'couriers': data}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -142,6 +263,7 @@ class OrdersCompleteAPI(APIView):
             order = None
         return order
 
+    @transaction.atomic
     def post(self, request):
         serializer = CompleteOrderSerializer(data=request.data)
 
@@ -158,8 +280,31 @@ class OrdersCompleteAPI(APIView):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         # If all data is valid and the instances exist
-        is_success, _ = order.complete(courier=courier,
-                                       complete_time=serializer.data['complete_time'])
+        is_success, _ = order.complete(
+            courier=courier,
+            complete_time=serializer.validated_data['complete_time'])
         if is_success:
             return Response({'order_id': order.order_id}, status=status.HTTP_200_OK)
         return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+class OrdersBatchCompleteAPI(APIView):
+    """
+    Api to mark many orders as completed.
+
+    return the result for each order.
+    """
+
+    @transaction.atomic
+    def post(self, request):
+        # If no data key and data isn't dict
+        if (not isinstance(request.data, dict)
+            or request.data.get('data') is None):
+            raise NoDataProvidedBadRequest
+        serializer = CompleteOrderSerializer(
+            data=request.data.get('data'), many=True, allow_empty=False)
+        if serializer.is_valid():
+            results = Order.objects.complete(serializer.validated_data)
+            data = CompleteOrderResultSerializer(results, many=True).data
+            return Response({'orders': data}, status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DeliveryConfig(AppConfig):
     name = 'delivery'
+
+    def ready(self):
+        # Connect the receivers counting the orders in the metrics
+        from . import metrics  # noqa: F401
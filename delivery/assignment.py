@@ -0,0 +1,131 @@
+"""
+The strategies of packing matching orders into an assigned order set.
+
+Each strategy gets the matching orders of the courier and his load
+capacity and returns the orders to assign. The total weight of the
+returned orders never exceeds the load capacity.
+"""
+
+from decimal import Decimal
+from operator import attrgetter
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+# The exact knapsack is used only for small candidate sets,
+# the bigger sets are packed with first fit decreasing.
+KNAPSACK_MAX_ORDERS = 500
+
+
+def _to_hundredths(weight) -> int:
+    """
+    Return the weight as integer number of hundredths of kg.
+    """
+
+    return int(round(Decimal(str(weight)) * 100))
+
+
+def greedy(orders: Iterable, capacity) -> List:
+    """
+    Take the lightest orders first while they fit the load capacity.
+
+    It assigns the maximum possible number of orders.
+    """
+
+    left = _to_hundredths(capacity)
+    packed_orders = []
+    for order in sorted(orders, key=attrgetter('weight')):
+        weight = _to_hundredths(order.weight)
+        if weight > left:
+            break
+        packed_orders.append(order)
+        left -= weight
+    return packed_orders
+
+
+def first_fit_decreasing(orders: Iterable, capacity) -> List:
+    """
+    Take the heaviest orders first, skipping the orders that don't fit
+    the rest of the load capacity.
+    """
+
+    left = _to_hundredths(capacity)
+    packed_orders = []
+    for order in sorted(orders, key=attrgetter('weight'), reverse=True):
+        weight = _to_hundredths(order.weight)
+        if weight <= left:
+            packed_orders.append(order)
+            left -= weight
+    return packed_orders
+
+
+def knapsack(orders: Iterable, capacity) -> List:
+    """
+    Find the orders with the maximum total weight that fit the load
+    capacity (0/1 knapsack problem).
+
+    The reachable total weights are kept as bits of an integer, so the
+    solution costs O(n * capacity / word size). If there are more than
+    KNAPSACK_MAX_ORDERS orders, first_fit_decreasing is used instead.
+    """
+
+    orders = list(orders)
+    if len(orders) > KNAPSACK_MAX_ORDERS:
+        return first_fit_decreasing(orders, capacity)
+
+    capacity = _to_hundredths(capacity)
+    weights = [_to_hundredths(order.weight) for order in orders]
+    limit = (1 << (capacity + 1)) - 1
+
+    # reachable[i] - the total weights reachable with the first i orders
+    reachable = [1]
+    for weight in weights:
+        reachable.append((reachable[-1] | reachable[-1] << weight) & limit)
+
+    # Find the best total weight and restore the orders giving it
+    total = reachable[-1].bit_length() - 1
+    packed_orders = []
+    for index in range(len(orders) - 1, -1, -1):
+        if not reachable[index] >> total & 1:
+            packed_orders.append(orders[index])
+            total -= weights[index]
+    packed_orders.reverse()
+    return packed_orders
+
+
+ASSIGNMENT_STRATEGIES: Dict[str, Callable] = {
+    'greedy': greedy,
+    'first_fit_decreasing': first_fit_decreasing,
+    'knapsack': knapsack,
+}
+
+
+def get_assignment_strategy(name: Optional[str] = None) -> Callable:
+    """
+    Return the strategy by its name or by dotted path to a callable.
+
+    If the name isn't given, ORDER_ASSIGNMENT_STRATEGY setting is used.
+    """
+
+    if name is None:
+        name = settings.ORDER_ASSIGNMENT_STRATEGY
+    if name in ASSIGNMENT_STRATEGIES:
+        return ASSIGNMENT_STRATEGIES[name]
+    try:
+        return import_string(name)
+    except ImportError:
+        raise ImproperlyConfigured(
+            f"Unknown order assignment strategy '{name}'. Use one of "
+            f"{list(ASSIGNMENT_STRATEGIES)} or a dotted path to a callable")
+
+
+def pack_orders(orders: Iterable, capacity,
+                strategy: Optional[str] = None) -> List:
+    """
+    Choose the orders to assign with the given or configured strategy.
+    """
+
+    return get_assignment_strategy(strategy)(orders, capacity)
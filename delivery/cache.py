@@ -0,0 +1,88 @@
+"""
+The cache of the courier details.
+
+The data of GET /couriers/<id> is cached by courier and invalidated
+when the data that feeds it changes: the courier is patched or his
+statistics of finished orders are updated.
+"""
+
+import threading
+from typing import Optional
+
+from django.core.cache import caches
+from django.db import transaction
+
+from .signals import courier_cache_requested
+
+
+# The alias of the cache in settings.CACHES
+COURIER_CACHE_ALIAS = 'couriers'
+
+# The counters of hits and misses of the current process
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def get_courier_cache():
+    return caches[COURIER_CACHE_ALIAS]
+
+
+def get_courier_cache_key(courier_id) -> str:
+    return f'courier:{courier_id}'
+
+
+def get_courier_detail(courier_id) -> Optional[dict]:
+    """
+    Return the cached details of the courier: {'version', 'data'}
+    or None if they aren't in the cache. The data are None if only
+    the version is cached.
+    """
+
+    entry = get_courier_cache().get(get_courier_cache_key(courier_id))
+    _count('misses' if entry is None else 'hits')
+    courier_cache_requested.send(sender=None, hit=entry is not None)
+    return entry
+
+
+def set_courier_detail(courier_id, version, data):
+    """
+    Cache the details of the courier with their version, or only
+    the version if the data are None.
+    """
+
+    get_courier_cache().set(get_courier_cache_key(courier_id),
+                            {'version': version, 'data': data})
+
+
+def invalidate_courier_detail(courier_id):
+    """
+    Remove the data of the courier from the cache.
+
+    It's removed at once and after the commit of the current
+    transaction, so a concurrent request can't cache the data that
+    hasn't been committed yet.
+    """
+
+    key = get_courier_cache_key(courier_id)
+    get_courier_cache().delete(key)
+    transaction.on_commit(lambda: get_courier_cache().delete(key))
+
+
+def get_cache_stats() -> dict:
+    """
+    Return the counters of hits and misses of the current process.
+    """
+
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
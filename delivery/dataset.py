@@ -0,0 +1,127 @@
+"""
+The synthetic data of couriers and orders for the benchmarks.
+
+The couriers and the orders are generated as the data of the requests
+of the API, so the same data are saved by generate_dataset command and
+posted by loadtest command. The data are defined by the seed of
+the random generator.
+"""
+
+import random
+from typing import List
+
+from django.db import models
+
+from .models import COURIER_LOAD_CAPACITY, ORDER_WEIGHT_CONSTRAINTS
+
+
+# The share of each courier type among the couriers
+COURIER_TYPE_MIX = {
+    'foot': 0.5,
+    'bike': 0.3,
+    'car': 0.2,
+}
+
+# The most orders are light, the heavy ones are rare
+ORDER_WEIGHT_MEDIAN = 2
+ORDER_WEIGHT_SIGMA = 1
+
+
+def get_next_id(model, field: str) -> int:
+    """
+    Return the id following the greatest id of the model, so
+    the generated data continue after the existing ones.
+    """
+
+    return (model.objects.aggregate(
+        max_id=models.Max(field))['max_id'] or 0) + 1
+
+
+def format_interval(start: int, end: int) -> str:
+    """
+    Return the interval of minutes of a day in format 'HH:MM-HH:MM'.
+    """
+
+    return '{:02}:{:02}-{:02}:{:02}'.format(
+        *divmod(start % (24 * 60), 60), *divmod(end % (24 * 60), 60))
+
+
+def generate_working_hours(rand: random.Random) -> List[str]:
+    """
+    Return 1 or 2 shifts of the courier in the day time.
+    """
+
+    if rand.random() < 0.8:
+        start = rand.randrange(7 * 60, 14 * 60 + 1, 30)
+        return [format_interval(start, start + rand.choice([4, 6, 8]) * 60)]
+
+    start = rand.randrange(7 * 60, 10 * 60 + 1, 30)
+    second_start = start + rand.choice([5, 6, 7]) * 60
+    return [format_interval(start, start + 4 * 60),
+            format_interval(second_start, second_start + 4 * 60)]
+
+
+def generate_delivery_hours(rand: random.Random) -> List[str]:
+    """
+    Return 1 or 2 windows of 1-3 hours between 08:00 and 22:00.
+    """
+
+    delivery_hours = []
+    for _ in range(1 if rand.random() < 0.7 else 2):
+        length = rand.choice([1, 2, 3]) * 60
+        start = rand.randrange(8 * 60, 22 * 60 - length + 1, 30)
+        delivery_hours.append(format_interval(start, start + length))
+    return delivery_hours
+
+
+def generate_weight(rand: random.Random, max_weight: float) -> float:
+    """
+    Return the weight of an order in kg with 2 decimal places.
+    """
+
+    weight = round(rand.lognormvariate(0, ORDER_WEIGHT_SIGMA)
+                   * ORDER_WEIGHT_MEDIAN, 2)
+    return min(max(weight, 0.01), max_weight)
+
+
+def generate_couriers(rand: random.Random, first_id: int, count: int,
+                      regions: int) -> List[dict]:
+    """
+    Return the data of the couriers with ids from first_id. Each of
+    them works in 1-5 regions of 1..regions.
+    """
+
+    courier_types = rand.choices(list(COURIER_TYPE_MIX),
+                                 weights=list(COURIER_TYPE_MIX.values()),
+                                 k=count)
+    return [
+        {
+            'courier_id': courier_id,
+            'courier_type': courier_type,
+            'regions': sorted(rand.sample(range(1, regions + 1),
+                                          min(rand.randint(1, 5), regions))),
+            'working_hours': generate_working_hours(rand),
+        }
+        for courier_id, courier_type in zip(
+            range(first_id, first_id + count), courier_types)
+    ]
+
+
+def generate_orders(rand: random.Random, first_id: int, count: int,
+                    regions: int) -> List[dict]:
+    """
+    Return the data of the orders with ids from first_id in the regions
+    1..regions. The orders heavier than a car can take are not created.
+    """
+
+    max_weight = min(COURIER_LOAD_CAPACITY['car'],
+                     ORDER_WEIGHT_CONSTRAINTS['max_value'])
+    return [
+        {
+            'order_id': order_id,
+            'weight': generate_weight(rand, max_weight),
+            'region': rand.randint(1, regions),
+            'delivery_hours': generate_delivery_hours(rand),
+        }
+        for order_id in range(first_id, first_id + count)
+    ]
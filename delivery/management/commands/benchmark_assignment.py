@@ -0,0 +1,79 @@
+"""
+The benchmark of the order assignment strategies.
+"""
+
+import random
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from delivery.assignment import ASSIGNMENT_STRATEGIES
+from delivery.models import COURIER_LOAD_CAPACITY, ORDER_WEIGHT_CONSTRAINTS
+
+
+CandidateOrder = namedtuple('CandidateOrder', ['order_id', 'weight'])
+
+
+class Command(BaseCommand):
+    """
+    Compare delivered weight per assign call across the strategies.
+
+    Each run drains a random pool of matching orders: the courier calls
+    assign while any order of the pool fits his load capacity.
+    """
+
+    help = 'Compare delivered weight per assign call across the strategies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000,
+                            help='The number of orders in the pool.')
+        parser.add_argument('--runs', type=int, default=10,
+                            help='The number of pools for each courier type.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'type':<6}{'strategy':<22}{'calls':>8}{'kg/call':>10}"
+            f"{'fill':>8}{'orders/call':>13}{'ms/call':>10}")
+
+        for courier_type, capacity in COURIER_LOAD_CAPACITY.items():
+            for name, strategy in ASSIGNMENT_STRATEGIES.items():
+                # The same pools for each strategy
+                rand = random.Random(options['seed'])
+                calls = delivered_weight = delivered_orders = 0
+                elapsed = 0.0
+                for _ in range(options['runs']):
+                    pool = self._create_pool(rand, options['orders'], capacity)
+                    while pool:
+                        start = time.perf_counter()
+                        packed = strategy(pool, capacity)
+                        elapsed += time.perf_counter() - start
+                        if not packed:
+                            break
+                        packed_ids = {order.order_id for order in packed}
+                        pool = [order for order in pool
+                                if order.order_id not in packed_ids]
+                        calls += 1
+                        delivered_orders += len(packed)
+                        delivered_weight += sum(order.weight for order in packed)
+
+                self.stdout.write(
+                    f'{courier_type:<6}{name:<22}{calls:>8}'
+                    f'{delivered_weight / calls:>10.2f}'
+                    f'{delivered_weight / calls / capacity:>8.1%}'
+                    f'{delivered_orders / calls:>13.2f}'
+                    f'{elapsed / calls * 1000:>10.3f}')
+
+    def _create_pool(self, rand, size, capacity):
+        """
+        Return the orders that match the courier by weight.
+        """
+
+        min_weight = int(ORDER_WEIGHT_CONSTRAINTS['min_value'] * 100) + 1
+        max_weight = int(min(capacity, ORDER_WEIGHT_CONSTRAINTS['max_value']) * 100)
+        return [
+            CandidateOrder(order_id, Decimal(rand.randint(min_weight, max_weight)) / 100)
+            for order_id in range(size)
+        ]
@@ -0,0 +1,163 @@
+"""
+The benchmark of matching the pending orders with a courier.
+"""
+
+import random
+import time
+from collections import namedtuple
+from datetime import time as day_time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from delivery.matching import OrderColumns, get_numpy
+from delivery.models import (
+    COURIER_LOAD_CAPACITY, get_hours_mask, have_intersecting_hours)
+
+
+PendingOrder = namedtuple(
+    'PendingOrder',
+    ['order_id', 'weight', 'region_id', 'delivery_hours',
+     'delivery_hours_mask'])
+
+
+def have_intersection(working_hours, delivery_hours) -> bool:
+    """
+    Find the time intersections of the delivery hours (1 item) and
+    the working hours (many items) like the check of the orders one by
+    one before the hours masks. The generated hours don't pass midnight.
+    """
+
+    order_start, order_end = delivery_hours
+    for courier_start, courier_end in working_hours:
+        # if we have a partial intersection at least 1 minute
+        if (courier_start < order_start < courier_end
+                or courier_start < order_end < courier_end):
+            return True
+        # If all working hours into delivery hours
+        if order_start <= courier_start and order_end >= courier_end:
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    """
+    Compare the loop checking the delivery hours of the orders one by
+    one with the loop over the hours masks (the pool of pending orders)
+    and the vectorized matching of OrderColumns.
+
+    The orders are generated in memory, so only the matching is measured.
+    """
+
+    help = ('Compare the loops over the hours and over the hours masks '
+            'with the vectorized matching.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[1000, 100000, 1000000],
+                            help='The numbers of pending orders.')
+        parser.add_argument('--regions', type=int, default=100)
+        parser.add_argument('--couriers', type=int, default=10,
+                            help='The number of couriers matched each time.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # Don't count the import of NumPy in the first loading
+        get_numpy()
+        self.stdout.write(
+            f"{'orders':>9}{'matched':>9}{'loop ms':>10}{'masks ms':>10}"
+            f"{'numpy ms':>10}{'load ms':>10}")
+
+        for size in options['sizes']:
+            rand = random.Random(options['seed'])
+            orders, windows = self._create_orders(rand, size, options['regions'])
+            couriers = [self._create_courier(rand, options['regions'])
+                        for _ in range(options['couriers'])]
+
+            start = time.perf_counter()
+            columns = OrderColumns(
+                orders, [order.region_id for order in orders], windows)
+            load_time = time.perf_counter() - start
+
+            loop_time = masks_time = numpy_time = 0.0
+            matched = 0
+            for region_ids, capacity, working_hours in couriers:
+                start = time.perf_counter()
+                expected_orders = self._match_in_loop(
+                    orders, region_ids, capacity, working_hours)
+                loop_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                mask_orders = self._match_masks_in_loop(
+                    orders, region_ids, capacity, get_hours_mask(working_hours))
+                masks_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                matched_orders = columns.match(
+                    working_hours, region_ids=region_ids, capacity=capacity)
+                numpy_time += time.perf_counter() - start
+
+                expected_ids = {order.order_id for order in expected_orders}
+                assert {order.order_id for order in mask_orders} == expected_ids
+                assert ({order.order_id for order in matched_orders}
+                        == expected_ids)
+                matched += len(matched_orders)
+
+            couriers_count = len(couriers)
+            self.stdout.write(
+                f'{size:>9}{matched // couriers_count:>9}'
+                f'{loop_time / couriers_count * 1000:>10.2f}'
+                f'{masks_time / couriers_count * 1000:>10.2f}'
+                f'{numpy_time / couriers_count * 1000:>10.2f}'
+                f'{load_time * 1000:>10.1f}')
+
+    def _match_in_loop(self, orders, region_ids, capacity, working_hours):
+        """
+        Match the orders checking their delivery hours one by one.
+        """
+
+        region_ids = set(region_ids)
+        return [
+            order for order in orders
+            if order.region_id in region_ids
+            and order.weight <= capacity
+            and any(have_intersection(working_hours, delivery_hours)
+                    for delivery_hours in order.delivery_hours)
+        ]
+
+    def _match_masks_in_loop(self, orders, region_ids, capacity,
+                             working_hours_mask):
+        """
+        Match the orders with the hours masks like the pool of pending
+        orders does it.
+        """
+
+        region_ids = set(region_ids)
+        return [
+            order for order in orders
+            if order.region_id in region_ids
+            and order.weight <= capacity
+            and have_intersecting_hours(working_hours_mask,
+                                        order.delivery_hours_mask)
+        ]
+
+    def _create_orders(self, rand, size, regions):
+        orders = []
+        windows = []
+        for order_id in range(1, size + 1):
+            start = rand.randint(8, 20)
+            intervals = [(day_time(hour=start), day_time(hour=start + 1))]
+            orders.append(PendingOrder(
+                order_id, Decimal(rand.randint(1, 5000)) / 100,
+                rand.randint(1, regions), intervals,
+                get_hours_mask(intervals)))
+            windows.extend((order_id, start, end) for start, end in intervals)
+        return orders, windows
+
+    def _create_courier(self, rand, regions):
+        start = rand.randint(8, 16)
+        return (
+            rand.sample(range(1, regions + 1), 3),
+            COURIER_LOAD_CAPACITY[rand.choice(list(COURIER_LOAD_CAPACITY))],
+            [(day_time(hour=start), day_time(hour=start + 4))],
+        )
@@ -0,0 +1,166 @@
+"""
+The benchmark of the query of pending orders used by the assignment.
+"""
+
+import random
+import time
+from datetime import time as day_time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from delivery.models import (
+    COURIER_LOAD_CAPACITY, ORDER_WEIGHT_CONSTRAINTS,
+    AssignedOrderSet, Courier, DeliveryHours, Order, Region, WorkingHours,
+    get_hours_mask)
+
+
+POOL_INDEX_NAME = 'order_pending_pool_idx'
+
+
+class Rollback(Exception):
+    """
+    Raised to roll back the transaction of the benchmark data.
+    """
+
+
+class Command(BaseCommand):
+    """
+    Show the plan of the query of pending orders with and without
+    the partial index of the pool.
+
+    The orders are created in a transaction that is rolled back at the
+    end, so the database is left as it was. Most of the orders are
+    finished and only --pending of them are waiting for a courier,
+    like in a working service.
+    """
+
+    help = ('Show the plan of the query of pending orders with and '
+            'without the partial index of the pool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000,
+                            help='The number of orders in the table.')
+        parser.add_argument('--pending', type=float, default=0.01,
+                            help='The share of pending orders.')
+        parser.add_argument('--regions', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                courier = self._create_data(random.Random(options['seed']),
+                                            options)
+                # Fire the deferred checks of foreign keys, PostgreSQL
+                # doesn't change a table with pending trigger events
+                connection.check_constraints()
+                self._analyze()
+                index = self._get_pool_index()
+                # The schema editor isn't entered: SQLite doesn't allow it
+                # inside a transaction, the statements are run as is
+                schema_editor = connection.schema_editor()
+                self._execute(index.remove_sql(Order, schema_editor))
+                self._explain('Without the index', courier)
+                self._execute(index.create_sql(Order, schema_editor))
+                self._analyze()
+                self._explain('With the index', courier)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _create_data(self, rand, options) -> Courier:
+        """
+        Create the regions, the orders and the courier working
+        in 3 regions. Return the courier.
+        """
+
+        first_region_id = (Region.objects.aggregate(
+            max_id=models.Max('id'))['max_id'] or 0) + 1
+        region_ids = range(first_region_id,
+                           first_region_id + options['regions'])
+        Region.objects.bulk_create([Region(id=region_id)
+                                    for region_id in region_ids])
+
+        courier = Courier.objects.create(
+            courier_id=(Courier.objects.aggregate(
+                max_id=models.Max('courier_id'))['max_id'] or 0) + 1,
+            courier_type='car')
+        courier.regions.set(region_ids[:3])
+        WorkingHours.objects.create(
+            start=day_time(hour=9), end=day_time(hour=18), courier=courier)
+        courier.update_working_hours_mask()
+        order_set = AssignedOrderSet.objects.create(
+            courier=courier, courier_type=courier.courier_type)
+
+        first_order_id = (Order.objects.aggregate(
+            max_id=models.Max('order_id'))['max_id'] or 0) + 1
+        min_weight = int(ORDER_WEIGHT_CONSTRAINTS['min_value'] * 100) + 1
+        max_weight = int(COURIER_LOAD_CAPACITY['car'] * 100)
+        hours_mask = get_hours_mask([(day_time(hour=10), day_time(hour=12))])
+        complete_time = now()
+
+        start = time.perf_counter()
+        for batch_start in range(0, options['orders'], options['batch_size']):
+            orders = []
+            for order_id in range(
+                    first_order_id + batch_start,
+                    first_order_id + min(batch_start + options['batch_size'],
+                                         options['orders'])):
+                order = Order(
+                    order_id=order_id,
+                    weight=Decimal(rand.randint(min_weight, max_weight)) / 100,
+                    region_id=rand.choice(region_ids),
+                    delivery_hours_mask=hours_mask)
+                if rand.random() >= options['pending']:
+                    order.set_of_orders = order_set
+                    order.complete_time = complete_time
+                    order.status = 'finished'
+                orders.append(order)
+            Order.objects.bulk_create(orders)
+            DeliveryHours.objects.bulk_create([
+                DeliveryHours(start=day_time(hour=10), end=day_time(hour=12),
+                              order=order)
+                for order in orders if order.status == 'new'])
+        self.stdout.write('Created {} orders in {:.1f} s'.format(
+            options['orders'], time.perf_counter() - start))
+        return courier
+
+    def _get_pool_index(self) -> models.Index:
+        for index in Order._meta.indexes:
+            if index.name == POOL_INDEX_NAME:
+                return index
+        raise LookupError(f'The index {POOL_INDEX_NAME} is not found')
+
+    def _analyze(self):
+        """
+        Update the statistics of the planner.
+        """
+
+        self._execute('ANALYZE')
+
+    def _execute(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(str(sql))
+
+    def _explain(self, title, courier):
+        """
+        Print the plan of the query of find_matching_orders and
+        the time of the query.
+
+        The query is explained without the vectorized matching, which
+        returns the list of the matched orders instead.
+        """
+
+        with override_settings(ORDER_MATCHING_VECTORIZED=False):
+            orders = courier.find_matching_orders()
+        self.stdout.write(f'\n{title}:')
+        self.stdout.write(orders.explain())
+
+        start = time.perf_counter()
+        count = len(list(orders.values_list('order_id', flat=True)))
+        self.stdout.write('{} matching orders in {:.1f} ms'.format(
+            count, (time.perf_counter() - start) * 1000))
@@ -0,0 +1,328 @@
+"""
+The micro-benchmarks of the matching, the rating and the bulk
+serializers.
+"""
+
+import json
+import platform
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from delivery.dataset import generate_couriers, generate_orders, get_next_id
+from delivery.matching import get_numpy
+from delivery.middleware import QueryStats
+from delivery.models import (AssignedOrderSet, Courier, CourierRegionStats,
+                             Order, WorkingHours, get_hours_mask)
+from delivery.serializers import CourierItemPostSerializer, OrderSerializer
+
+
+# The regions of the generated orders, the couriers work in 3 of them
+REGIONS = 10
+COURIER_REGIONS = [1, 2, 3]
+COURIER_WORKING_HOURS = ['09:00-13:00', '15:00-19:00']
+
+# The orders of a finished set of the courier with the history
+FINISHED_SET_SIZE = 5
+
+# The slower results are regressions if they are slower by more than
+# this time too, the faster benchmarks are noisy
+MIN_REGRESSION_MS = 0.5
+
+
+def get_order_ids(orders):
+    """
+    Return the ids of the matched orders: a QuerySet, or a list with
+    the vectorized matching.
+    """
+
+    if isinstance(orders, models.QuerySet):
+        return list(orders.values_list('order_id', flat=True))
+    return [order.order_id for order in orders]
+
+
+class Rollback(Exception):
+    """
+    Raised to roll back the transaction of the benchmark data.
+    """
+
+
+class Command(BaseCommand):
+    """
+    Time the hot paths of the matching, the rating and the bulk
+    serializers on generated data of each size: the wall time and
+    the number of SQL queries.
+
+    The data are created in a transaction that is rolled back at
+    the end, and each run of a benchmark is rolled back to a savepoint,
+    so the runs see the same data. The first run warms up the caches
+    and isn't counted. The results are written to --output as JSON
+    and compared with the results of --baseline: the benchmarks that
+    make more queries or become slower by more than --threshold are
+    regressions, and the command fails if there are any.
+    """
+
+    help = ('Time the matching, the rating and the bulk serializers and '
+            'compare the results with the baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[100, 1000, 10000],
+                            help='The numbers of pending orders, finished '
+                                 'orders and posted items.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='The number of runs of each benchmark.')
+        parser.add_argument('--only', nargs='+', default=None,
+                            help='Run the benchmarks whose names start '
+                                 'with one of these prefixes.')
+        parser.add_argument('--output', help='The JSON file of the results.')
+        parser.add_argument('--baseline',
+                            help='The JSON file of the results to compare.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='The allowed slowdown against the baseline.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = {(result['name'], result['size']): result
+                            for result in json.load(file)['results']}
+
+        self.repeat = options['repeat']
+        results = []
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    self._create_data(random.Random(options['seed']), size)
+                    for name, function, setup in self._get_benchmarks(size):
+                        if options['only'] and not name.startswith(
+                                tuple(options['only'])):
+                            continue
+                        results.append({
+                            'name': name, 'size': size,
+                            **self._measure(name, function, setup)})
+                    raise Rollback
+            except Rollback:
+                pass
+
+        regressions = self._report(results, baseline, options['threshold'])
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump({
+                    'created': datetime.now().isoformat(timespec='seconds'),
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'repeat': self.repeat,
+                    'results': results,
+                }, file, indent=2)
+        if regressions:
+            raise CommandError(
+                f'Regressions against the baseline: {regressions}')
+
+    def _get_benchmarks(self, size):
+        """
+        Return (name, function, setup) of the benchmarks. The setup is
+        run before each run of the function and isn't timed.
+        """
+
+        pending_orders = Order.objects.filter(
+            set_of_orders=None, complete_time=None)
+        benchmarks = []
+        for courier in self.couriers.values():
+            benchmarks.append((
+                f'find_matching_orders[{courier.courier_type}]',
+                lambda courier=courier: get_order_ids(
+                    courier.find_matching_orders()),
+                None))
+        car_courier = self.couriers['car']
+
+        def filter_pending_orders():
+            return get_order_ids(
+                car_courier._filter_orders_by_delivery_hours(pending_orders))
+
+        benchmarks.append((
+            '_filter_orders_by_delivery_hours', filter_pending_orders, None))
+        try:
+            get_numpy()
+        except ImproperlyConfigured:
+            pass
+        else:
+            benchmarks.append((
+                '_filter_orders_by_delivery_hours[vectorized]',
+                self._vectorized(filter_pending_orders), None))
+
+        # The courier with the history of finished orders
+        bike_courier = self.couriers['bike']
+        benchmarks += [
+            ('Courier.rating', lambda: bike_courier.rating, None),
+            ('Courier.earnings', lambda: bike_courier.earnings, None),
+            ('Courier.get_rating_and_earnings',
+             bike_courier.get_rating_and_earnings, None),
+        ]
+
+        # The courier changes his working hours, so a part of his not
+        # started orders become unsuitable
+        benchmarks.append((
+            'remove_unsuitable_orders', car_courier.remove_unsuitable_orders,
+            lambda: self._change_working_hours(car_courier, ['18:00-19:00'])))
+
+        orders = generate_orders(random.Random(size), get_next_id(
+            Order, 'order_id'), size, REGIONS)
+        couriers = generate_couriers(random.Random(size), get_next_id(
+            Courier, 'courier_id'), size, REGIONS)
+        benchmarks += [
+            ('OrderSerializer[many]',
+             lambda: self._save(OrderSerializer, orders), None),
+            ('CourierItemPostSerializer[many]',
+             lambda: self._save(CourierItemPostSerializer, couriers), None),
+        ]
+        return benchmarks
+
+    def _measure(self, name, function, setup=None):
+        """
+        Run the function repeat + 1 times and return the median and
+        the minimum of the wall time and the number of queries.
+
+        The runs see the same data, so they have to make the same
+        number of queries, otherwise the benchmark is broken.
+        """
+
+        durations = []
+        query_counts = []
+        for _ in range(self.repeat + 1):
+            stats = QueryStats()
+            try:
+                with transaction.atomic():
+                    if setup is not None:
+                        setup()
+                    with connection.execute_wrapper(stats):
+                        start = time.perf_counter()
+                        function()
+                        durations.append(time.perf_counter() - start)
+                    query_counts.append(stats.count)
+                    raise Rollback
+            except Rollback:
+                pass
+
+        # Skip the warm-up run
+        durations = durations[1:]
+        query_counts = query_counts[1:]
+        if len(set(query_counts)) > 1:
+            raise CommandError(
+                f'The runs of {name} make different numbers of queries: '
+                f'{query_counts}')
+        return {
+            'median_ms': round(statistics.median(durations) * 1000, 3),
+            'min_ms': round(min(durations) * 1000, 3),
+            'queries': query_counts[0],
+        }
+
+    def _report(self, results, baseline, threshold) -> int:
+        """
+        Print the results and their changes against the baseline.
+        Return the number of regressions.
+        """
+
+        self.stdout.write(
+            f"{'benchmark':<46}{'size':>7}{'median ms':>11}{'min ms':>10}"
+            f"{'queries':>9}{'baseline':>10}")
+        regressions = 0
+        for result in results:
+            line = (f"{result['name']:<46}{result['size']:>7}"
+                    f"{result['median_ms']:>11.2f}{result['min_ms']:>10.2f}"
+                    f"{result['queries']:>9}")
+            base = (baseline or {}).get((result['name'], result['size']))
+            if base is not None:
+                change = (result['median_ms'] / base['median_ms'] - 1
+                          if base['median_ms'] else 0)
+                line += f'{change:>+10.0%}'
+                if (result['queries'] > base['queries']
+                        or (change > threshold
+                            and result['median_ms'] - base['median_ms']
+                            > MIN_REGRESSION_MS)):
+                    regressions += 1
+                    line += '  REGRESSION'
+                    if result['queries'] > base['queries']:
+                        line += f" (queries: {base['queries']})"
+            self.stdout.write(line)
+        return regressions
+
+    def _create_data(self, rand, size):
+        """
+        Create the couriers of each type, the pending orders, the history
+        of finished orders of the bike courier and the current set of
+        orders of the car courier.
+        """
+
+        first_id = get_next_id(Courier, 'courier_id')
+        self._save(CourierItemPostSerializer, [
+            {'courier_id': first_id + index, 'courier_type': courier_type,
+             'regions': COURIER_REGIONS,
+             'working_hours': COURIER_WORKING_HOURS}
+            for index, courier_type in enumerate(['foot', 'bike', 'car'])
+        ])
+        self.couriers = {courier.courier_type: courier
+                         for courier in Courier.objects.filter(
+                             courier_id__gte=first_id)}
+
+        # The finished orders are assigned in sets and completed in
+        # the order of the sets
+        orders = self._save(OrderSerializer, [
+            {**order, 'region': rand.choice(COURIER_REGIONS)}
+            for order in generate_orders(
+                rand, get_next_id(Order, 'order_id'), size, REGIONS)])
+        courier = self.couriers['bike']
+        assign_time = now() - timedelta(days=365)
+        for index in range(0, len(orders), FINISHED_SET_SIZE):
+            order_set = AssignedOrderSet.objects.create(
+                courier=courier, courier_type=courier.courier_type)
+            # assign_time is set to now() on the creation
+            AssignedOrderSet.objects.filter(pk=order_set.pk).update(
+                assign_time=assign_time)
+            complete_time = assign_time
+            for order in orders[index:index + FINISHED_SET_SIZE]:
+                complete_time += timedelta(minutes=rand.randint(5, 60))
+                order.set_of_orders = order_set
+                order.status = 'finished'
+                order.complete_time = complete_time
+            assign_time = complete_time
+        Order.objects.bulk_update(
+            orders, ['set_of_orders', 'status', 'complete_time'],
+            batch_size=1000)
+        CourierRegionStats.objects.rebuild(courier)
+
+        self._save(OrderSerializer, generate_orders(
+            rand, get_next_id(Order, 'order_id'), size, REGIONS))
+        self.couriers['car'].assign_orders()
+
+    def _change_working_hours(self, courier, working_hours):
+        courier.working_hours.all().delete()
+        WorkingHours.objects.bulk_create([
+            WorkingHours(courier=courier, start=start, end=end)
+            for start, end in (
+                (datetime.strptime(value, '%H:%M').time()
+                 for value in interval.split('-'))
+                for interval in working_hours)
+        ])
+        courier.working_hours_mask = get_hours_mask(
+            courier.working_hours.values_list('start', 'end'))
+        courier.save(update_fields=['working_hours_mask'])
+
+    def _vectorized(self, function):
+        def vectorized_function():
+            with override_settings(ORDER_MATCHING_VECTORIZED=True):
+                return function()
+        return vectorized_function
+
+    def _save(self, serializer_class, data):
+        serializer = serializer_class(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
@@ -0,0 +1,75 @@
+"""
+The generator of the synthetic dataset for the load tests.
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from delivery.dataset import generate_couriers, generate_orders, get_next_id
+from delivery.models import Courier, Order, Region
+from delivery.serializers import CourierItemPostSerializer, OrderSerializer
+
+
+class Command(BaseCommand):
+    """
+    Create the couriers and the orders generated from the seed.
+
+    The data are saved with the serializers of the API, like they are
+    posted by the clients. The ids continue after the existing ones,
+    or the existing data are deleted with --flush, so the same seed
+    gives the same dataset. The running server has to be restarted if
+    it keeps the pool of pending orders in memory.
+    """
+
+    help = 'Create the synthetic couriers and orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--couriers', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--regions', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete the couriers, the orders and '
+                                 'the regions before.')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            with transaction.atomic():
+                Courier.objects.all().delete()
+                Region.objects.all().delete()
+
+        rand = random.Random(options['seed'])
+        start = time.perf_counter()
+        first_id = get_next_id(Courier, 'courier_id')
+        self._save(CourierItemPostSerializer, generate_couriers(
+            rand, first_id, options['couriers'], options['regions']),
+            options['batch_size'])
+        self.stdout.write('Created {} couriers in {:.1f} s'.format(
+            options['couriers'], time.perf_counter() - start))
+
+        start = time.perf_counter()
+        first_id = get_next_id(Order, 'order_id')
+        self._save(OrderSerializer, generate_orders(
+            rand, first_id, options['orders'], options['regions']),
+            options['batch_size'])
+        self.stdout.write('Created {} orders in {:.1f} s'.format(
+            options['orders'], time.perf_counter() - start))
+
+    def _save(self, serializer_class, data, batch_size):
+        """
+        Validate and save the data in batches.
+        """
+
+        for index in range(0, len(data), batch_size):
+            serializer = serializer_class(
+                data=data[index:index + batch_size], many=True)
+            if not serializer.is_valid():
+                errors = [error for error in serializer.errors if error]
+                raise CommandError(
+                    f'The generated data are not valid: {errors}')
+            with transaction.atomic():
+                serializer.save()
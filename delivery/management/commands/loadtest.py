@@ -0,0 +1,277 @@
+"""
+The load test of the running service.
+"""
+
+import http.client
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from delivery.dataset import (generate_couriers, generate_orders,
+                              generate_working_hours, get_next_id)
+from delivery.models import Courier, Order
+
+
+# The share of each operation in the requests
+DEFAULT_MIX = {
+    'assign': 30,
+    'complete': 25,
+    'courier-get': 20,
+    'courier-patch': 5,
+    'orders': 15,
+    'couriers': 5,
+}
+
+# The maximum number of orders posted in one request
+ORDERS_BATCH_SIZE = 10
+
+
+def parse_mix(value: str) -> Dict[str, int]:
+    """
+    Parse the mix of operations in format 'assign=30,complete=25,...'.
+    """
+
+    mix = {}
+    for item in value.split(','):
+        operation, _, weight = item.partition('=')
+        if operation not in DEFAULT_MIX or not weight.isdigit():
+            raise ValueError(f'Invalid item of the mix: {item!r}')
+        mix[operation] = int(weight)
+    return mix
+
+
+def get_percentile(sorted_values: List[float], percent: float) -> float:
+    """
+    Return the percentile of the sorted values with the nearest rank.
+    """
+
+    rank = max(round(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class LoadTest:
+    """
+    The requests of the load test and their results.
+
+    The state is shared by the threads: the ids of the couriers,
+    the assigned orders waiting for completion and the next ids of
+    the created couriers and orders.
+    """
+
+    def __init__(self, url, regions):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise CommandError(f'Invalid URL: {url}')
+        self.connection_class = (http.client.HTTPSConnection
+                                 if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.regions = regions
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.courier_ids = list(Courier.objects.values_list(
+            'courier_id', flat=True))
+        if not self.courier_ids:
+            raise CommandError(
+                'There are no couriers, create them with generate_dataset')
+        self.assigned_orders = list(Order.objects.filter(
+            status='assigned',
+        ).values_list('set_of_orders__courier_id', 'order_id'))
+        self.queued_order_ids = {order_id for _, order_id
+                                 in self.assigned_orders}
+        self.next_ids = {
+            'courier': get_next_id(Courier, 'courier_id'),
+            'order': get_next_id(Order, 'order_id'),
+        }
+
+        self.durations = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def take_ids(self, name, count) -> int:
+        """
+        Reserve count ids of the new couriers or orders, return the first.
+        """
+
+        with self.lock:
+            first_id = self.next_ids[name]
+            self.next_ids[name] += count
+        return first_id
+
+    def request(self, operation, method, path,
+                data=None) -> Tuple[object, Optional[dict]]:
+        """
+        Send the request with the connection of the thread and record
+        its duration and status. Return the status and the data of
+        the response.
+        """
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(
+                self.host, timeout=60)
+
+        body = None if data is None else json.dumps(data)
+        headers = {'Content-Type': 'application/json'} if body else {}
+        start = time.perf_counter()
+        try:
+            connection.request(method, self.prefix + path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            # The connection is opened again by the next request
+            connection.close()
+            self.local.connection = None
+            content = b''
+            status = 'error'
+        duration = time.perf_counter() - start
+
+        with self.lock:
+            self.durations[operation].append(duration)
+            self.statuses[operation][status] += 1
+        if status in (200, 201) and content:
+            return status, json.loads(content)
+        return status, None
+
+    def run(self, operation, seed):
+        """
+        Send the request of the operation, its data are generated
+        from the seed.
+        """
+
+        rand = random.Random(seed)
+        if operation == 'complete':
+            with self.lock:
+                if self.assigned_orders:
+                    courier_id, order_id = self.assigned_orders.pop(
+                        rand.randrange(len(self.assigned_orders)))
+                else:
+                    courier_id = None
+            if courier_id is None:
+                # There is nothing to complete yet
+                operation = 'assign'
+            else:
+                self.request('complete', 'POST', '/orders/complete', {
+                    'courier_id': courier_id,
+                    'order_id': order_id,
+                    'complete_time': now().isoformat(),
+                })
+                return
+
+        if operation == 'assign':
+            courier_id = rand.choice(self.courier_ids)
+            _, data = self.request('assign', 'POST', '/orders/assign',
+                                   {'courier_id': courier_id})
+            if data:
+                # The not completed orders of the set are returned
+                # again, they are queued once
+                with self.lock:
+                    for order in data['orders']:
+                        if order['id'] not in self.queued_order_ids:
+                            self.queued_order_ids.add(order['id'])
+                            self.assigned_orders.append(
+                                (courier_id, order['id']))
+        elif operation == 'courier-get':
+            self.request('courier-get', 'GET',
+                         f'/couriers/{rand.choice(self.courier_ids)}')
+        elif operation == 'courier-patch':
+            self.request('courier-patch', 'PATCH',
+                         f'/couriers/{rand.choice(self.courier_ids)}',
+                         {'working_hours': generate_working_hours(rand)})
+        elif operation == 'orders':
+            count = rand.randint(1, ORDERS_BATCH_SIZE)
+            self.request('orders', 'POST', '/orders', {'data': generate_orders(
+                rand, self.take_ids('order', count), count, self.regions)})
+        elif operation == 'couriers':
+            couriers = generate_couriers(
+                rand, self.take_ids('courier', 1), 1, self.regions)
+            status, _ = self.request('couriers', 'POST', '/couriers',
+                                     {'data': couriers})
+            if status == 201:
+                with self.lock:
+                    self.courier_ids.append(couriers[0]['courier_id'])
+
+
+class Command(BaseCommand):
+    """
+    Send a mix of requests to the running service from --concurrency
+    threads and report the latency percentiles of each operation and
+    the throughput.
+
+    The couriers and the assigned orders are read from the database of
+    the settings, so it has to be the database of the service (see
+    generate_dataset). The operations and their data are generated
+    from the seed: the assignment to a random courier, the completion
+    of an order assigned during the test, getting and patching
+    a courier, posting new orders and new couriers.
+    """
+
+    help = 'Send a mix of requests to the service and report the latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='The URL of the service.')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help="The weights of the operations, "
+                                 "e.g. 'assign=30,complete=25,courier-get=20,"
+                                 "courier-patch=5,orders=15,couriers=5'.")
+        parser.add_argument('--regions', type=int, default=50,
+                            help='The regions of the new orders and couriers.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        load_test = LoadTest(options['url'], options['regions'])
+        rand = random.Random(options['seed'])
+        operations = rand.choices(list(options['mix']),
+                                  weights=list(options['mix'].values()),
+                                  k=options['requests'])
+        seeds = [rand.getrandbits(32) for _ in operations]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            # Raise the exceptions of the threads
+            for _ in executor.map(load_test.run, operations, seeds):
+                pass
+        elapsed = time.perf_counter() - start
+
+        self.report(load_test, elapsed)
+
+    def report(self, load_test, elapsed):
+        self.stdout.write(
+            f"{'operation':<15}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'p99 ms':>9}  statuses")
+        all_durations = []
+        for operation in DEFAULT_MIX:
+            durations = sorted(load_test.durations.get(operation, []))
+            if not durations:
+                continue
+            all_durations.extend(durations)
+            statuses = ' '.join(
+                f'{status}:{count}' for status, count
+                in sorted(load_test.statuses[operation].items(), key=str))
+            self.stdout.write(self._format_row(operation, durations)
+                              + f'  {statuses}')
+
+        if not all_durations:
+            return
+        all_durations.sort()
+        self.stdout.write(self._format_row('total', all_durations))
+        self.stdout.write('{} requests in {:.1f} s, {:.1f} requests/s'.format(
+            len(all_durations), elapsed, len(all_durations) / elapsed))
+
+    def _format_row(self, operation, durations):
+        return (f'{operation:<15}{len(durations):>9}'
+                + ''.join(f'{get_percentile(durations, percent) * 1000:>9.1f}'
+                          for percent in (50, 95, 99)))
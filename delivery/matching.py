@@ -0,0 +1,186 @@
+"""
+The vectorized matching of orders with couriers.
+
+The candidate orders are loaded as columns: ids, weights, regions and
+the delivery windows in minutes of a day. The orders matching a courier
+are found with NumPy array operations, the intersections of delivery
+windows and working hours are computed by broadcasting.
+
+It's enabled with settings.ORDER_MATCHING_VECTORIZED. NumPy is an
+optional dependency and is imported on the first use.
+"""
+
+from datetime import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+def get_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImproperlyConfigured(
+            'The vectorized matching of orders requires NumPy, '
+            'install it with: pip install numpy')
+    return numpy
+
+
+def get_hundredths(weights):
+    """
+    Return the weights as integer numbers of hundredths of kg.
+    """
+
+    np = get_numpy()
+    return np.rint(np.asarray(weights, dtype=float) * 100).astype(np.int64)
+
+
+def get_minutes_intervals(
+        intervals: Iterable[Tuple[time, time]]) -> List[Tuple[int, int]]:
+    """
+    Return the not empty intervals as [start, end) minutes of a day.
+
+    An interval with start > end passes midnight and is split in two,
+    like in get_hours_mask.
+    """
+
+    from .models import MINUTES_IN_DAY
+
+    minutes_intervals = []
+    for start, end in intervals:
+        start = start.hour * 60 + start.minute
+        end = end.hour * 60 + end.minute
+        if start > end:
+            minutes_intervals.append((start, MINUTES_IN_DAY))
+            start = 0
+        if start < end:
+            minutes_intervals.append((start, end))
+    return minutes_intervals
+
+
+class OrderColumns:
+    """
+    The candidate orders as columnar arrays.
+
+    The orders are kept sorted by order_id. Each delivery window refers
+    to its order by the position in the arrays of orders. The orders
+    that are taken are skipped by the next matches.
+    """
+
+    def __init__(self, orders: Sequence, region_ids: Sequence[int],
+                 windows: Iterable[Tuple[int, time, time]]):
+        """
+        Get: orders: the objects having order_id and weight,
+             region_ids: the region ids of the orders,
+             windows: (order_id, start, end) of delivery hours.
+        """
+
+        from .models import MINUTES_IN_DAY
+
+        np = get_numpy()
+
+        order_ids = np.array([order.order_id for order in orders],
+                             dtype=np.int64)
+        positions = np.argsort(order_ids)
+        self.orders = [orders[position] for position in positions]
+        self.order_ids = order_ids[positions]
+        # The weights are compared in hundredths of kg, like in
+        # the strategies of packing
+        self.weights = get_hundredths(
+            np.array([float(order.weight) for order in self.orders]))
+        self.region_ids = np.array(region_ids, dtype=np.int64)[positions]
+        self.taken = np.zeros(len(self.orders), dtype=bool)
+
+        windows = list(windows)
+        window_order_ids = np.array([order_id for order_id, _, _ in windows],
+                                    dtype=np.int64)
+        starts = np.array([start.hour * 60 + start.minute
+                           for _, start, _ in windows], dtype=np.int16)
+        ends = np.array([end.hour * 60 + end.minute
+                         for _, _, end in windows], dtype=np.int16)
+        # The windows passing midnight are split in two
+        passing = starts > ends
+        window_order_ids = np.concatenate(
+            [window_order_ids, window_order_ids[passing]])
+        starts = np.concatenate(
+            [starts, np.zeros(passing.sum(), dtype=np.int16)])
+        ends = np.concatenate(
+            [np.where(passing, MINUTES_IN_DAY, ends), ends[passing]])
+
+        # Drop the empty windows and the windows of the orders that
+        # aren't loaded
+        window_orders = np.searchsorted(self.order_ids, window_order_ids)
+        known = (window_orders < len(self.order_ids)) & (starts < ends)
+        known[known] = (
+            self.order_ids[window_orders[known]] == window_order_ids[known])
+        self.window_orders = window_orders[known]
+        self.window_starts = starts[known]
+        self.window_ends = ends[known].astype(np.int16)
+
+    def __len__(self):
+        return len(self.orders)
+
+    @classmethod
+    def from_queryset(cls, orders) -> 'OrderColumns':
+        """
+        Load the orders of the queryset and their delivery hours
+        with 2 queries.
+        """
+
+        from .models import DeliveryHours
+
+        windows = DeliveryHours.objects.filter(
+            order__in=orders.order_by().values('pk'),
+        ).values_list('order', 'start', 'end').order_by()
+        # set_of_orders isn't deferred: it's read for each order loaded
+        # by the related manager of the set of orders
+        orders = list(orders.only(
+            'order_id', 'weight', 'region', 'set_of_orders'))
+        return cls(orders, [order.region_id for order in orders], windows)
+
+    def match(self, working_hours: Iterable[Tuple[time, time]],
+              region_ids: Optional[Iterable[int]] = None,
+              capacity=None) -> list:
+        """
+        Return the orders that aren't taken and have delivery hours
+        intersecting the working hours. If the regions or the load
+        capacity are given, the orders have to be in the regions and
+        fit the load capacity.
+        """
+
+        np = get_numpy()
+
+        candidates = ~self.taken
+        if region_ids is not None:
+            candidates &= np.isin(
+                self.region_ids, np.fromiter(region_ids, dtype=np.int64))
+        if capacity is not None:
+            candidates &= self.weights <= get_hundredths(float(capacity))
+
+        windows = candidates[self.window_orders]
+        starts = self.window_starts[windows]
+        ends = self.window_ends[windows]
+        working_intervals = np.array(
+            get_minutes_intervals(working_hours), dtype=np.int16,
+        ).reshape(-1, 2)
+        # The window and the working hours have at least 1 common minute:
+        # the windows are the rows, the working hours are the columns
+        intersects = (
+            (starts[:, np.newaxis] < working_intervals[:, 1])
+            & (working_intervals[:, 0] < ends[:, np.newaxis])
+        ).any(axis=1)
+
+        matched = np.zeros(len(self.orders), dtype=bool)
+        matched[self.window_orders[windows][intersects]] = True
+        return [self.orders[position] for position in np.flatnonzero(matched)]
+
+    def take(self, orders: Iterable):
+        """
+        Skip the orders in the next matches.
+        """
+
+        np = get_numpy()
+
+        order_ids = np.array([order.order_id for order in orders],
+                             dtype=np.int64)
+        self.taken[np.searchsorted(self.order_ids, order_ids)] = True
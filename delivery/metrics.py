@@ -0,0 +1,157 @@
+"""
+The Prometheus metrics of the application.
+
+The metrics are collected with settings.METRICS_ENABLED and exposed
+at /metrics in the text format of Prometheus:
+
+- delivery_request_duration_seconds: the latency of the requests by
+  the URL name of the view and the method;
+- delivery_db_duration_seconds: the time of the SQL queries of
+  the requests;
+- delivery_serializer_duration_seconds: the time of the validation and
+  the representation of the data by the serializers;
+- delivery_orders_assigned_total, delivery_orders_completed_total:
+  the committed assignments and completions of orders;
+- delivery_pending_orders: the orders that aren't assigned and aren't
+  completed, it's counted on each scrape;
+- delivery_courier_cache_hits_total, delivery_courier_cache_misses_total:
+  the hits and the misses of the cache of the courier details (see
+  delivery/cache.py).
+
+The serializer time is collected with delivery/timing.py, and
+the orders and the requests of the cache are counted by the signals
+of the models and the cache, so they don't import prometheus_client.
+The receivers are connected when the application is ready (see
+apps.py).
+
+Under gunicorn every worker has its own metrics. If the environment
+variable PROMETHEUS_MULTIPROC_DIR is set, the workers write them to
+the files of that directory and the endpoint aggregates them across
+all the workers (see gunicorn.conf.py).
+"""
+
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+
+from .signals import (courier_cache_requested, orders_assigned,
+                      orders_completed)
+
+
+# The requests of the API take milliseconds, so the buckets are finer
+# than the default ones
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = CollectorRegistry()
+
+REQUEST_DURATION = Histogram(
+    'delivery_request_duration_seconds',
+    'The latency of the requests.',
+    ['view', 'method'], buckets=DURATION_BUCKETS, registry=registry)
+DB_DURATION = Histogram(
+    'delivery_db_duration_seconds',
+    'The time of the SQL queries of the requests.',
+    ['view', 'method'], buckets=DURATION_BUCKETS, registry=registry)
+SERIALIZER_DURATION = Histogram(
+    'delivery_serializer_duration_seconds',
+    'The time of the serializers of the requests.',
+    ['view', 'method'], buckets=DURATION_BUCKETS, registry=registry)
+ORDERS_ASSIGNED = Counter(
+    'delivery_orders_assigned',
+    'The orders assigned to the couriers.', registry=registry)
+ORDERS_COMPLETED = Counter(
+    'delivery_orders_completed',
+    'The orders completed by the couriers.', registry=registry)
+COURIER_CACHE_HITS = Counter(
+    'delivery_courier_cache_hits',
+    'The requests of the courier details found in the cache.',
+    registry=registry)
+COURIER_CACHE_MISSES = Counter(
+    'delivery_courier_cache_misses',
+    'The requests of the courier details not found in the cache.',
+    registry=registry)
+
+
+class PendingOrdersCollector:
+    """
+    Count the pending orders on each scrape. The count is read from
+    the database, so it's the same whatever worker is scraped.
+    """
+
+    def collect(self):
+        from .models import Order
+
+        yield GaugeMetricFamily(
+            'delivery_pending_orders',
+            'The orders that are not assigned and not completed.',
+            value=Order.objects.filter(
+                set_of_orders=None, complete_time=None).count())
+
+
+registry.register(PendingOrdersCollector())
+
+
+@receiver(orders_assigned)
+def count_assigned_orders(sender, count: int, **kwargs):
+    """
+    Count the assigned orders after the commit of the current
+    transaction.
+    """
+
+    if settings.METRICS_ENABLED and count:
+        transaction.on_commit(lambda: ORDERS_ASSIGNED.inc(count))
+
+
+@receiver(orders_completed)
+def count_completed_orders(sender, count: int, **kwargs):
+    """
+    Count the completed orders after the commit of the current
+    transaction.
+    """
+
+    if settings.METRICS_ENABLED and count:
+        transaction.on_commit(lambda: ORDERS_COMPLETED.inc(count))
+
+
+@receiver(courier_cache_requested)
+def count_courier_cache_request(sender, hit: bool, **kwargs):
+    """
+    Count the hit or the miss of the courier cache.
+    """
+
+    if settings.METRICS_ENABLED:
+        (COURIER_CACHE_HITS if hit else COURIER_CACHE_MISSES).inc()
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    Return the registry with the metrics of the process, or of all
+    the processes in the multiprocess mode.
+    """
+
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return registry
+
+    multiprocess_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(multiprocess_registry)
+    multiprocess_registry.register(PendingOrdersCollector())
+    return multiprocess_registry
+
+
+def metrics_view(request):
+    """
+    Return the metrics in the text format of Prometheus.
+    """
+
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(generate_latest(get_registry()),
+                        content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,235 @@
+"""
+The middleware of the application.
+"""
+
+import cProfile
+import logging
+import os
+import random
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.crypto import constant_time_compare
+
+from .metrics import DB_DURATION, REQUEST_DURATION, SERIALIZER_DURATION
+from .timing import measure_serializers
+
+
+logger = logging.getLogger('delivery.queries')
+
+# The slowest statement is cut to this length in the log
+SLOWEST_SQL_LENGTH = 200
+
+# The request header asking to profile the request
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class QueryStats:
+    """
+    The execute wrapper counting the queries of the request, their
+    total time and the slowest of them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if self.slowest_sql is None or duration > self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+    def get_server_timing(self) -> str:
+        """
+        Return the value of Server-Timing header, the durations are
+        in milliseconds.
+        """
+
+        return (f'db;desc="{self.count} queries";'
+                f'dur={self.duration * 1000:.2f}, '
+                f'db-slowest;dur={self.slowest_duration * 1000:.2f}')
+
+
+class QueryStatsMiddleware:
+    """
+    Record the number of SQL queries of the request, their total time
+    and the slowest statement.
+
+    They are sent in Server-Timing header of the response and logged
+    to 'delivery.queries' logger. It's enabled with
+    settings.QUERY_STATS_ENABLED, otherwise the middleware is removed
+    from the chain at the start.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_STATS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+
+        server_timing = stats.get_server_timing()
+        if response.has_header('Server-Timing'):
+            server_timing = f"{response['Server-Timing']}, {server_timing}"
+        response['Server-Timing'] = server_timing
+
+        query_stats = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 2),
+            'slowest_ms': round(stats.slowest_duration * 1000, 2),
+            'slowest_sql': (stats.slowest_sql or '')[:SLOWEST_SQL_LENGTH],
+        }
+        logger.info(
+            ' '.join(f'{key}={value!r}' if key == 'slowest_sql'
+                     else f'{key}={value}'
+                     for key, value in query_stats.items()),
+            extra={'query_stats': query_stats})
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Observe the latency of the request, the time of its SQL queries
+    and of its serializers in the histograms of delivery/metrics.py,
+    labeled by the URL name of the view.
+
+    It's enabled with settings.METRICS_ENABLED, otherwise the middleware
+    is removed from the chain at the start.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            serializer_timer = stack.enter_context(measure_serializers())
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        view = get_view_name(request)
+        REQUEST_DURATION.labels(view, request.method).observe(duration)
+        DB_DURATION.labels(view, request.method).observe(stats.duration)
+        SERIALIZER_DURATION.labels(view, request.method).observe(
+            serializer_timer.duration)
+        return response
+
+
+def get_view_name(request) -> str:
+    """
+    Return the URL name of the view of the request, the requests not
+    matching any URL are named 'unknown'.
+    """
+
+    resolver_match = request.resolver_match
+    if resolver_match is None:
+        return 'unknown'
+    return resolver_match.url_name or resolver_match.view_name
+
+
+class ProfilingMiddleware:
+    """
+    Profile 1 in settings.PROFILING_SAMPLE_RATE requests, and the
+    requests with X-Profile header, with cProfile. The header is
+    honoured only with settings.DEBUG or if it's equal to
+    settings.PROFILING_SECRET, so the clients can't force profiling.
+
+    The statistics are dumped to settings.PROFILING_DIR, one .pstats
+    file for a request named by the URL name of its view, and the name
+    of the file is sent in X-Profile header of the response. The oldest
+    files are removed when the files take more than
+    settings.PROFILING_MAX_SIZE bytes. The middleware is removed from
+    the chain at the start if PROFILING_DIR isn't set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_DIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.directory = settings.PROFILING_DIR
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.max_size = settings.PROFILING_MAX_SIZE
+        self.debug = settings.DEBUG
+        self.secret = settings.PROFILING_SECRET
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        if not self.is_sampled(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - start
+
+        filename = (f'{get_view_name(request)}'
+                    f'.{datetime.now():%Y%m%dT%H%M%S%f}.{os.getpid()}'
+                    f'.{duration * 1000:.0f}ms.pstats')
+        profiler.dump_stats(os.path.join(self.directory, filename))
+        self.remove_old_profiles()
+        response['X-Profile'] = filename
+        return response
+
+    def is_sampled(self, request) -> bool:
+        """
+        Check if the request is profiled.
+        """
+
+        header = request.META.get(PROFILE_HEADER)
+        if header and (self.debug or self.secret and constant_time_compare(
+                header, self.secret)):
+            return True
+        return self.sample_rate > 0 and random.randrange(self.sample_rate) == 0
+
+    def remove_old_profiles(self):
+        """
+        Remove the oldest profiles until the rest fit PROFILING_MAX_SIZE.
+        """
+
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pstats') and entry.is_file():
+                stat = entry.stat()
+                profiles.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in profiles)
+        profiles.sort()
+        for _, size, path in profiles:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # It's removed by another worker
+                pass
+            total_size -= size
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.7 on 2026-10-16 23:12
+
+from django.db import migrations, models
+
+
+MINUTES_IN_DAY = 24 * 60
+HOURS_MASK_LENGTH = MINUTES_IN_DAY // 8
+
+
+def get_hours_mask(intervals):
+    """
+    Return the minute-of-day mask of given time intervals.
+
+    The copy of delivery.models.get_hours_mask at the time of
+    the migration.
+    """
+
+    mask = 0
+    for start, end in intervals:
+        start = start.hour * 60 + start.minute
+        end = end.hour * 60 + end.minute
+        if start <= end:
+            mask |= ((1 << (end - start)) - 1) << start
+        else:
+            mask |= ((1 << (MINUTES_IN_DAY - start)) - 1) << start
+            mask |= (1 << end) - 1
+    return mask.to_bytes(HOURS_MASK_LENGTH, 'big')
+
+
+def fill_hours_masks(apps, schema_editor):
+    """
+    Calculate the hours masks of existing couriers and orders.
+    """
+
+    Courier = apps.get_model('delivery', 'Courier')
+    Order = apps.get_model('delivery', 'Order')
+
+    for courier in Courier.objects.prefetch_related('working_hours'):
+        courier.working_hours_mask = get_hours_mask(
+            (item.start, item.end) for item in courier.working_hours.all())
+        courier.save(update_fields=['working_hours_mask'])
+
+    for order in Order.objects.prefetch_related('delivery_hours'):
+        order.delivery_hours_mask = get_hours_mask(
+            (item.start, item.end) for item in order.delivery_hours.all())
+        order.save(update_fields=['delivery_hours_mask'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0005_auto_20210327_1620'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='working_hours_mask',
+            field=models.BinaryField(default=bytes(180), max_length=180),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_hours_mask',
+            field=models.BinaryField(default=bytes(180), max_length=180),
+        ),
+        migrations.RunPython(fill_hours_masks, migrations.RunPython.noop),
+    ]
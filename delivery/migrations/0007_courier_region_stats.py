@@ -0,0 +1,96 @@
+# Generated by Django 3.1.7 on 2026-10-16 23:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+RATE_OF_PAYMENT = {
+    'foot': 2,
+    'bike': 5,
+    'car': 9,
+}
+BASE_PAYMENT = 500
+
+
+def summarize_finished_orders(orders):
+    """
+    Calculate the fields of CourierRegionStats for finished orders:
+    {region_id: {field: value}}.
+
+    The copy of delivery.models.summarize_finished_orders at the time
+    of the migration. The orders are added in order of completion, so
+    the delivery time of each order is counted from the complete time
+    of the previous one, of the first order - from the assign time.
+    """
+
+    region_stats = {}
+    for region_id, complete_time, assign_time, courier_type in sorted(
+            orders, key=lambda order: order[1]):
+        stats = region_stats.get(region_id)
+        if stats is None:
+            stats = region_stats[region_id] = {
+                'orders_count': 0,
+                'first_complete_time': complete_time,
+                'last_complete_time': complete_time,
+                'delivery_time_sum': complete_time - assign_time,
+                'earnings': 0,
+            }
+        else:
+            stats['delivery_time_sum'] += (
+                complete_time - stats['last_complete_time'])
+            stats['last_complete_time'] = complete_time
+        stats['orders_count'] += 1
+        stats['earnings'] += BASE_PAYMENT * RATE_OF_PAYMENT[courier_type]
+    return region_stats
+
+
+def fill_courier_region_stats(apps, schema_editor):
+    """
+    Calculate the statistics of couriers from their finished orders.
+    """
+
+    Courier = apps.get_model('delivery', 'Courier')
+    Order = apps.get_model('delivery', 'Order')
+    CourierRegionStats = apps.get_model('delivery', 'CourierRegionStats')
+
+    for courier in Courier.objects.all():
+        orders = Order.objects.filter(
+            complete_time__isnull=False, set_of_orders__courier=courier,
+        ).values_list('region', 'complete_time', 'set_of_orders__assign_time',
+                      'set_of_orders__courier_type')
+        CourierRegionStats.objects.bulk_create([
+            CourierRegionStats(courier=courier, region_id=region_id, **values)
+            for region_id, values in summarize_finished_orders(orders).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0006_hours_masks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierRegionStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('first_complete_time', models.DateTimeField(blank=True, null=True)),
+                ('last_complete_time', models.DateTimeField(blank=True, null=True)),
+                ('delivery_time_sum', models.DurationField(blank=True, null=True)),
+                ('earnings', models.PositiveIntegerField(default=0)),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_stats', to='delivery.courier')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='delivery.region')),
+            ],
+            options={
+                'ordering': ['courier', 'region'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='courierregionstats',
+            constraint=models.UniqueConstraint(fields=('courier', 'region'), name='unique_courier_region_stats'),
+        ),
+        migrations.RunPython(fill_courier_region_stats,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.7 on 2026-10-16 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0007_courier_region_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignedorderset',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='courier',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 3.1.7 on 2026-10-16 23:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_order_statuses(apps, schema_editor):
+    """
+    Set the statuses of existing orders from the notstarted_orders and
+    finished_orders tables of their sets.
+    """
+
+    Order = apps.get_model('delivery', 'Order')
+    AssignedOrderSet = apps.get_model('delivery', 'AssignedOrderSet')
+
+    for status, field in (('finished', 'finished_orders'),
+                          ('assigned', 'notstarted_orders')):
+        through = getattr(AssignedOrderSet, field).through
+        Order.objects.filter(
+            status='new',
+            set_of_orders__isnull=False,
+        ).filter(models.Exists(through.objects.filter(
+            order=models.OuterRef('pk'),
+            assignedorderset=models.OuterRef('set_of_orders'),
+        ))).update(status=status)
+
+
+def fill_order_sets_tables(apps, schema_editor):
+    """
+    Fill the notstarted_orders and finished_orders tables of the sets
+    from the statuses of orders.
+    """
+
+    Order = apps.get_model('delivery', 'Order')
+    AssignedOrderSet = apps.get_model('delivery', 'AssignedOrderSet')
+
+    for status, field in (('finished', 'finished_orders'),
+                          ('assigned', 'notstarted_orders')):
+        through = getattr(AssignedOrderSet, field).through
+        through.objects.bulk_create([
+            through(assignedorderset_id=order_set_id, order_id=order_id)
+            for order_id, order_set_id in Order.objects.filter(
+                status=status, set_of_orders__isnull=False,
+            ).values_list('order_id', 'set_of_orders')
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0008_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('new', 'New'), ('assigned', 'Assigned'), ('finished', 'Finished')], default='new', max_length=8),
+        ),
+        migrations.RunPython(fill_order_statuses, fill_order_sets_tables),
+        migrations.RemoveField(
+            model_name='assignedorderset',
+            name='finished_orders',
+        ),
+        migrations.RemoveField(
+            model_name='assignedorderset',
+            name='notstarted_orders',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='set_of_orders',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='delivery.assignedorderset'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['set_of_orders', 'status'], name='order_set_status_idx'),
+        ),
+    ]
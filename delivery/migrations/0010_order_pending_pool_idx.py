@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0009_order_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('complete_time', None), ('set_of_orders', None)), fields=['region', 'weight'], name='order_pending_pool_idx'),
+        ),
+    ]
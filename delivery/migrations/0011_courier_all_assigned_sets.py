@@ -0,0 +1,19 @@
+# Generated by Django 3.1.7 on 2026-10-17 00:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0010_order_pending_pool_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assignedorderset',
+            name='courier',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='all_assigned_sets', to='delivery.courier'),
+        ),
+    ]
@@ -3,12 +3,21 @@ The models.
 """
 
 import collections
-from typing import Optional, Tuple
-from operator import attrgetter
+from datetime import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from operator import attrgetter, itemgetter
 
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce, Lag
 from django.core.exceptions import FieldError
 
+from .assignment import pack_orders
+from .cache import invalidate_courier_detail
+from .matching import OrderColumns
+from .pool import add_pending_orders, get_order_pool, remove_pending_orders
+from .signals import orders_assigned, orders_completed
+
 
 COURIER_TYPES = [
     ('foot', 'Foot'),
@@ -34,6 +43,237 @@ RATE_OF_PAYMENT = {
     'car': 9,
 }
 
+# The status of an order:
+# new - the order isn't assigned, assigned - the order is in its set of
+# orders and isn't started, finished - the order is completed
+ORDER_STATUSES = [
+    ('new', 'New'),
+    ('assigned', 'Assigned'),
+    ('finished', 'Finished'),
+]
+
+# The payment for an order is BASE_PAYMENT * RATE_OF_PAYMENT[courier_type]
+BASE_PAYMENT = 500
+
+# The number of attempts to complete an order that is changed
+# concurrently, e.g. released and assigned to the courier again
+COMPLETE_ATTEMPTS = 3
+
+# The hours masks have 1 bit for each minute of a day
+MINUTES_IN_DAY = 24 * 60
+HOURS_MASK_LENGTH = MINUTES_IN_DAY // 8
+EMPTY_HOURS_MASK = bytes(HOURS_MASK_LENGTH)
+
+
+def get_hours_mask(intervals: Iterable[Tuple[time, time]]) -> bytes:
+    """
+    Return the minute-of-day mask of given time intervals.
+
+    The bit number i of the mask (counting from the lowest bit) is set
+    when the minute i of a day lies in [start, end) of any interval.
+    An interval with start > end passes midnight.
+    """
+
+    mask = 0
+    for start, end in intervals:
+        start = start.hour * 60 + start.minute
+        end = end.hour * 60 + end.minute
+        if start <= end:
+            mask |= ((1 << (end - start)) - 1) << start
+        else:
+            mask |= ((1 << (MINUTES_IN_DAY - start)) - 1) << start
+            mask |= (1 << end) - 1
+    return mask.to_bytes(HOURS_MASK_LENGTH, 'big')
+
+
+def have_intersecting_hours(mask_1: bytes, mask_2: bytes) -> bool:
+    """
+    Return True if two hours masks have at least 1 common minute.
+    """
+
+    return (int.from_bytes(mask_1, 'big')
+            & int.from_bytes(mask_2, 'big')) != 0
+
+
+def get_payment_expression() -> models.Case:
+    """
+    Return the expression of the payment for an order by the courier
+    type of its set: BASE_PAYMENT * RATE_OF_PAYMENT[courier_type].
+    """
+
+    return models.Case(
+        *[models.When(set_of_orders__courier_type=courier_type,
+                      then=models.Value(BASE_PAYMENT * rate))
+          for courier_type, rate in RATE_OF_PAYMENT.items()],
+        output_field=models.IntegerField(),
+    )
+
+
+class CourierQuerySet(models.QuerySet):
+    """
+    The queryset of couriers with the bulk operations.
+    """
+
+    def idle(self):
+        """
+        Return couriers that don't have not started orders.
+        """
+
+        return self.exclude(
+            current_set_of_orders__orders__status='assigned')
+
+    def with_earnings(self):
+        """
+        Annotate the couriers with `total_earnings` calculated by
+        the database, so `earnings` of many couriers costs 1 query.
+        """
+
+        earnings = Order.objects.filter(
+            complete_time__isnull=False,
+            set_of_orders__courier=models.OuterRef('pk'),
+        ).values(
+            'set_of_orders__courier',
+        ).annotate(
+            earnings=models.Sum(get_payment_expression()),
+        ).values('earnings')
+        return self.annotate(total_earnings=Coalesce(
+            models.Subquery(earnings, output_field=models.IntegerField()),
+            0))
+
+    def assign_orders(self) -> Dict['Courier', Optional['AssignedOrderSet']]:
+        """
+        Assign orders to all the couriers of the queryset in one pass.
+
+        The pending orders are loaded once and matched with each courier
+        in memory like for a single assignment, and only the assigned
+        orders are locked. The couriers
+        with smaller load capacity choose first, so the heavy orders are
+        left for the bigger couriers.
+        Return {courier: his current set of orders or None}.
+        """
+
+        with transaction.atomic():
+            return self._assign_orders()
+
+    def _assign_orders(self):
+        # Lock the couriers to prevent assigning to them in parallel
+        couriers = self.select_related(
+            'current_set_of_orders').prefetch_related('regions')
+        if settings.ORDER_MATCHING_VECTORIZED:
+            couriers = couriers.prefetch_related('working_hours')
+        couriers = list(couriers.select_for_update(of=('self',)))
+
+        # The couriers with not started orders keep their current sets
+        busy_sets = set(Order.objects.filter(
+            set_of_orders__in=[courier.current_set_of_orders_id
+                               for courier in couriers],
+            status='assigned',
+        ).values_list('set_of_orders', flat=True))
+        order_sets = {}
+        idle_couriers = []
+        for courier in couriers:
+            if courier.current_set_of_orders_id in busy_sets:
+                order_sets[courier] = courier.current_set_of_orders
+            else:
+                order_sets[courier] = None
+                idle_couriers.append(courier)
+        if not idle_couriers:
+            return order_sets
+
+        # The pending orders of the regions of the couriers are loaded
+        # once and matched in memory by the masks of the hours, or as
+        # columns for the vectorized matching. If the in-memory pool of
+        # pending orders is enabled, it's used instead.
+        order_pool = get_order_pool()
+        vectorized = (order_pool is None
+                      and settings.ORDER_MATCHING_VECTORIZED)
+        if order_pool is None:
+            pending_orders = Order.objects.filter(
+                set_of_orders=None,
+                complete_time=None,
+                region__in={region.id for courier in idle_couriers
+                            for region in courier.regions.all()},
+                weight__lte=max(courier.load_capacity
+                                for courier in idle_couriers),
+            )
+            if vectorized:
+                columns = OrderColumns.from_queryset(pending_orders)
+            else:
+                pending_orders = list(pending_orders.only(
+                    'order_id', 'weight', 'region', 'delivery_hours_mask'))
+
+        # Match the orders to the couriers and claim (lock) the packed
+        # orders in the database. The couriers that lost some of them to
+        # concurrent assignments query their matching orders again and
+        # pack the rest of their load capacity from them.
+        matched_orders = collections.defaultdict(list)
+        capacities = {courier: courier.load_capacity
+                      for courier in idle_couriers}
+        skipped_ids = set()
+        couriers_to_pack = sorted(
+            idle_couriers, key=attrgetter('load_capacity', 'courier_id'))
+        repacking = False
+        while couriers_to_pack:
+            packed_orders = {}
+            for courier in couriers_to_pack:
+                if order_pool is not None:
+                    candidates = order_pool.find_matching_orders(
+                        [region.id for region in courier.regions.all()],
+                        capacities[courier], courier.working_hours_mask)
+                elif repacking:
+                    candidates = courier.find_matching_orders(
+                        Order.objects.filter(set_of_orders=None).only(
+                            'order_id', 'weight'))
+                elif vectorized:
+                    candidates = columns.match(
+                        [(hours.start, hours.end)
+                         for hours in courier.working_hours.all()],
+                        region_ids=[region.id
+                                    for region in courier.regions.all()],
+                        capacity=capacities[courier])
+                else:
+                    region_ids = {region.id
+                                  for region in courier.regions.all()}
+                    candidates = [
+                        order for order in pending_orders
+                        if order.region_id in region_ids
+                        and order.weight <= capacities[courier]
+                        and courier._has_intersecting_hours_mask(order)
+                    ]
+                orders = pack_orders(
+                    [order for order in candidates
+                     if order.order_id not in skipped_ids],
+                    capacities[courier])
+                packed_orders[courier] = orders
+                skipped_ids.update(order.order_id for order in orders)
+                if vectorized and not repacking:
+                    columns.take(orders)
+
+            repacking = True
+            claimed_orders = Order.objects.claim_pending(
+                order.order_id for orders in packed_orders.values()
+                for order in orders)
+            couriers_to_pack = []
+            for courier, orders in packed_orders.items():
+                claimed = [claimed_orders[order.order_id] for order in orders
+                           if order.order_id in claimed_orders]
+                matched_orders[courier].extend(claimed)
+                if len(claimed) < len(orders):
+                    couriers_to_pack.append(courier)
+                    capacities[courier] -= sum(
+                        order.weight for order in claimed)
+        matched_orders = {courier: orders for courier, orders
+                          in matched_orders.items() if orders}
+
+        AssignedOrderSet.objects.create_for_couriers(matched_orders)
+        remove_pending_orders(order.order_id for orders
+                              in matched_orders.values() for order in orders)
+        orders_assigned.send(
+            sender=Order, count=sum(map(len, matched_orders.values())))
+        for courier in matched_orders:
+            order_sets[courier] = courier.current_set_of_orders
+        return order_sets
+
 
 class Courier(models.Model):
     """
@@ -50,6 +290,14 @@ class Courier(models.Model):
         null=True,
         related_name='+')
     # The realted_name is '+' because it will never be used.
+    working_hours_mask = models.BinaryField(
+        max_length=HOURS_MASK_LENGTH, default=EMPTY_HOURS_MASK)
+    # The mask is kept in sync with working hours (see get_hours_mask)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # The version is bumped when the details of the courier are changed
+    # (see bump_version), it's used as ETag
+
+    objects = CourierQuerySet.as_manager()
 
     class Meta:
         ordering = ['courier_id']
@@ -87,75 +335,158 @@ class Courier(models.Model):
         td [i] - average time of order delivery for region i (in seconds).
         """
 
-        # Get all finished orders by the current courier
-        orders = self.get_finished_orders()
+        # Find the minimum average time for all districts
+        _, t = self.get_average_delivery_times()
 
         # If courier doesn't have completed orders - return None
-        if orders.count() == 0:
+        if t is None:
             return None
 
-        # Find the minimum average time for all districts and calculate rating
-        t = self._calculate_minimum_average_time_for_all_regions(orders=orders)
-        rating = (60*60 - min(t, 60*60))/(60*60) * 5
-        return round(rating, 2)
+        return self._calculate_rating(t)
 
     @property
     def earnings(self) -> int:
         """
         The sum of money that the current courier gained.
+
+        It's calculated by the database in 1 query, or taken from
+        `total_earnings` if the courier was loaded with_earnings().
         """
 
-        # Get all finished orders by the current courier
+        if hasattr(self, 'total_earnings'):
+            return self.total_earnings
+
+        # Find the sum of all money that the courier gained
+        # for all his finished orders
         orders = self.get_finished_orders()
+        earnings = orders.aggregate(
+            earnings=Coalesce(models.Sum(get_payment_expression()), 0))
+        return earnings['earnings']
+
+    def get_rating_and_earnings(self) -> Tuple[Optional[float], int]:
+        """
+        Return the rating and the earnings of the courier calculated
+        from his CourierRegionStats, i.e. in O(regions).
+        """
 
-        # If courier doesn't have completed orders - return zero
-        if orders.count() == 0:
-            return 0
+        region_stats = list(self.region_stats.all())
 
-        # Find the sum of all money that the courier gained
-        order_payments = []
-        for order in orders:
-            rate = RATE_OF_PAYMENT.get(order.set_of_orders.courier_type)
-            payment = 500 * rate
-            order_payments.append(payment)
-        return sum(order_payments)
+        # If courier doesn't have completed orders
+        if not region_stats:
+            return None, 0
+
+        t = min(item.average_time for item in region_stats)
+        earnings = sum(item.earnings for item in region_stats)
+        return self._calculate_rating(t), earnings
+
+    @staticmethod
+    def bump_version(courier_id):
+        """
+        Bump the version of the courier whose details have been changed
+        and remove his details from the cache.
+        """
+
+        Courier.objects.filter(courier_id=courier_id).update(
+            version=models.F('version') + 1)
+        invalidate_courier_detail(courier_id)
 
     def assign_orders(self) -> Optional['AssignedOrderSet']:
         """
         Find the appropriate orders and assign them to the courier.
+
+        The assigned orders are locked until the end of the transaction,
+        so concurrent assignments never take the same order.
         """
 
+        with transaction.atomic():
+            return self._assign_orders()
+
+    def _assign_orders(self) -> Optional['AssignedOrderSet']:
+        # Lock the courier to prevent assigning to him in parallel
+        # and reload his current set of orders after getting the lock.
+        # The set is loaded by a separate query, a join would read
+        # the sets committed before the lock was taken.
+        courier = Courier.objects.select_for_update().get(pk=self.pk)
+        self.current_set_of_orders = courier.current_set_of_orders
+
         # If the courier has unfinished orders in `current_set_of_orders`,
         # then return `current_set_of_orders`.
         if self.current_set_of_orders:
-            if self.current_set_of_orders.notstarted_orders.count() != 0:
+            if self.current_set_of_orders.notstarted_orders.exists():
                 return self.current_set_of_orders
 
         # If the courier doesn't have `current_set_of_orders` or has, but
         # its unfinished orders are over, then create new AssignedOrderSet
         # for the courier and return it.
-        orders = self.find_matching_orders()
+        # The total weight of the new set must fit the load capacity.
+        orders = self._claim_matching_orders()
         if orders:
             # Create new AssignedOrderSet and pin it to the courier
             self.current_set_of_orders = AssignedOrderSet.objects.create(
                 courier=self, courier_type=self.courier_type)
-            self.save()
-            # All the matching orders put in notstarted_orders stack
-            self.current_set_of_orders.notstarted_orders.set(orders)
-            # Set new order set to each order in orders
+            self.save(update_fields=['current_set_of_orders'])
+            # Set new order set to each order in orders,
+            # all the matching orders are not started
             for order in orders:
                 order.set_of_orders = self.current_set_of_orders
-                order.save()
+                order.status = 'assigned'
+            Order.objects.filter(
+                order_id__in=[order.order_id for order in orders],
+            ).update(set_of_orders=self.current_set_of_orders,
+                     status='assigned')
+            remove_pending_orders(order.order_id for order in orders)
+            orders_assigned.send(sender=Order, count=len(orders))
             return self.current_set_of_orders
 
         # But if we can't find appropriate
         # orders, then return None.
         return None
 
+    def _claim_matching_orders(self) -> List['Order']:
+        """
+        Pack the matching orders and claim (lock) them in the database.
+
+        The candidates are taken from the pool of pending orders if it's
+        enabled. Only the packed orders are locked: the orders claimed
+        by concurrent assignments in the meantime are skipped and
+        the rest of the load capacity is packed again from the other
+        candidates.
+        """
+
+        order_pool = get_order_pool()
+        orders = []
+        skipped_ids = set()
+        capacity = self.load_capacity
+        while True:
+            if order_pool is None:
+                candidates = self.find_matching_orders()
+            else:
+                candidates = order_pool.find_matching_orders(
+                    self.regions.values_list('id', flat=True),
+                    capacity, self.working_hours_mask)
+            packed_orders = pack_orders(
+                [order for order in candidates
+                 if order.order_id not in skipped_ids], capacity)
+            claimed_orders = Order.objects.claim_pending(
+                [order.order_id for order in packed_orders])
+            orders.extend(claimed_orders[order.order_id]
+                          for order in packed_orders
+                          if order.order_id in claimed_orders)
+            # Every round skips at least 1 more candidate
+            # or it's the last round
+            if len(claimed_orders) == len(packed_orders):
+                return orders
+            skipped_ids.update(order.order_id for order in packed_orders)
+            capacity -= sum(order.weight for order
+                            in claimed_orders.values())
+
     def find_matching_orders(self, queryset=None):
         """
         Find the matching orders that mathes by parameters: 
         region, weight and delivery/working hours.
+
+        Return a QuerySet, or a list of orders ordered by order_id with
+        the vectorized matching (settings.ORDER_MATCHING_VECTORIZED).
         """
 
         # If queryset is None -> get all orders
@@ -201,6 +532,8 @@ class Courier(models.Model):
 
         the courier has notstarted orders, it method is being called.
         The method remove unsuitable order from notstarted orders set.
+        The suitable orders are packed again to the load capacity, so
+        the orders that don't fit the new courier type are removed too.
         """
         
         # If the courier doesn't have assigned orders -> Do nothing
@@ -210,70 +543,175 @@ class Courier(models.Model):
         notstarted_orders = self.current_set_of_orders.notstarted_orders.all()
         suitable_notstarted_orders = self.find_matching_orders(
             queryset=notstarted_orders)
-        
-        # Unset set_of_orders of unsuitable_notstarted_orders
-        for order in notstarted_orders:
-            if not order in suitable_notstarted_orders:
-                order.set_of_orders = None
-                order.save()
-        
-        # Set only suitable orders
-        self.current_set_of_orders.notstarted_orders.set(
-            suitable_notstarted_orders)
+
+        # Find ids of unsuitable notstarted orders
+        notstarted_ids = set(notstarted_orders.order_by().values_list(
+            'order_id', flat=True))
+        suitable_ids = {order.order_id for order in pack_orders(
+            suitable_notstarted_orders, self.load_capacity)}
+        unsuitable_ids = notstarted_ids - suitable_ids
+        if not unsuitable_ids:
+            return None
+
+        # Unset set_of_orders of unsuitable notstarted orders with 1 query
+        Order.objects.filter(order_id__in=unsuitable_ids).update(
+            set_of_orders=None, status='new')
+        self.current_set_of_orders.bump_version()
+        add_pending_orders(Order.objects.filter(
+            order_id__in=unsuitable_ids,
+        ).only('order_id', 'weight', 'region', 'delivery_hours_mask'))
 
     def _filter_orders_by_delivery_hours(self, orders):
         """
         Returns matching orders from initial QuerySet: orders.
+
+        The intersections of delivery hours and working hours are
+        evaluated by the database in one EXISTS subquery, so the orders
+        are never loaded to check them one by one.
         """
 
-        matching_orders = []
-        for order in orders:
-            # Have we any intersections in all working hours
-            # of courier and delivery hours of order?
-            if self._is_suitable_delivery_hours(order=order):
-                matching_orders.append(order)
-        return matching_orders
+        # The intersections can be found by the vectorized matching
+        # of the loaded orders instead, then the list of the matched
+        # orders is returned
+        if settings.ORDER_MATCHING_VECTORIZED:
+            columns = OrderColumns.from_queryset(orders)
+            return columns.match(
+                self.working_hours.values_list('start', 'end'))
+
+        # Does the order have at least 1 delivery hours item that
+        # intersects at least 1 working hours item of the courier?
+        # The delivery hours passing midnight are matched separately.
+        suitable_delivery_hours = DeliveryHours.objects.filter(
+            order=models.OuterRef('pk'),
+        ).filter(
+            models.Q(models.Exists(self._get_intersecting_working_hours()),
+                     start__lt=models.F('end'))
+            | models.Q(models.Exists(self._get_intersecting_working_hours(
+                passing_midnight=True)), start__gt=models.F('end'))
+        )
+        return orders.filter(models.Exists(suitable_delivery_hours))
 
-    def _is_suitable_delivery_hours(self, order) -> bool:
+    def _has_intersecting_hours_mask(self, order) -> bool:
         """
-        If find at least 1 intersection in in all working hours
-        of courier and delivery hours of order - return True.
-        Else: return False
+        Return True if the working hours mask of the courier and
+        the delivery hours mask of the order have a common minute.
+
+        The masks have to be up to date, the check is made in memory.
+        It matches the pending orders loaded once by the batch
+        assignment (CourierQuerySet.assign_orders) like
+        _filter_orders_by_delivery_hours does it in the database.
         """
-        for delivery_hours in order.delivery_hours.all():
-            if self._have_intersection(delivery_hours):
-                return True
-        return False
 
-    def _have_intersection(self, delivery_hours) -> bool:
+        return have_intersecting_hours(
+            self.working_hours_mask, order.delivery_hours_mask)
+
+    def update_working_hours_mask(self):
         """
-        Find the time intersections in given delivery hours (1 item)
-        and working hours of courier (many items).
+        Recalculate `working_hours_mask` from the working hours of
+        the courier and save it.
         """
 
-        # Separate working hours to them starts and ends
-        # it is necessary for comparison of times
-        courier_starts, courier_ends = [], []
-        for working_hours in self.working_hours.all():
-            courier_starts.append(working_hours.start)
-            courier_ends.append(working_hours.end)
+        self.working_hours_mask = get_hours_mask(
+            self.working_hours.values_list('start', 'end'))
+        self.save(update_fields=['working_hours_mask'])
+
+    def _get_intersecting_working_hours(self, passing_midnight=False):
+        """
+        Return working hours of the courier that intersect the delivery
+        hours of the outer query (OuterRef).
 
-        # Give more brief names to delivery hours
-        order_start = delivery_hours.start
-        order_end = delivery_hours.end
+        The hours with start > end pass midnight, like in get_hours_mask,
+        and the hours with start == end are empty. If passing_midnight is
+        True, the delivery hours of the outer query pass midnight.
+        """
 
-        # check each time matching option
-        for courier_start, courier_end in zip(courier_starts, courier_ends):
-            # if we have a partial intersection at least 1 minute
-            if (courier_start < order_start < courier_end
-                    or courier_start < order_end < courier_end):
-                return True
-            # If all working hours into delivery hours
-            elif order_start <= courier_start and order_end >= courier_end:
-                return True
+        order_start = models.OuterRef('start')
+        order_end = models.OuterRef('end')
+        same_day = models.Q(start__lt=models.F('end'))
+        passing = models.Q(start__gt=models.F('end'))
+
+        if passing_midnight:
+            # The working hours passing midnight share the minute 0 with
+            # the delivery hours, the others have to intersect the part
+            # before or after midnight
+            return self.working_hours.filter(
+                passing
+                | same_day & (models.Q(end__gt=order_start)
+                              | models.Q(start__lt=order_end))
+            )
+
+        return self.working_hours.filter(
+            # if we have an intersection at least 1 minute
+            same_day & models.Q(start__lt=order_end, end__gt=order_start)
+            # The working hours passing midnight intersect the delivery
+            # hours before or after midnight
+            | passing & (models.Q(start__lt=order_end)
+                         | models.Q(end__gt=order_start))
+        )
 
-        # The time intersections don't exist
-        return False
+    def get_average_delivery_times(
+            self) -> Tuple[Dict[int, int], Optional[int]]:
+        """
+        Find the average delivery time in seconds for each region and
+        the minimum of them in 1 query.
+
+        The delivery time of an order is the difference between its
+        complete time and the complete time of the previous order in
+        the region: LAG(complete_time) over the region partition. The
+        first order of the region is counted from the assign time of
+        its set. It's the same formula as in
+        _calculate_minimum_average_time_for_all_regions().
+        Return ({region_id: average time}, minimum average time or None).
+        """
+
+        previous_complete_time = models.Window(
+            expression=Lag('complete_time'),
+            partition_by=[models.F('region')],
+            order_by=[models.F('complete_time').asc(),
+                      models.F('order_id').asc()],
+        )
+        orders = self.get_finished_orders().annotate(
+            delivery_time=models.ExpressionWrapper(
+                models.F('complete_time') - Coalesce(
+                    previous_complete_time, 'set_of_orders__assign_time'),
+                output_field=models.DurationField(),
+            ),
+        ).values('region', 'delivery_time').order_by()
+
+        # Window functions can't be aggregated in the same query,
+        # so the orders are grouped by region in the outer query
+        subquery, params = orders.query.get_compiler(using=orders.db).as_sql()
+        region = connection.ops.quote_name('region_id')
+        delivery_time = connection.ops.quote_name('delivery_time')
+        sql = (f'SELECT {region}, COUNT(*), SUM({delivery_time}) '
+               f'FROM ({subquery}) orders GROUP BY {region}')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        # On databases without the interval type the sum is
+        # in microseconds
+        duration_field = models.DurationField()
+        converters = duration_field.get_db_converters(connection)
+
+        average_times = {}
+        for region_id, orders_count, delivery_time_sum in rows:
+            for converter in converters:
+                delivery_time_sum = converter(
+                    delivery_time_sum, duration_field, connection)
+            average_time = delivery_time_sum.total_seconds() / orders_count
+            average_times[region_id] = round(average_time)
+
+        return average_times, min(average_times.values(), default=None)
+
+    @staticmethod
+    def _calculate_rating(t) -> float:
+        """
+        Calculate the rating by the minimum average time for all regions.
+        """
+
+        rating = (60*60 - min(t, 60*60))/(60*60) * 5
+        return round(rating, 2)
 
     def _calculate_minimum_average_time_for_all_regions(self, orders) -> int:
         """
@@ -328,6 +766,109 @@ class Courier(models.Model):
         return round(average_time)
 
 
+class OrderQuerySet(models.QuerySet):
+    """
+    The queryset of orders with the bulk operations.
+    """
+
+    def claim_pending(self, order_ids) -> Dict[int, 'Order']:
+        """
+        Lock the matched orders that are still pending and return them:
+        {order_id: order}.
+
+        The orders locked by concurrent assignments are skipped. The
+        orders that aren't claimed are dropped from the pool.
+        """
+
+        order_ids = set(order_ids)
+        orders = self.select_for_update(skip_locked=True).filter(
+            set_of_orders=None, complete_time=None,
+        ).only(
+            'order_id', 'weight', 'region', 'delivery_hours_mask',
+        ).in_bulk(order_ids)
+        remove_pending_orders(order_ids - orders.keys())
+        return orders
+
+    def complete(self, completions) -> List[Tuple[int, bool, str]]:
+        """
+        Complete many orders at once, like Order.complete does it for
+        one order.
+
+        Get: completions: iterable of dicts with keys 'courier_id',
+             'order_id' and 'complete_time'.
+        Return: [(order_id, is_success, message)] in the same order.
+
+        The orders are checked in 1 query and complete_time is written
+        with a bulk update.
+        """
+
+        completions = list(completions)
+        orders = self.select_related('set_of_orders').select_for_update(
+            of=('self',)).in_bulk(
+            [completion['order_id'] for completion in completions])
+
+        results = []
+        completed_orders = {}
+        # The couriers whose orders had been completed before
+        recompleted_courier_ids = set()
+        for completion in completions:
+            order_id = completion['order_id']
+            order = orders.get(order_id)
+            if order is None:
+                results.append((order_id, False, 'The order does not exist'))
+            elif order_id in completed_orders:
+                results.append(
+                    (order_id, False, 'The order is repeated in the request'))
+            elif not order.set_of_orders:
+                results.append(
+                    (order_id, False, 'The order was not assigned'))
+            elif order.set_of_orders.courier_id != completion['courier_id']:
+                results.append((order_id, False,
+                                'The order was assigned to another courier'))
+            else:
+                if order.complete_time is not None:
+                    recompleted_courier_ids.add(completion['courier_id'])
+                order.complete_time = completion['complete_time']
+                order.status = 'finished'
+                completed_orders[order_id] = order
+                results.append((order_id, True, 'OK'))
+
+        if completed_orders:
+            self._complete(list(completed_orders.values()),
+                           recompleted_courier_ids)
+        return results
+
+    def _complete(self, orders, recompleted_courier_ids):
+        # Write compete time and finished status
+        Order.objects.bulk_update(
+            orders, ['complete_time', 'status'], batch_size=1000)
+        self.finish(orders, recompleted_courier_ids)
+
+    def finish(self, orders, recompleted_courier_ids):
+        """
+        Bump the versions of the sets of the just completed orders and
+        update the statistics of their couriers.
+
+        The statistics of the couriers from recompleted_courier_ids
+        (their orders had been completed before) are rebuilt.
+        """
+
+        AssignedOrderSet.objects.filter(
+            id__in={order.set_of_orders_id for order in orders},
+        ).update(version=models.F('version') + 1)
+        orders_completed.send(sender=Order, count=len(orders))
+
+        # Update the statistics of the couriers. If an order had been
+        # completed before, the statistics of its courier are rebuilt.
+        CourierRegionStats.objects.add_finished_orders([
+            order for order in orders
+            if order.set_of_orders.courier_id not in recompleted_courier_ids])
+        if recompleted_courier_ids:
+            for courier in Courier.objects.filter(
+                    courier_id__in=recompleted_courier_ids):
+                CourierRegionStats.objects.rebuild(courier)
+
+
 class Order(models.Model):
     """
     The Order model.
@@ -344,10 +885,30 @@ class Order(models.Model):
         'AssignedOrderSet',
         on_delete=models.SET_NULL,
         blank=True,
-        null=True)
+        null=True,
+        related_name='orders')
+    status = models.CharField(
+        max_length=8, choices=ORDER_STATUSES, default='new')
+    # The status is kept in sync with set_of_orders and complete_time
+    delivery_hours_mask = models.BinaryField(
+        max_length=HOURS_MASK_LENGTH, default=EMPTY_HOURS_MASK)
+    # The mask is kept in sync with delivery hours (see get_hours_mask)
+
+    objects = OrderQuerySet.as_manager()
 
     class Meta:
         ordering = ['order_id']
+        indexes = [
+            models.Index(fields=['set_of_orders', 'status'],
+                         name='order_set_status_idx'),
+            # The pool of pending orders searched by the assignment.
+            # The condition is the same as in find_matching_orders,
+            # so the index keeps only the small part of the table.
+            models.Index(fields=['region', 'weight'],
+                         name='order_pending_pool_idx',
+                         condition=models.Q(set_of_orders=None,
+                                            complete_time=None)),
+        ]
 
     def __str__(self):
         return 'Order (order_id={}, weight={}, region={})'.format(
@@ -357,27 +918,100 @@ class Order(models.Model):
         """
         Complete the order. 
 
-        Fill out complete_time.
+        Fill out complete_time with 1 conditional UPDATE: the order is
+        changed only if it's still in its set and the set belongs to
+        the courier, so the number of changed rows is the check of the
+        owner and a parallel PATCH or assignment can't get in between.
+        If the order was changed after it had been read, it's read again
+        and the UPDATE is repeated at most COMPLETE_ATTEMPTS times.
+        """
+
+        for _ in range(COMPLETE_ATTEMPTS):
+            # The sets of orders of the courier that the order can be in
+            order_sets = AssignedOrderSet.objects.filter(
+                id=self.set_of_orders_id, courier=courier)
+            orders = Order.objects.filter(
+                order_id=self.order_id, set_of_orders__in=order_sets)
+
+            # If data is valid:
+            # Write compete time. If the order had been completed before,
+            # its complete time is changed. The completion that was read
+            # is checked by the same UPDATE.
+            was_completed = self.complete_time is not None
+            if was_completed:
+                orders = orders.filter(complete_time__isnull=False)
+            else:
+                orders = orders.filter(complete_time=None)
+            if orders.update(complete_time=complete_time, status='finished'):
+                break
+
+            # The order could be changed after it had been read
+            self.refresh_from_db(fields=['set_of_orders', 'complete_time'])
+
+            # If the order was not assigned
+            if not self.set_of_orders:
+                return False, 'The order was not assigned'
+
+            # If the order was assigned to another courier
+            if self.set_of_orders.courier_id != courier.courier_id:
+                return False, 'The order was assigned to another courier'
+
+            # The order was reassigned to the courier or completed
+            # in the meantime, try again with the order that was read
+        else:
+            return False, 'The order is being changed'
+
+        # Update the set of orders and the statistics of the courier
+        self.complete_time = complete_time
+        self.status = 'finished'
+        Order.objects.finish([self], recompleted_courier_ids=(
+            {courier.courier_id} if was_completed else set()))
+        return True, 'OK'
+
+    def update_delivery_hours_mask(self):
+        """
+        Recalculate `delivery_hours_mask` from the delivery hours of
+        the order and save it.
         """
 
-        # If the order was not assigned
-        if not self.set_of_orders:
-            return False, 'The order was not assigned'
+        self.delivery_hours_mask = get_hours_mask(
+            self.delivery_hours.values_list('start', 'end'))
+        self.save(update_fields=['delivery_hours_mask'])
 
-        # If the order was assigned to another courier
-        if self.set_of_orders.courier != courier:
-            return False, 'The order was assigned to another courier'
 
-        # If data is valid:
-        # Write compete time
-        self.complete_time = complete_time
-        self.save()
-        # Move order from notstarted_orders to finished_orders
-        # in its set_or_orders
-        self.set_of_orders.notstarted_orders.remove(self)
-        self.set_of_orders.finished_orders.add(self)
+class AssignedOrderSetManager(models.Manager):
+    """
+    The manager of AssignedOrderSet model.
+    """
 
-        return True, 'OK'
+    def create_for_couriers(self, matched_orders):
+        """
+        Create the sets of matched orders {courier: [orders]} with bulk
+        inserts and pin them to the couriers.
+        """
+
+        order_sets = [self.model(courier=courier,
+                                 courier_type=courier.courier_type)
+                      for courier in matched_orders]
+        if connection.features.can_return_rows_from_bulk_insert:
+            self.bulk_create(order_sets)
+        else:
+            for order_set in order_sets:
+                order_set.save()
+
+        orders = []
+        for order_set, courier in zip(order_sets, matched_orders):
+            courier.current_set_of_orders = order_set
+            for order in matched_orders[courier]:
+                order.set_of_orders = order_set
+                order.status = 'assigned'
+                orders.append(order)
+
+        Order.objects.bulk_update(
+            orders, ['set_of_orders', 'status'], batch_size=1000)
+        Courier.objects.bulk_update(
+            list(matched_orders), ['current_set_of_orders'], batch_size=1000)
+        return order_sets
 
 
 class AssignedOrderSet(models.Model):
@@ -393,14 +1027,208 @@ class AssignedOrderSet(models.Model):
     courier_type = models.CharField(
         max_length=4, choices=COURIER_TYPES)
     assign_time = models.DateTimeField(auto_now=True)
-    notstarted_orders = models.ManyToManyField(
-        Order, related_name='sets_with_notstarted_status')
-    finished_orders = models.ManyToManyField(Order)
+    # The version is bumped when the notstarted orders are changed,
+    # it's used as ETag
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = AssignedOrderSetManager()
 
     def __str__(self):
         return 'Order set (id={}, courier_id={})'.format(
             self.id, self.courier.courier_id)
 
+    @property
+    def notstarted_orders(self):
+        """
+        The orders of the set that aren't completed yet.
+        """
+
+        return self.orders.filter(status='assigned')
+
+    @property
+    def finished_orders(self):
+        """
+        The completed orders of the set.
+        """
+
+        return self.orders.filter(status='finished')
+
+    def bump_version(self):
+        """
+        Bump the version of the set after its orders have been changed.
+        """
+
+        AssignedOrderSet.objects.filter(id=self.id).update(
+            version=models.F('version') + 1)
+        self.refresh_from_db(fields=['version'])
+
+
+# The fields of CourierRegionStats with statistics
+STATS_FIELDS = ['orders_count', 'first_complete_time', 'last_complete_time',
+                'delivery_time_sum', 'earnings']
+
+
+def summarize_finished_orders(orders) -> Dict[int, dict]:
+    """
+    Calculate the fields of CourierRegionStats for finished orders.
+
+    Get: orders: iterable of (region_id, complete_time, assign_time,
+         courier_type) of finished orders of a courier, where
+         assign_time and courier_type belong to the order set.
+    Return: {region_id: {field: value}}
+    """
+
+    region_stats = {}
+    for region_id, complete_time, assign_time, courier_type in sorted(
+            orders, key=itemgetter(1)):
+        stats = region_stats.setdefault(region_id, {
+            'orders_count': 0,
+            'first_complete_time': None,
+            'last_complete_time': None,
+            'delivery_time_sum': None,
+            'earnings': 0,
+        })
+        _add_finished_order(stats, complete_time, assign_time, courier_type)
+    return region_stats
+
+
+def _add_finished_order(stats, complete_time, assign_time, courier_type):
+    """
+    Add the finished order to the fields of CourierRegionStats.
+
+    The delivery time of the first order (by complete time) is counted
+    from the assign time, of the other ones - from the complete time of
+    the previous order. So the sum of delivery times is always equal to
+    (last complete time - assign time of the first order) and it can be
+    updated even if the orders are added not in order of completion.
+    """
+
+    if stats['orders_count'] == 0:
+        stats['first_complete_time'] = complete_time
+        stats['last_complete_time'] = complete_time
+        stats['delivery_time_sum'] = complete_time - assign_time
+    elif complete_time >= stats['last_complete_time']:
+        stats['delivery_time_sum'] += (
+            complete_time - stats['last_complete_time'])
+        stats['last_complete_time'] = complete_time
+    elif complete_time < stats['first_complete_time']:
+        stats['delivery_time_sum'] = (
+            stats['last_complete_time'] - assign_time)
+        stats['first_complete_time'] = complete_time
+
+    stats['orders_count'] += 1
+    stats['earnings'] += BASE_PAYMENT * RATE_OF_PAYMENT[courier_type]
+
+
+class CourierRegionStatsManager(models.Manager):
+    """
+    The manager of CourierRegionStats model.
+    """
+
+    def add_finished_orders(self, orders):
+        """
+        Add just completed orders to the statistics of their couriers.
+
+        The couriers are locked, so their statistics are changed
+        by one transaction at a time. Their versions are bumped by
+        the same UPDATE that locks them.
+        """
+
+        if not orders:
+            return
+        courier_ids = sorted({order.set_of_orders.courier_id
+                              for order in orders})
+        if len(courier_ids) > 1:
+            # Lock many couriers in the order of ids to avoid deadlocks
+            list(Courier.objects.select_for_update().filter(
+                courier_id__in=courier_ids).values_list('courier_id'))
+        Courier.objects.filter(courier_id__in=courier_ids).update(
+            version=models.F('version') + 1)
+        region_stats = {(stats.courier_id, stats.region_id): stats
+                        for stats in self.filter(courier_id__in=courier_ids)}
+
+        changed_keys = set()
+        for order in orders:
+            order_set = order.set_of_orders
+            key = (order_set.courier_id, order.region_id)
+            stats = region_stats.setdefault(key, self.model(
+                courier_id=order_set.courier_id, region_id=order.region_id))
+            values = {name: getattr(stats, name) for name in STATS_FIELDS}
+            _add_finished_order(values, order.complete_time,
+                                order_set.assign_time, order_set.courier_type)
+            for name, value in values.items():
+                setattr(stats, name, value)
+            changed_keys.add(key)
+
+        changed_stats = [region_stats[key] for key in changed_keys]
+        new_stats = [stats for stats in changed_stats if stats.pk is None]
+        old_stats = [stats for stats in changed_stats if stats.pk is not None]
+        self.bulk_create(new_stats)
+        self.bulk_update(old_stats, STATS_FIELDS)
+        for courier_id in courier_ids:
+            invalidate_courier_detail(courier_id)
+
+    def rebuild(self, courier):
+        """
+        Calculate the statistics of the courier from all his finished
+        orders again.
+        """
+
+        orders = courier.get_finished_orders().values_list(
+            'region', 'complete_time', 'set_of_orders__assign_time',
+            'set_of_orders__courier_type')
+        self.filter(courier=courier).delete()
+        region_stats = self.bulk_create([
+            self.model(courier=courier, region_id=region_id, **values)
+            for region_id, values in summarize_finished_orders(orders).items()
+        ])
+        Courier.bump_version(courier.courier_id)
+        return region_stats
+
+
+class CourierRegionStats(models.Model):
+    """
+    The statistics of finished orders of the courier in a region.
+
+    It's updated incrementally when an order is completed, so the rating
+    and the earnings of the courier are calculated without reading
+    all his finished orders.
+    """
+
+    courier = models.ForeignKey(
+        Courier, on_delete=models.CASCADE, related_name='region_stats')
+    region = models.ForeignKey(
+        'Region', on_delete=models.CASCADE, related_name='+')
+    orders_count = models.PositiveIntegerField(default=0)
+    first_complete_time = models.DateTimeField(blank=True, null=True)
+    last_complete_time = models.DateTimeField(blank=True, null=True)
+    # The sum of delivery times of all finished orders in the region
+    delivery_time_sum = models.DurationField(blank=True, null=True)
+    earnings = models.PositiveIntegerField(default=0)
+
+    objects = CourierRegionStatsManager()
+
+    class Meta:
+        ordering = ['courier', 'region']
+        constraints = [
+            models.UniqueConstraint(fields=['courier', 'region'],
+                                    name='unique_courier_region_stats'),
+        ]
+
+    def __str__(self):
+        return 'Stats (courier_id={}, region={}, orders_count={})'.format(
+            self.courier_id, self.region_id, self.orders_count)
+
+    @property
+    def average_time(self) -> int:
+        """
+        The average time of order delivery in the region (in seconds).
+        """
+
+        average_time = (self.delivery_time_sum.total_seconds()
+                        / self.orders_count)
+        return round(average_time)
+
 
 class Region(models.Model):
     """
@@ -0,0 +1,418 @@
+"""
+The in-memory pool of pending orders.
+
+The pool keeps the orders that aren't assigned and aren't completed,
+grouped by regions and sorted by weight, with their delivery hours
+masks. The assignment takes the candidate orders from the pool instead
+of querying the whole pending pool from the database, and claims them
+by locking their rows: the orders that are already taken are dropped
+from the pool.
+
+The pool is enabled with settings.ORDER_POOL_ENABLED. It's filled from
+the database on the first use and kept current by the changes made in
+the same process, so it's meant for a single process deployment.
+
+With settings.ORDER_POOL_SHARED the pool is kept in shared memory
+instead (SharedOrderPool). It's created and filled by the master process
+of gunicorn before forking the workers (see gunicorn.conf.py), so all
+the workers match the orders against one copy of the pool.
+"""
+
+import bisect
+import collections
+import multiprocessing
+import threading
+import time
+from decimal import Decimal
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, NamedTuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .matching import get_numpy
+
+
+class PendingOrder(NamedTuple):
+    """
+    The order in the pool.
+    """
+
+    order_id: int
+    weight: object
+    region_id: int
+    hours_mask: int
+
+
+class OrderPool:
+    """
+    The pending orders grouped by regions and sorted by weight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {region_id: [(weight, order_id), ...]} sorted by weight
+        self._regions: Dict[int, list] = collections.defaultdict(list)
+        self._orders: Dict[int, PendingOrder] = {}
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def add(self, orders: Iterable):
+        """
+        Add the orders having order_id, weight, region_id and
+        delivery_hours_mask to the pool.
+        """
+
+        with self._lock:
+            changed_regions = set()
+            for order in orders:
+                if order.order_id in self._orders:
+                    continue
+                self._orders[order.order_id] = PendingOrder(
+                    order.order_id, order.weight, order.region_id,
+                    int.from_bytes(order.delivery_hours_mask, 'big'))
+                self._regions[order.region_id].append(
+                    (order.weight, order.order_id))
+                changed_regions.add(order.region_id)
+            # Sorting of the appended items is linear for a few orders
+            # and doesn't turn the filling of the pool into insort
+            # of each order
+            for region_id in changed_regions:
+                self._regions[region_id].sort()
+
+    def remove(self, order_ids: Iterable[int]):
+        with self._lock:
+            for order_id in order_ids:
+                order = self._orders.pop(order_id, None)
+                if order is None:
+                    continue
+                region = self._regions[order.region_id]
+                index = bisect.bisect_left(
+                    region, (order.weight, order.order_id))
+                del region[index]
+
+    def find_matching_orders(self, region_ids: Iterable[int], capacity,
+                             hours_mask: bytes) -> List[PendingOrder]:
+        """
+        Return the orders of the regions that fit the load capacity
+        and have delivery hours intersecting the working hours mask.
+        """
+
+        hours_mask = int.from_bytes(hours_mask, 'big')
+        matching_orders = []
+        with self._lock:
+            for region_id in region_ids:
+                region = self._regions.get(region_id, [])
+                # The orders are sorted by weight, so the orders fitting
+                # the load capacity are the ones before the bisection
+                end = bisect.bisect_right(region, (capacity, float('inf')))
+                for _, order_id in region[:end]:
+                    order = self._orders[order_id]
+                    if order.hours_mask & hours_mask:
+                        matching_orders.append(order)
+        return matching_orders
+
+
+class SharedOrderPool:
+    """
+    The pending orders in shared memory.
+
+    The orders are kept in the slots of fixed size arrays: ids, weights
+    in hundredths of kg, region ids and delivery hours masks. The used
+    slots are kept dense at the start of the arrays: the removed orders
+    are replaced by the last ones, so the matching is made by NumPy over
+    the used slots only. The changes and the matching take a lock shared
+    by the processes.
+
+    If the orders don't fit the slots, the pool is marked as overflowed
+    and isn't used until it's rebuilt from the database.
+    """
+
+    # The header: the number of the used slots, overflowed flag,
+    # the time of the last overflow or rebuilding
+    HEADER_SIZE = 3
+
+    def __init__(self, size: int):
+        from .models import HOURS_MASK_LENGTH
+
+        np = get_numpy()
+
+        self.size = size
+        self._lock = multiprocessing.Lock()
+        self._memory = shared_memory.SharedMemory(
+            create=True,
+            size=(self.HEADER_SIZE * 8 + size * (8 + 8 + 4)
+                  + size * HOURS_MASK_LENGTH))
+
+        offset = 0
+
+        def get_array(dtype, shape):
+            nonlocal offset
+            array = np.ndarray(shape, dtype=dtype,
+                               buffer=self._memory.buf, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self._header = get_array(np.int64, (self.HEADER_SIZE,))
+        self._order_ids = get_array(np.int64, (size,))
+        self._region_ids = get_array(np.int64, (size,))
+        self._weights = get_array(np.int32, (size,))
+        self._masks = get_array(np.uint8, (size, HOURS_MASK_LENGTH))
+        self._header[:] = 0
+
+    @property
+    def overflowed(self) -> bool:
+        return bool(self._header[1])
+
+    def __len__(self):
+        return int(self._header[0])
+
+    def __contains__(self, order_id):
+        with self._lock:
+            return bool(
+                (self._order_ids[:self._header[0]] == order_id).any())
+
+    def add(self, orders: Iterable):
+        """
+        Add the orders having order_id, weight, region_id and
+        delivery_hours_mask to the pool.
+        """
+
+        orders = list(orders)
+        with self._lock:
+            self._add(orders)
+
+    def _add(self, orders: list):
+        np = get_numpy()
+
+        count = self._header[0]
+        new_ids = np.array([order.order_id for order in orders],
+                           dtype=np.int64)
+        orders = [order for order, is_existing
+                  in zip(orders, np.isin(new_ids, self._order_ids[:count]))
+                  if not is_existing]
+        if not orders:
+            return
+
+        # Take the slots after the used ones
+        new_count = count + len(orders)
+        if new_count > self.size:
+            # The time of the overflow is kept until the pool is rebuilt,
+            # the next rejected orders don't postpone the rebuilding
+            if not self._header[1]:
+                self._header[1] = 1
+                self._header[2] = int(time.time())
+            return
+        slots = slice(count, new_count)
+        self._order_ids[slots] = [order.order_id for order in orders]
+        self._region_ids[slots] = [order.region_id for order in orders]
+        self._weights[slots] = [int(round(order.weight * 100))
+                                for order in orders]
+        self._masks[slots] = [
+            np.frombuffer(order.delivery_hours_mask, dtype=np.uint8)
+            for order in orders]
+        self._header[0] = new_count
+
+    def remove(self, order_ids: Iterable[int]):
+        np = get_numpy()
+
+        order_ids = np.fromiter(order_ids, dtype=np.int64)
+        with self._lock:
+            count = self._header[0]
+            removed = np.isin(self._order_ids[:count], order_ids)
+            new_count = count - int(removed.sum())
+            if new_count == count:
+                return
+
+            # Move the orders kept after the new end of the used slots
+            # to the slots of the removed orders before it
+            holes = np.flatnonzero(removed[:new_count])
+            moved = new_count + np.flatnonzero(~removed[new_count:])
+            for array in (self._order_ids, self._region_ids,
+                          self._weights, self._masks):
+                array[holes] = array[moved]
+            self._header[0] = new_count
+
+    def rebuild(self, orders: Iterable, min_interval: int = 0) -> bool:
+        """
+        Fill the overflowed pool with the orders again if min_interval
+        seconds have passed since the last overflow or rebuilding.
+        Return True if the pool has been rebuilt.
+
+        The orders are read under the lock, so the changes committed
+        meanwhile are added or removed after the rebuilding.
+        """
+
+        with self._lock:
+            if (not self._header[1]
+                    or time.time() - self._header[2] < min_interval):
+                return False
+            self._header[:] = [0, 0, int(time.time())]
+            for chunk in _get_chunks(orders, REBUILD_CHUNK_SIZE):
+                self._add(chunk)
+                if self._header[1]:
+                    break
+            return True
+
+    def find_matching_orders(self, region_ids: Iterable[int], capacity,
+                             hours_mask: bytes) -> List[PendingOrder]:
+        """
+        Return the orders of the regions that fit the load capacity
+        and have delivery hours intersecting the working hours mask.
+        """
+
+        np = get_numpy()
+
+        region_ids = np.fromiter(region_ids, dtype=np.int64)
+        hours_mask = np.frombuffer(hours_mask, dtype=np.uint8)
+        with self._lock:
+            count = self._header[0]
+            slots = np.flatnonzero(
+                np.isin(self._region_ids[:count], region_ids)
+                & (self._weights[:count] <= round(capacity * 100)))
+            slots = slots[(self._masks[slots] & hours_mask).any(axis=1)]
+            rows = zip(self._order_ids[slots].tolist(),
+                       self._weights[slots].tolist(),
+                       self._region_ids[slots].tolist(),
+                       self._masks[slots])
+            matching_orders = [
+                PendingOrder(order_id, Decimal(weight) / 100, region_id,
+                             int.from_bytes(mask.tobytes(), 'big'))
+                for order_id, weight, region_id, mask in rows
+            ]
+
+        # The same order as in OrderPool: by the regions, then by weight
+        region_positions = {region_id: position for position, region_id
+                            in enumerate(region_ids.tolist())}
+        matching_orders.sort(key=lambda order: (
+            region_positions[order.region_id], order.weight, order.order_id))
+        return matching_orders
+
+    def close(self):
+        """
+        Free the shared memory, it's called by the process created
+        the pool.
+        """
+
+        self._memory.close()
+        self._memory.unlink()
+
+
+# The number of the orders added to the pool at once when it's rebuilt
+REBUILD_CHUNK_SIZE = 10000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_order_pool():
+    """
+    Return the pool of pending orders of the process or None if
+    the pool is disabled or overflowed. The pool is filled on
+    the first call if it isn't created before.
+
+    The overflowed pool is rebuilt from the database after the commit
+    of the current transaction, at most once in
+    settings.ORDER_POOL_REBUILD_INTERVAL seconds.
+    """
+
+    global _pool
+
+    if not settings.ORDER_POOL_ENABLED:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = _load_order_pool()
+        pool = _pool
+    if getattr(pool, 'overflowed', False):
+        transaction.on_commit(lambda: pool.rebuild(
+            _get_pending_orders().iterator(),
+            settings.ORDER_POOL_REBUILD_INTERVAL))
+        # It's rebuilt at once outside of a transaction
+        if pool.overflowed:
+            return None
+    return pool
+
+
+def create_shared_order_pool():
+    """
+    Create and fill the pool in shared memory before forking
+    the workers, they inherit it.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        _pool = _load_order_pool()
+
+
+def reset_order_pool():
+    """
+    Drop the pool, it will be filled from the database again.
+
+    The shared memory of the pool is freed, so it has to be called
+    by the process created the pool.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        if isinstance(_pool, SharedOrderPool):
+            _pool.close()
+        _pool = None
+
+
+def add_pending_orders(orders: Iterable):
+    """
+    Add the orders to the pool after the commit of the current
+    transaction.
+    """
+
+    pool = get_order_pool()
+    if pool is not None:
+        orders = list(orders)
+        transaction.on_commit(lambda: pool.add(orders))
+
+
+def remove_pending_orders(order_ids: Iterable[int]):
+    """
+    Remove the orders from the pool after the commit of the current
+    transaction.
+    """
+
+    pool = get_order_pool()
+    if pool is not None:
+        order_ids = list(order_ids)
+        transaction.on_commit(lambda: pool.remove(order_ids))
+
+
+def _get_pending_orders():
+    from .models import Order
+
+    return Order.objects.filter(
+        set_of_orders=None, complete_time=None,
+    ).only('order_id', 'weight', 'region', 'delivery_hours_mask').order_by()
+
+
+def _get_chunks(items: Iterable, size: int) -> Iterable[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _load_order_pool() -> OrderPool:
+    if settings.ORDER_POOL_SHARED:
+        pool = SharedOrderPool(settings.ORDER_POOL_SHARED_SIZE)
+    else:
+        pool = OrderPool()
+    pool.add(_get_pending_orders().iterator())
+    return pool
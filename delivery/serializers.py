@@ -2,10 +2,18 @@
 The serializers classes.
 """
 
+from collections import OrderedDict
+
+from django.db import models
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 
+from .cache import invalidate_courier_detail
 from .models import (Courier, Region, WorkingHours, Order, DeliveryHours,
-                     AssignedOrderSet, ORDER_WEIGHT_CONSTRAINTS)
+                     AssignedOrderSet, ORDER_WEIGHT_CONSTRAINTS,
+                     get_hours_mask)
+from .pool import add_pending_orders
+from .timing import observe_serializer
 
 
 class RegionSerializer(serializers.Serializer):
@@ -79,7 +87,170 @@ class TimeIntervalSerializer(serializers.Serializer):
         return str(instance)
 
 
-class CourierItemPostSerializer(serializers.ModelSerializer):
+# The maximum number of objects in one bulk query
+BULK_BATCH_SIZE = 1000
+
+
+class UniqueInBatchValidator(UniqueValidator):
+    """
+    The UniqueValidator for the items of BulkCreateListSerializer.
+
+    It checks the ids prefetched by the list serializer for the whole
+    batch instead of making a query for each item. It also rejects the
+    ids repeated in the batch.
+    """
+
+    def __call__(self, value, serializer_field):
+        batch_ids = serializer_field.context.get('batch_ids')
+        if batch_ids is None:
+            return super().__call__(value, serializer_field)
+
+        if value in batch_ids['existing'] or value in batch_ids['seen']:
+            raise serializers.ValidationError(self.message, code='unique')
+        batch_ids['seen'].add(value)
+
+
+class BulkCreateSerializerMixin:
+    """
+    The mixin for model serializers used with BulkCreateListSerializer.
+
+    It replaces UniqueValidator of the fields with UniqueInBatchValidator.
+    """
+
+    def build_standard_field(self, field_name, model_field):
+        field_class, field_kwargs = super().build_standard_field(
+            field_name, model_field)
+        if 'validators' in field_kwargs:
+            field_kwargs['validators'] = [
+                UniqueInBatchValidator(validator.queryset, validator.message)
+                if isinstance(validator, UniqueValidator) else validator
+                for validator in field_kwargs['validators']
+            ]
+        return field_class, field_kwargs
+
+
+class TimedSerializerMixin:
+    """
+    The mixin for the serializers used by the views: the time of
+    the validation and the representation is counted in the metrics
+    of the request.
+    """
+
+    def is_valid(self, raise_exception=False):
+        with observe_serializer():
+            return super().is_valid(raise_exception=raise_exception)
+
+    @property
+    def data(self):
+        with observe_serializer():
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """
+    The list serializer counted in the metrics of the request.
+    """
+
+
+class BulkCreateListSerializer(TimedSerializerMixin,
+                               serializers.ListSerializer):
+    """
+    The base list serializer creating all the items with bulk queries.
+
+    Before validation of the items it fetches the ids that already
+    exist in db with one query for each BULK_BATCH_SIZE items.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.context['batch_ids'] = {
+                'existing': self._get_existing_ids(data),
+                'seen': set(),
+            }
+        try:
+            return super().to_internal_value(data)
+        finally:
+            self.context.pop('batch_ids', None)
+
+    def _get_existing_ids(self, data):
+        """
+        Return the primary keys of data items that exist in db.
+        """
+
+        model = self.child.Meta.model
+        pk_name = model._meta.pk.name
+        ids = []
+        for item in data:
+            try:
+                ids.append(int(item[pk_name]))
+            except (KeyError, TypeError, ValueError):
+                pass
+
+        existing_ids = set()
+        for index in range(0, len(ids), BULK_BATCH_SIZE):
+            existing_ids.update(model.objects.filter(
+                pk__in=ids[index:index + BULK_BATCH_SIZE],
+            ).values_list('pk', flat=True))
+        return existing_ids
+
+
+class CourierListSerializer(BulkCreateListSerializer):
+    """
+    This serializer creates many couriers with bulk queries.
+    """
+
+    def create(self, validated_data):
+        """
+        Create the regions that don't exist, the couriers, their
+        regions and working hours.
+        """
+
+        # Create the regions that don't exist with 1 query
+        region_ids = {region['id'] for item in validated_data
+                      for region in item['regions']}
+        Region.objects.bulk_create(
+            [Region(id=region_id) for region_id in region_ids],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+        # Create couriers with the masks of their working hours
+        couriers = [
+            Courier(
+                courier_id=item['courier_id'],
+                courier_type=item['courier_type'],
+                working_hours_mask=get_hours_mask(
+                    (hours['start'], hours['end'])
+                    for hours in item['working_hours']),
+            )
+            for item in validated_data
+        ]
+        Courier.objects.bulk_create(couriers, batch_size=BULK_BATCH_SIZE)
+
+        # Set regions to the couriers (the repeated regions are skipped)
+        CourierRegion = Courier.regions.through
+        CourierRegion.objects.bulk_create(
+            [
+                CourierRegion(courier_id=item['courier_id'],
+                              region_id=region_id)
+                for item in validated_data
+                for region_id in dict.fromkeys(
+                    region['id'] for region in item['regions'])
+            ],
+            batch_size=BULK_BATCH_SIZE)
+
+        # Create working hours
+        WorkingHours.objects.bulk_create(
+            [
+                WorkingHours(start=hours['start'], end=hours['end'],
+                             courier=courier)
+                for courier, item in zip(couriers, validated_data)
+                for hours in item['working_hours']
+            ],
+            batch_size=BULK_BATCH_SIZE)
+        return couriers
+
+
+class CourierItemPostSerializer(BulkCreateSerializerMixin,
+                                serializers.ModelSerializer):
     """
     This serializer is used for posting and creating not existing 
     couriers.
@@ -92,16 +263,20 @@ class CourierItemPostSerializer(serializers.ModelSerializer):
         model = Courier
         fields = ['courier_id', 'courier_type', 'regions', 'working_hours']
         extra_kwargs = {'courier_type': {'write_only': True}}
+        list_serializer_class = CourierListSerializer
 
     def create(self, validated_data):
         """
         Create courier, his regions (if they don't exist), his working hours.
         """
 
-        # Create courier
+        # Create courier with the mask of his working hours
+        working_hours = validated_data.pop('working_hours')
         courier = Courier.objects.create(
             courier_id=validated_data.pop('courier_id'),
             courier_type=validated_data.pop('courier_type'),
+            working_hours_mask=get_hours_mask(
+                (item['start'], item['end']) for item in working_hours),
         )
 
         # Create regions
@@ -112,10 +287,10 @@ class CourierItemPostSerializer(serializers.ModelSerializer):
             courier.regions.add(region)
 
         # Create working hours
-        for working_hours in validated_data.pop('working_hours'):
+        for working_hours_item in working_hours:
             WorkingHours.objects.create(
-                start=working_hours['start'],
-                end=working_hours['end'],
+                start=working_hours_item['start'],
+                end=working_hours_item['end'],
                 courier=courier,
             )
 
@@ -134,7 +309,8 @@ class CourierItemPostSerializer(serializers.ModelSerializer):
         return ret
 
 
-class CourierItemPatchSerializer(serializers.ModelSerializer):
+class CourierItemPatchSerializer(TimedSerializerMixin,
+                                 serializers.ModelSerializer):
     """
     This serializer is used for patching (update) existing couriers.
     """
@@ -186,13 +362,24 @@ class CourierItemPatchSerializer(serializers.ModelSerializer):
                     end=working_hours_item['end'],
                     courier=instance)
 
-        # Save, refresh notstarted orders (if they are) and return courier
-        instance.save()
+            # Refresh the mask of working hours
+            instance.working_hours_mask = get_hours_mask(
+                (item['start'], item['end']) for item in working_hours)
+
+        # Save, refresh notstarted orders (if they are) and return courier.
+        # The version is bumped in the same UPDATE, so the version
+        # bumped by a parallel request is never written over.
+        instance.version = models.F('version') + 1
+        instance.save(update_fields=[
+            'courier_type', 'working_hours_mask', 'version'])
+        instance.refresh_from_db(fields=['version'])
         instance.remove_unsuitable_orders()
+        invalidate_courier_detail(instance.courier_id)
         return instance
 
 
-class CourierDetailSerializer(serializers.ModelSerializer):
+class CourierDetailSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
     """
     This serializer for a detailed display of a specific courier.
     """
@@ -216,17 +403,19 @@ class CourierDetailSerializer(serializers.ModelSerializer):
 
         ret = super().to_representation(instance)
 
+        # Rating and earnings are calculated from the courier statistics
+        rating, earnings = instance.get_rating_and_earnings()
+
         # Add the rating field if the courier have finished order(-s)
-        rating = instance.rating
         if rating:
             ret['rating'] = rating
 
         # Add earnings field
-        ret['earnings'] = instance.earnings
+        ret['earnings'] = earnings
         return ret
 
 
-class CourierIdSerializer(serializers.Serializer):
+class CourierIdSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     The serializer for getting posts with one field: 'courier_id'
     """
@@ -234,7 +423,73 @@ class CourierIdSerializer(serializers.Serializer):
     courier_id = serializers.IntegerField()
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class CourierIdListSerializer(TimedSerializerMixin, serializers.Serializer):
+    """
+    The serializer for getting posts of the batch assignment.
+
+    It has either the list of 'courier_ids' or 'all_idle': true.
+    """
+
+    courier_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False)
+    all_idle = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        """
+        Check that exactly one way to choose couriers is given.
+        """
+
+        if bool(data.get('courier_ids')) == data['all_idle']:
+            raise serializers.ValidationError(
+                "Provide either 'courier_ids' or 'all_idle': true")
+        return data
+
+
+class OrderListSerializer(BulkCreateListSerializer):
+    """
+    This serializer creates many orders with bulk queries.
+    """
+
+    def create(self, validated_data):
+        """
+        Create the regions that don't exist, the orders and their
+        delivery hours.
+        """
+
+        # Create the regions that don't exist with 1 query
+        region_ids = {item['region']['id'] for item in validated_data}
+        Region.objects.bulk_create(
+            [Region(id=region_id) for region_id in region_ids],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+        # Create Order instances with the masks of their delivery hours
+        orders = [
+            Order(
+                order_id=item['order_id'],
+                weight=item['weight'],
+                region_id=item['region']['id'],
+                delivery_hours_mask=get_hours_mask(
+                    (hours['start'], hours['end'])
+                    for hours in item['delivery_hours']),
+            )
+            for item in validated_data
+        ]
+        Order.objects.bulk_create(orders, batch_size=BULK_BATCH_SIZE)
+
+        # Create delivery hours instances
+        DeliveryHours.objects.bulk_create(
+            [
+                DeliveryHours(start=hours['start'], end=hours['end'],
+                              order=order)
+                for order, item in zip(orders, validated_data)
+                for hours in item['delivery_hours']
+            ],
+            batch_size=BULK_BATCH_SIZE)
+        add_pending_orders(orders)
+        return orders
+
+
+class OrderSerializer(BulkCreateSerializerMixin, serializers.ModelSerializer):
     """
     This serializer is used for posting and creating not existing 
     orders.
@@ -250,6 +505,7 @@ class OrderSerializer(serializers.ModelSerializer):
             'weight': {'write_only': True,
                        **ORDER_WEIGHT_CONSTRAINTS, },
         }
+        list_serializer_class = OrderListSerializer
 
     def create(self, validated_data):
 
@@ -257,19 +513,23 @@ class OrderSerializer(serializers.ModelSerializer):
         region, _ = Region.objects.get_or_create(
             id=validated_data.pop('region')['id'])
 
-        # Create Order instance
+        # Create Order instance with the mask of its delivery hours
+        delivery_hours = validated_data.pop('delivery_hours')
         order = Order.objects.create(
             order_id=validated_data.pop('order_id'),
             weight=validated_data.pop('weight'),
             region=region,
+            delivery_hours_mask=get_hours_mask(
+                (item['start'], item['end']) for item in delivery_hours),
         )
         # Create delivery hours instances
-        for delivery_hours_item in validated_data.pop('delivery_hours'):
+        for delivery_hours_item in delivery_hours:
             DeliveryHours.objects.create(
                 start=delivery_hours_item['start'],
                 end=delivery_hours_item['end'],
                 order=order,
             )
+        add_pending_orders([order])
         return order
 
 
@@ -282,6 +542,7 @@ class OrderIdSerializer(serializers.ModelSerializer):
         model = Order
         fields = ['order_id']
         read_only_fields = ['order_id']
+        list_serializer_class = TimedListSerializer
 
     def to_representation(self, instance):
         """
@@ -294,32 +555,59 @@ class OrderIdSerializer(serializers.ModelSerializer):
         return ret
 
 
-class AssignOrderSetSerializer(serializers.ModelSerializer):
+class AssignOrderSetSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
     """
     The serializer for AssignOrderSet model.
     """
 
-    notstarted_orders = OrderIdSerializer(many=True, read_only=True)
-
     class Meta:
         model = AssignedOrderSet
-        fields = ['notstarted_orders', 'assign_time']
-        read_only_fields = ['notstarted_orders', 'assign_time']
+        fields = ['assign_time']
+        read_only_fields = ['assign_time']
 
     def to_representation(self, instance):
         """
         Change output data to appropriate view.
 
-        Rename field 'notstarted_orders' to 'orders'. 
+        Add field 'orders' with not started orders of the set.
         """
         ret = super().to_representation(instance)
-        ret['orders'] = ret.pop('notstarted_orders')
+        # The orders can be prefetched to 'prefetched_notstarted_orders'
+        orders = getattr(instance, 'prefetched_notstarted_orders', None)
+        if orders is None:
+            orders = instance.notstarted_orders
+        ret['orders'] = OrderIdSerializer(orders, many=True).data
         # Move to end assign_time in the representation view
         ret.move_to_end('assign_time')
         return ret
 
 
-class CompleteOrderSerializer(serializers.Serializer):
+class CourierOrderSetSerializer(serializers.Serializer):
+    """
+    The serializer for the result of the batch assignment for a courier.
+    """
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+    def to_representation(self, instance):
+        """
+        Get (courier, order_set) and return the courier id with the
+        representation of his order set. If the courier doesn't have
+        the order set, its orders are empty.
+        """
+
+        courier, order_set = instance
+        ret = OrderedDict([('id', courier.courier_id)])
+        if order_set is None:
+            ret['orders'] = []
+        else:
+            ret.update(AssignOrderSetSerializer(order_set).data)
+        return ret
+
+
+class CompleteOrderSerializer(TimedSerializerMixin, serializers.Serializer):
     """
     The serializer for getting complete order posts.
     """
@@ -327,3 +615,24 @@ class CompleteOrderSerializer(serializers.Serializer):
     courier_id = serializers.IntegerField()
     order_id = serializers.IntegerField()
     complete_time = serializers.DateTimeField()
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+
+class CompleteOrderResultSerializer(serializers.Serializer):
+    """
+    The serializer for the result of the batch completion for an order:
+    (order_id, is_success, message).
+    """
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+    def to_representation(self, instance):
+        order_id, is_success, message = instance
+        return OrderedDict([
+            ('order_id', order_id),
+            ('success', is_success),
+            ('detail', message),
+        ])
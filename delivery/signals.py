@@ -0,0 +1,20 @@
+"""
+The signals of the application.
+
+The models send them after changing the orders and the cache sends
+them on each request of the courier details, so the instrumentation
+(see delivery/metrics.py) isn't imported by them.
+"""
+
+from django.dispatch import Signal
+
+
+# Sent with the number of the orders assigned to the couriers (count)
+orders_assigned = Signal()
+
+# Sent with the number of the just completed orders (count)
+orders_completed = Signal()
+
+# Sent on each request of the courier details to the cache, hit is
+# True if they were found
+courier_cache_requested = Signal()
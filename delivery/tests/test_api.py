@@ -4,13 +4,24 @@ Test api.
 
 from datetime import time, datetime, timezone, timedelta
 import json
+from unittest import mock
 
 from rest_framework.test import APITestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import now as timezone_now
 from rest_framework import status
 
+from .. import api
+from ..api import get_etag
+from ..cache import (get_courier_cache, get_courier_cache_key, get_cache_stats,
+                     reset_cache_stats)
+from ..serializers import CourierItemPatchSerializer
+
 from ..models import (
-    Courier, Region, WorkingHours, Order, DeliveryHours, AssignedOrderSet)
+    Courier, Region, WorkingHours, Order, DeliveryHours, AssignedOrderSet,
+    CourierRegionStats, get_hours_mask)
 
 
 class CourierListAPITestCase(APITestCase):
@@ -162,7 +173,9 @@ class CourierItemAPITestCase(APITestCase):
         # Create order set
         self.order_set_1 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_1.finished_orders.set([self.order_1])
+        for order in [self.order_1]:
+            order.status = 'finished'
+            order.save()
         self.order_1.complete_time = self.time
         self.order_1.set_of_orders = self.order_set_1
         self.order_1.save()
@@ -170,7 +183,9 @@ class CourierItemAPITestCase(APITestCase):
         # Create order set
         self.order_set_2 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_2.finished_orders.set([self.order_2])
+        for order in [self.order_2]:
+            order.status = 'finished'
+            order.save()
         self.order_2.complete_time = self.time
         self.order_2.set_of_orders = self.order_set_2
         self.order_2.save()
@@ -178,13 +193,20 @@ class CourierItemAPITestCase(APITestCase):
         # Create order set
         self.order_set_3 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_3.finished_orders.set([self.order_3])
+        for order in [self.order_3]:
+            order.status = 'finished'
+            order.save()
 
         # Create order set
         self.order_set_4 = AssignedOrderSet.objects.create(
             courier=self.another_courier,
             courier_type=self.another_courier.courier_type)
-        self.order_set_4.finished_orders.set([self.order_4])
+        for order in [self.order_4]:
+            order.status = 'finished'
+            order.save()
+
+        # The orders were completed bypassing Order.complete
+        CourierRegionStats.objects.rebuild(self.courier)
 
     def test_changed_all_courier_fields(self):
         url = reverse('courier-item', args=[1])
@@ -192,6 +214,14 @@ class CourierItemAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, self.input_data_foot)
 
+    def test_patch_refreshes_working_hours_mask(self):
+        url = reverse('courier-item', args=[1])
+        self.client.patch(url, {'working_hours': ['10:00-11:00']},
+                          format='json')
+        self.courier.refresh_from_db()
+        expected_mask = get_hours_mask([(time(hour=10), time(hour=11))])
+        self.assertEqual(bytes(self.courier.working_hours_mask), expected_mask)
+
     def test_request_with_invalid_courier_type(self):
         url = reverse('courier-item', args=[1])
         self.input_data_foot['courier_type'] = 'zuzu'
@@ -227,6 +257,7 @@ class CourierItemAPITestCase(APITestCase):
         # Set order_2 as complete
         self.order_2.complete_time = None
         self.order_2.save()
+        CourierRegionStats.objects.rebuild(self.courier)
 
         url = reverse('courier-item', args=[1])
         response = self.client.get(url, format='json')
@@ -406,8 +437,13 @@ class OrdersAssignAPITestCase(APITestCase):
         self.order_set = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type
         )
-        self.order_set.notstarted_orders.set([self.order_1])
-        self.order_set.finished_orders.set([self.order_2])
+        for order in [self.order_1]:
+            order.set_of_orders = self.order_set
+            order.status = 'assigned'
+            order.save()
+        for order in [self.order_2]:
+            order.status = 'finished'
+            order.save()
         self.courier.current_set_of_orders = self.order_set
         self.courier.save()
 
@@ -434,7 +470,9 @@ class OrdersAssignAPITestCase(APITestCase):
         self.order_set = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type
         )
-        self.order_set.finished_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.status = 'finished'
+            order.save()
         self.order_1.set_of_orders = self.order_set
         self.order_2.set_of_orders = self.order_set
         self.order_1.save()
@@ -455,6 +493,98 @@ class OrdersAssignAPITestCase(APITestCase):
         self.assertEqual(json.loads(response.content), expected_response_data)
 
 
+class OrdersBatchAssignAPITestCase(APITestCase):
+    """
+    The test case for OrdersBatchAssignAPI class.
+    """
+
+    def setUp(self):
+        # Create couriers and orders through the api to fill hours masks
+        couriers = [
+            {'courier_id': 1, 'courier_type': 'foot', 'regions': [1],
+             'working_hours': ['09:00-12:00']},
+            {'courier_id': 2, 'courier_type': 'car', 'regions': [1, 2],
+             'working_hours': ['09:00-18:00']},
+            {'courier_id': 3, 'courier_type': 'bike', 'regions': [3],
+             'working_hours': ['09:00-18:00']},
+        ]
+        orders = [
+            {'order_id': 1, 'weight': 4, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 2, 'weight': 5, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 3, 'weight': 20, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 4, 'weight': 3, 'region': 2,
+             'delivery_hours': ['17:00-19:00']},
+            {'order_id': 5, 'weight': 3, 'region': 1,
+             'delivery_hours': ['13:00-14:00']},
+        ]
+        self.client.post(reverse('couriers'), {'data': couriers},
+                         format='json')
+        self.client.post(reverse('orders'), {'data': orders}, format='json')
+        self.url = reverse('orders-assign-batch')
+
+    def get_assigned_orders(self, response):
+        return {item['id']: [order['id'] for order in item['orders']]
+                for item in json.loads(response.content)['couriers']}
+
+    def test_post_courier_ids(self):
+        response = self.client.post(
+            self.url, {'courier_ids': [1, 2, 3]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_assigned_orders(response),
+                         {1: [1, 2], 2: [3, 4, 5], 3: []})
+
+        # Test order sets in db
+        for courier_id, order_ids in [(1, [1, 2]), (2, [3, 4, 5])]:
+            courier = Courier.objects.get(courier_id=courier_id)
+            order_set = courier.current_set_of_orders
+            self.assertEqual(order_set.courier, courier)
+            self.assertEqual(order_set.courier_type, courier.courier_type)
+            self.assertCountEqual(
+                order_set.notstarted_orders.values_list('order_id', flat=True),
+                order_ids)
+            self.assertCountEqual(
+                order_set.orders.values_list('order_id', flat=True),
+                order_ids)
+        self.assertIsNone(Courier.objects.get(courier_id=3).current_set_of_orders)
+
+    def test_post_all_idle(self):
+        self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                         format='json')
+        response = self.client.post(self.url, {'all_idle': True},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_assigned_orders(response),
+                         {2: [3, 4, 5], 3: []})
+
+    def test_post_keeps_current_set_with_notstarted_orders(self):
+        self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                         format='json')
+        order_set = Courier.objects.get(courier_id=1).current_set_of_orders
+        response = self.client.post(self.url, {'courier_ids': [1]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_assigned_orders(response), {1: [1, 2]})
+        self.assertEqual(
+            Courier.objects.get(courier_id=1).current_set_of_orders, order_set)
+
+    def test_post_invalid_courier(self):
+        response = self.client.post(self.url, {'courier_ids': [1, 999]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'detail': "Courier doesn't exist"})
+        self.assertEqual(AssignedOrderSet.objects.count(), 0)
+
+    def test_post_invalid_fields(self):
+        for data in [{}, {'courier_ids': []},
+                     {'courier_ids': [1], 'all_idle': True}]:
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+
 class OrdersCompleteAPITestCase(APITestCase):
     """
     The test case for OrdersCompleteAPI class.
@@ -510,7 +640,10 @@ class OrdersCompleteAPITestCase(APITestCase):
         # Create order set
         self.order_set = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set.notstarted_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.set_of_orders = self.order_set
+            order.status = 'assigned'
+            order.save()
 
         # Set order_set to orders
         self.order_1.set_of_orders = self.order_set
@@ -589,3 +722,301 @@ class OrdersCompleteAPITestCase(APITestCase):
         self.assertIsNone(response.data)
         self.order_1.refresh_from_db()
         self.assertIsNone(self.order_1.complete_time)
+
+
+class CourierItemCacheAPITestCase(APITestCase):
+    """
+    The test case for the cache of CourierItemAPI.get.
+    """
+
+    def setUp(self):
+        get_courier_cache().clear()
+        reset_cache_stats()
+
+        couriers = [{'courier_id': 1, 'courier_type': 'foot',
+                     'regions': [1], 'working_hours': ['09:00-18:00']}]
+        self.client.post(reverse('couriers'), {'data': couriers},
+                         format='json')
+        orders = [{'order_id': 1, 'weight': 1, 'region': 1,
+                   'delivery_hours': ['10:00-11:00']}]
+        self.client.post(reverse('orders'), {'data': orders}, format='json')
+        self.url = reverse('courier-item', args=[1])
+
+    def get(self, cache_status):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], cache_status)
+        return json.loads(response.content)
+
+    def test_get_from_cache(self):
+        data = self.get('MISS')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('HIT'), data)
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_get_404_is_not_cached(self):
+        url = reverse('courier-item', args=[999])
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(get_cache_stats(), {'hits': 0, 'misses': 2})
+
+    def test_patch_invalidates_cache(self):
+        self.get('MISS')
+        self.client.patch(self.url, {'regions': [2, 3]}, format='json')
+        self.assertEqual(self.get('MISS')['regions'], [2, 3])
+
+    def test_complete_invalidates_cache(self):
+        self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                         format='json')
+
+        # Assignment doesn't change the details of the courier
+        self.assertEqual(self.get('MISS')['earnings'], 0)
+        self.get('HIT')
+
+        complete_data = {'courier_id': 1, 'order_id': 1,
+                         'complete_time': timezone_now().isoformat()}
+        self.client.post(reverse('orders-complete'), complete_data,
+                         format='json')
+        data = self.get('MISS')
+        self.assertEqual(data['earnings'], 1000)
+        self.assertIn('rating', data)
+
+
+class ETagAPITestCase(APITestCase):
+    """
+    The test case for ETag of the courier details and the assigned set.
+    """
+
+    def setUp(self):
+        get_courier_cache().clear()
+
+        couriers = [{'courier_id': 1, 'courier_type': 'foot',
+                     'regions': [1], 'working_hours': ['09:00-18:00']}]
+        self.client.post(reverse('couriers'), {'data': couriers},
+                         format='json')
+        orders = [{'order_id': order_id, 'weight': 1, 'region': 1,
+                   'delivery_hours': ['10:00-11:00']}
+                  for order_id in (1, 2)]
+        self.client.post(reverse('orders'), {'data': orders}, format='json')
+        self.url = reverse('courier-item', args=[1])
+
+    def assign(self, **headers):
+        return self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                                format='json', **headers)
+
+    def complete(self, order_id):
+        complete_data = {'courier_id': 1, 'order_id': order_id,
+                         'complete_time': timezone_now().isoformat()}
+        self.client.post(reverse('orders-complete'), complete_data,
+                         format='json')
+
+    def test_get_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        # From the cache
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        # From the database without serializing the details: the courier
+        # is read and his version is checked after caching it
+        get_courier_cache().clear()
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=f'"0-0", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        # The version is cached for the next conditional requests,
+        # the details are serialized by the first request without it
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_get_doesnt_cache_details_patched_meanwhile(self):
+        # The patch is committed after the courier is read and before
+        # his details are cached
+        serializer_class = api.CourierDetailSerializer
+
+        def patch_and_serialize(courier):
+            Courier.bump_version(courier.courier_id)
+            return serializer_class(courier)
+
+        with mock.patch.object(api, 'CourierDetailSerializer',
+                               patch_and_serialize):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIsNone(get_courier_cache().get(get_courier_cache_key(1)))
+
+    def test_get_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.client.patch(self.url, {'regions': [2]}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        self.client.patch(self.url, {'regions': [1]}, format='json')
+        self.assign()
+        self.assertEqual(self.client.get(self.url)['ETag'],
+                         get_etag(1, 3))
+        self.complete(order_id=1)
+        self.assertEqual(self.client.get(self.url)['ETag'],
+                         get_etag(1, 4))
+
+    def test_assign_not_modified(self):
+        response = self.assign()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.assign(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # The orders of the set are changed
+        self.complete(order_id=1)
+        response = self.assign(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['orders'], [{'id': 2}])
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_patch_doesnt_overwrite_version(self):
+        courier = Courier.objects.get(courier_id=1)
+        Courier.bump_version(courier_id=1)
+        self.assertEqual(courier.version, 1)
+
+        serializer = CourierItemPatchSerializer(
+            courier, data={'courier_type': 'bike'})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        courier.refresh_from_db()
+        self.assertEqual(courier.version, 3)
+
+    def test_patch_doesnt_overwrite_current_set_of_orders(self):
+        # The courier is read before the orders are assigned to him
+        courier = Courier.objects.get(courier_id=1)
+        self.assign()
+        order_set_id = Courier.objects.get(
+            courier_id=1).current_set_of_orders_id
+        self.assertIsNotNone(order_set_id)
+
+        serializer = CourierItemPatchSerializer(
+            courier, data={'courier_type': 'bike'})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        courier.refresh_from_db()
+        self.assertEqual(courier.courier_type, 'bike')
+        self.assertEqual(courier.current_set_of_orders_id, order_set_id)
+
+
+class OrdersBatchCompleteAPITestCase(APITestCase):
+    """
+    The test case for OrdersBatchCompleteAPI class.
+    """
+
+    def setUp(self):
+        couriers = [{'courier_id': courier_id, 'courier_type': 'foot',
+                     'regions': [1, 2], 'working_hours': ['09:00-18:00']}
+                    for courier_id in (1, 2)]
+        self.client.post(reverse('couriers'), {'data': couriers},
+                         format='json')
+        orders = [{'order_id': order_id, 'weight': 1,
+                   'region': order_id % 2 + 1,
+                   'delivery_hours': ['10:00-11:00']}
+                  for order_id in range(1, 7)]
+        self.client.post(reverse('orders'), {'data': orders}, format='json')
+        self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                         format='json')
+        self.order_set = Courier.objects.get(
+            courier_id=1).current_set_of_orders
+
+        self.url = reverse('orders-complete-batch')
+        self.complete_time = timezone_now() + timedelta(minutes=5)
+
+    def completion(self, order_id, courier_id=1, minutes=0):
+        complete_time = self.complete_time + timedelta(minutes=minutes)
+        return {'courier_id': courier_id, 'order_id': order_id,
+                'complete_time': complete_time.isoformat()}
+
+    def assert_stats_match_finished_orders(self):
+        courier = Courier.objects.get(courier_id=1)
+        self.assertEqual(courier.get_rating_and_earnings(),
+                         (courier.rating, courier.earnings))
+
+    def test_complete_orders(self):
+        Order.objects.filter(order_id=6).update(
+            set_of_orders=None, status='new')
+        data = [
+            self.completion(1, minutes=10),
+            self.completion(2, minutes=5),
+            self.completion(2),
+            self.completion(3, courier_id=2),
+            self.completion(6),
+            self.completion(99),
+        ]
+        response = self.client.post(self.url, {'data': data}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'orders': [
+            {'order_id': 1, 'success': True, 'detail': 'OK'},
+            {'order_id': 2, 'success': True, 'detail': 'OK'},
+            {'order_id': 2, 'success': False,
+             'detail': 'The order is repeated in the request'},
+            {'order_id': 3, 'success': False,
+             'detail': 'The order was assigned to another courier'},
+            {'order_id': 6, 'success': False,
+             'detail': 'The order was not assigned'},
+            {'order_id': 99, 'success': False,
+             'detail': 'The order does not exist'},
+        ]})
+
+        self.assertEqual(
+            Order.objects.get(order_id=2).complete_time,
+            self.complete_time + timedelta(minutes=5))
+        self.assertCountEqual(
+            self.order_set.finished_orders.values_list('order_id', flat=True),
+            [1, 2])
+        self.assertCountEqual(
+            self.order_set.notstarted_orders.values_list(
+                'order_id', flat=True),
+            [3, 4, 5])
+        self.assert_stats_match_finished_orders()
+
+    def test_complete_orders_again(self):
+        self.client.post(self.url, {'data': [self.completion(1),
+                                             self.completion(2)]},
+                         format='json')
+        response = self.client.post(
+            self.url, {'data': [self.completion(1, minutes=20),
+                                self.completion(3, minutes=10)]},
+            format='json')
+        self.assertTrue(all(item['success']
+                            for item in response.data['orders']))
+        self.assertEqual(self.order_set.finished_orders.count(), 3)
+        self.assert_stats_match_finished_orders()
+
+    def test_number_of_queries_doesnt_depend_on_orders(self):
+        number_of_queries = []
+        for order_ids in ([1, 2], [3, 4, 5]):
+            data = [self.completion(order_id) for order_id in order_ids]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, {'data': data}, format='json')
+            number_of_queries.append(len(queries))
+        self.assertEqual(number_of_queries[0], number_of_queries[1])
+
+    def test_invalid_data(self):
+        for data in ([], [{'order_id': 1}], None):
+            response = self.client.post(self.url, {'data': data},
+                                        format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.order_set.finished_orders.count(), 0)
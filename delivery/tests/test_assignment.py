@@ -0,0 +1,111 @@
+"""
+The tests of the order assignment strategies.
+"""
+
+import itertools
+import random
+from collections import namedtuple
+from datetime import time
+from decimal import Decimal
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from ..assignment import (
+    greedy, first_fit_decreasing, knapsack, get_assignment_strategy)
+from ..models import Courier, Region, WorkingHours, Order, DeliveryHours
+
+
+CandidateOrder = namedtuple('CandidateOrder', ['order_id', 'weight'])
+
+
+def total_weight(orders):
+    return sum(order.weight for order in orders)
+
+
+class AssignmentStrategiesTestCase(SimpleTestCase):
+    """
+    The test case for the strategies of packing orders.
+    """
+
+    def setUp(self):
+        weights = ['6', '5', '5', '0.5', '3.3']
+        self.orders = [CandidateOrder(order_id, Decimal(weight))
+                       for order_id, weight in enumerate(weights, start=1)]
+
+    def test_greedy(self):
+        orders = greedy(self.orders, 10)
+        self.assertEqual([order.order_id for order in orders], [4, 5, 2])
+        self.assertEqual(total_weight(orders), Decimal('8.8'))
+
+    def test_first_fit_decreasing(self):
+        orders = first_fit_decreasing(self.orders, 10)
+        self.assertEqual([order.order_id for order in orders], [1, 5, 4])
+        self.assertEqual(total_weight(orders), Decimal('9.8'))
+
+    def test_knapsack(self):
+        orders = knapsack(self.orders, 10)
+        self.assertEqual([order.order_id for order in orders], [2, 3])
+        self.assertEqual(total_weight(orders), Decimal('10'))
+
+    def test_knapsack_finds_the_best_total_weight(self):
+        rand = random.Random(0)
+        for _ in range(20):
+            orders = [CandidateOrder(order_id, Decimal(rand.randint(1, 1500)) / 100)
+                      for order_id in range(8)]
+            best_weight = max(
+                total_weight(combination)
+                for size in range(len(orders) + 1)
+                for combination in itertools.combinations(orders, size)
+                if total_weight(combination) <= 15)
+            self.assertEqual(total_weight(knapsack(orders, 15)), best_weight)
+
+    def test_strategies_when_nothing_fits(self):
+        for strategy in (greedy, first_fit_decreasing, knapsack):
+            self.assertEqual(strategy(self.orders, Decimal('0.4')), [])
+            self.assertEqual(strategy([], 10), [])
+
+    def test_get_assignment_strategy(self):
+        self.assertIs(get_assignment_strategy('knapsack'), knapsack)
+        self.assertIs(
+            get_assignment_strategy('delivery.assignment.greedy'), greedy)
+        with override_settings(ORDER_ASSIGNMENT_STRATEGY='greedy'):
+            self.assertIs(get_assignment_strategy(), greedy)
+
+    def test_get_unknown_assignment_strategy(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_assignment_strategy('unknown')
+
+
+class CourierAssignOrdersCapacityTestCase(TestCase):
+    """
+    The test case for load capacity of the sets created by assign_orders.
+    """
+
+    def setUp(self):
+        self.region = Region.objects.create(id=1)
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='foot')
+        self.courier.regions.set([self.region])
+        WorkingHours.objects.create(
+            start=time(hour=9), end=time(hour=18), courier=self.courier)
+
+        for order_id, weight in enumerate([6, 5, 5, 0.5, 3.3], start=1):
+            order = Order.objects.create(
+                order_id=order_id, weight=weight, region=self.region)
+            DeliveryHours.objects.create(
+                start=time(hour=10), end=time(hour=12), order=order)
+
+    @override_settings(ORDER_ASSIGNMENT_STRATEGY='first_fit_decreasing')
+    def test_assigned_set_fits_load_capacity(self):
+        order_set = self.courier.assign_orders()
+        orders = order_set.notstarted_orders.all()
+        self.assertCountEqual(
+            [order.order_id for order in orders], [1, 4, 5])
+        self.assertEqual(Order.objects.filter(set_of_orders=None).count(), 2)
+
+    @override_settings(ORDER_ASSIGNMENT_STRATEGY='knapsack')
+    def test_assigned_set_with_knapsack(self):
+        order_set = self.courier.assign_orders()
+        self.assertEqual(
+            total_weight(order_set.notstarted_orders.all()), Decimal('10'))
@@ -0,0 +1,101 @@
+"""
+The tests of the benchmark suite.
+"""
+
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from ..management.commands.benchmark_suite import Command
+from ..models import Courier, Order
+
+
+class BenchmarkSuiteTestCase(TestCase):
+    """
+    The test case for benchmark_suite command.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'results.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_suite(self, **options):
+        stdout = StringIO()
+        call_command('benchmark_suite', sizes=[20], repeat=1,
+                     stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_results(self):
+        self.run_suite(output=self.output)
+
+        with open(self.output) as file:
+            results = json.load(file)['results']
+        names = {result['name'] for result in results}
+        self.assertLessEqual({
+            'find_matching_orders[car]', '_filter_orders_by_delivery_hours',
+            'Courier.rating', 'Courier.earnings', 'remove_unsuitable_orders',
+            'OrderSerializer[many]', 'CourierItemPostSerializer[many]',
+        }, names)
+        for result in results:
+            self.assertEqual(result['size'], 20)
+            self.assertGreater(result['queries'], 0)
+            self.assertGreaterEqual(result['median_ms'], result['min_ms'])
+
+        # The data are rolled back
+        self.assertFalse(Courier.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_baseline(self):
+        self.run_suite(output=self.output, only=['Courier.'])
+        baseline = os.path.join(self.directory.name, 'baseline.json')
+        with open(self.output) as file:
+            results = json.load(file)
+
+        # The same number of queries isn't a regression
+        for result in results['results']:
+            result['median_ms'] = 1000
+        with open(baseline, 'w') as file:
+            json.dump(results, file)
+        output = self.run_suite(baseline=baseline, only=['Courier.'])
+        self.assertNotIn('REGRESSION', output)
+
+        results['results'][0]['queries'] = 0
+        with open(baseline, 'w') as file:
+            json.dump(results, file)
+        with self.assertRaisesMessage(
+                CommandError, 'Regressions against the baseline: 1'):
+            self.run_suite(baseline=baseline, only=['Courier.'])
+
+    def test_different_queries(self):
+        command = Command()
+        command.repeat = 3
+        runs = []
+
+        def function():
+            runs.append(None)
+            for _ in runs:
+                Courier.objects.exists()
+
+        with self.assertRaisesMessage(
+                CommandError,
+                'The runs of function make different numbers of queries: '
+                '[2, 3, 4]'):
+            command._measure('function', function)
+
+    def test_finished_orders_are_delivered_after_assignment(self):
+        command = Command()
+        command._create_data(random.Random(0), 20)
+
+        courier = command.couriers['bike']
+        rating, _ = courier.get_rating_and_earnings()
+        self.assertGreaterEqual(rating, 0)
+        self.assertLessEqual(rating, 5)
+        self.assertEqual(courier.rating, rating)
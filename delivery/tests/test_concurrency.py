@@ -0,0 +1,128 @@
+"""
+The stress tests of concurrent assignment.
+
+They need a database supporting SELECT ... FOR UPDATE SKIP LOCKED
+(PostgreSQL) and are skipped on other databases.
+"""
+
+import threading
+import unittest
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+
+from ..models import Courier, Order, AssignedOrderSet
+from ..serializers import CourierItemPostSerializer, OrderSerializer
+
+
+THREADS = 16
+ORDERS = 400
+
+
+@unittest.skipUnless(connection.features.has_select_for_update_skip_locked,
+                     'The database does not support SKIP LOCKED')
+class ConcurrentAssignmentTestCase(TransactionTestCase):
+    """
+    Many threads assign orders at once, each with its own connection.
+    """
+
+    def setUp(self):
+        couriers = [
+            {'courier_id': courier_id, 'courier_type': 'foot',
+             'regions': [1, 2], 'working_hours': ['09:00-18:00']}
+            for courier_id in range(1, THREADS * 2 + 1)
+        ]
+        serializer = CourierItemPostSerializer(data=couriers, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        orders = [
+            {'order_id': order_id, 'weight': 1, 'region': order_id % 2 + 1,
+             'delivery_hours': ['10:00-11:00']}
+            for order_id in range(1, ORDERS + 1)
+        ]
+        serializer = OrderSerializer(data=orders, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def run_in_threads(self, targets):
+        barrier = threading.Barrier(len(targets))
+        errors = []
+
+        def run(target):
+            try:
+                barrier.wait()
+                target()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(target,))
+                   for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assert_no_double_assignment(self):
+        assigned_orders = Order.objects.exclude(set_of_orders=None)
+        self.assertTrue(assigned_orders.exists())
+        self.assertFalse(assigned_orders.exclude(status='assigned').exists())
+        self.assertFalse(Order.objects.filter(
+            set_of_orders=None).exclude(status='new').exists())
+
+        # There are enough orders to fill each set up to the load
+        # capacity, so a set with fewer orders lost some of them
+        # to another set
+        for order_set in AssignedOrderSet.objects.all():
+            self.assertEqual(order_set.notstarted_orders.count(), 10)
+            self.assertEqual(
+                order_set.courier.current_set_of_orders_id, order_set.id)
+
+        # Each courier has at most 1 set
+        self.assertEqual(
+            AssignedOrderSet.objects.count(),
+            len(set(AssignedOrderSet.objects.values_list('courier', flat=True))))
+
+    def test_assign_orders_in_parallel(self):
+        couriers = list(Courier.objects.all())
+        self.run_in_threads(
+            [courier.assign_orders for courier in couriers[:THREADS]])
+        self.assert_no_double_assignment()
+
+    def test_same_courier_in_parallel(self):
+        courier = Courier.objects.get(courier_id=1)
+        self.run_in_threads([courier.assign_orders] * THREADS)
+        self.assertEqual(AssignedOrderSet.objects.count(), 1)
+        self.assert_no_double_assignment()
+
+    def test_single_and_batch_assignment_in_parallel(self):
+        couriers = list(Courier.objects.all())
+        targets = [courier.assign_orders for courier in couriers[:THREADS]]
+        for index in range(THREADS, THREADS * 2, 4):
+            queryset = Courier.objects.filter(
+                courier_id__in=[courier.courier_id
+                                for courier in couriers[index:index + 4]])
+            targets.append(queryset.assign_orders)
+        self.run_in_threads(targets)
+        self.assert_no_double_assignment()
+
+    def test_only_assigned_orders_are_locked(self):
+        courier = Courier.objects.get(courier_id=1)
+        not_locked_counts = []
+
+        @transaction.atomic
+        def count_not_locked():
+            not_locked_counts.append(len(Order.objects.select_for_update(
+                skip_locked=True).filter(set_of_orders=None)))
+
+        with transaction.atomic():
+            order_set = courier.assign_orders()
+            # The other matching orders can be claimed by another
+            # connection meanwhile
+            self.run_in_threads([count_not_locked])
+            self.assertEqual(
+                not_locked_counts,
+                [ORDERS - order_set.notstarted_orders.count()])
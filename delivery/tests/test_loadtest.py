@@ -0,0 +1,101 @@
+"""
+The tests of the synthetic dataset and the load test commands.
+"""
+
+import random
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase
+
+from ..dataset import generate_couriers, generate_orders, get_next_id
+from ..management.commands.loadtest import get_percentile, parse_mix
+from ..models import Courier, Order
+
+
+class DatasetTestCase(TestCase):
+    """
+    The test case for the generation of the dataset.
+    """
+
+    def test_same_seed_gives_same_data(self):
+        self.assertEqual(generate_orders(random.Random(1), 1, 50, 10),
+                         generate_orders(random.Random(1), 1, 50, 10))
+        self.assertNotEqual(generate_orders(random.Random(1), 1, 50, 10),
+                            generate_orders(random.Random(2), 1, 50, 10))
+
+    def test_generate_dataset(self):
+        call_command('generate_dataset', couriers=30, orders=200, regions=5,
+                     batch_size=70, stdout=StringIO())
+        self.assertEqual(Courier.objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 200)
+        self.assertEqual(
+            set(Courier.objects.values_list('courier_type', flat=True)),
+            {'foot', 'bike', 'car'})
+
+        # The ids continue after the existing ones
+        call_command('generate_dataset', couriers=5, orders=10, regions=5,
+                     stdout=StringIO())
+        self.assertEqual(Order.objects.count(), 210)
+
+        call_command('generate_dataset', couriers=5, orders=10, regions=5,
+                     flush=True, stdout=StringIO())
+        self.assertEqual(Courier.objects.count(), 5)
+        self.assertEqual(Order.objects.count(), 10)
+
+    def test_get_next_id(self):
+        self.assertEqual(get_next_id(Order, 'order_id'), 1)
+        call_command('generate_dataset', couriers=5, orders=10, regions=5,
+                     stdout=StringIO())
+        self.assertEqual(get_next_id(Order, 'order_id'), 11)
+        self.assertEqual(get_next_id(Courier, 'courier_id'), 6)
+
+    def test_couriers(self):
+        couriers = generate_couriers(random.Random(0), 10, 100, 3)
+        self.assertEqual([courier['courier_id'] for courier in couriers],
+                         list(range(10, 110)))
+        for courier in couriers:
+            self.assertTrue(set(courier['regions']) <= {1, 2, 3})
+
+
+class LoadTestUtilsTestCase(SimpleTestCase):
+    """
+    The test case for the helpers of loadtest command.
+    """
+
+    def test_get_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(get_percentile(values, 50), 50)
+        self.assertEqual(get_percentile(values, 99), 99)
+        self.assertEqual(get_percentile([7], 95), 7)
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('assign=3,complete=1'),
+                         {'assign': 3, 'complete': 1})
+        with self.assertRaises(ValueError):
+            parse_mix('delete=1')
+
+
+class LoadTestTestCase(LiveServerTestCase):
+    """
+    The test case for loadtest command against the live server.
+    """
+
+    def test_loadtest(self):
+        call_command('generate_dataset', couriers=10, orders=100, regions=3,
+                     stdout=StringIO())
+        stdout = StringIO()
+        call_command('loadtest', url=self.live_server_url, requests=60,
+                     concurrency=1, regions=3, stdout=stdout)
+
+        lines = stdout.getvalue().splitlines()
+        self.assertTrue(lines[-1].startswith('60 requests in'))
+        rows = {line.split()[0]: line.split() for line in lines[1:-1]}
+        self.assertEqual(rows['total'][1], '60')
+        # All the requests are answered without server errors
+        for operation, row in rows.items():
+            if operation != 'total':
+                self.assertNotIn('error', ' '.join(row[5:]))
+                self.assertFalse(any(status.startswith('5')
+                                     for status in row[5:]))
+        self.assertGreater(Order.objects.filter(status='finished').count(), 0)
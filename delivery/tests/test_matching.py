@@ -0,0 +1,208 @@
+"""
+The tests of the vectorized matching of orders.
+"""
+
+import random
+import unittest
+from collections import namedtuple
+from datetime import time
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..matching import OrderColumns, get_minutes_intervals
+from ..models import (Courier, DeliveryHours, Order, WorkingHours,
+                      get_hours_mask, have_intersecting_hours)
+from ..serializers import CourierItemPostSerializer, OrderSerializer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+Item = namedtuple('Item', ['order_id', 'weight'])
+
+
+def get_random_interval(rand):
+    return (time(hour=rand.randint(0, 23), minute=rand.choice([0, 30])),
+            time(hour=rand.randint(0, 23), minute=rand.choice([0, 30])))
+
+
+class MinutesIntervalsTestCase(SimpleTestCase):
+    """
+    The test case for get_minutes_intervals.
+    """
+
+    def test_get_minutes_intervals(self):
+        self.assertEqual(
+            get_minutes_intervals([(time(hour=9), time(hour=12, minute=30))]),
+            [(540, 750)])
+        self.assertEqual(
+            get_minutes_intervals([(time(hour=22), time(hour=1))]),
+            [(1320, 1440), (0, 60)])
+        self.assertEqual(
+            get_minutes_intervals([(time(hour=9), time(hour=9)),
+                                   (time(hour=22), time(hour=0))]),
+            [(1320, 1440)])
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class OrderColumnsTestCase(SimpleTestCase):
+    """
+    The test case for OrderColumns.
+    """
+
+    def setUp(self):
+        weights = ['5', '0.5', '12', '1', '2']
+        self.orders = [Item(order_id, Decimal(weight))
+                       for order_id, weight in enumerate(weights, start=1)]
+        windows = [
+            (1, time(hour=9), time(hour=11)),
+            (2, time(hour=18), time(hour=19)),
+            (2, time(hour=10), time(hour=11)),
+            (3, time(hour=9), time(hour=10)),
+            (4, time(hour=23), time(hour=2)),
+            (5, time(hour=11), time(hour=12)),
+            # The order that isn't loaded
+            (6, time(hour=10), time(hour=11)),
+        ]
+        self.columns = OrderColumns(
+            list(reversed(self.orders)), [2, 1, 1, 1, 1], windows)
+
+    def get_ids(self, orders):
+        return [order.order_id for order in orders]
+
+    def test_match(self):
+        orders = self.columns.match(
+            [(time(hour=10), time(hour=12))], region_ids=[1], capacity=10)
+        self.assertEqual(self.get_ids(orders), [1, 2])
+
+        orders = self.columns.match([(time(hour=8), time(hour=12))])
+        self.assertEqual(self.get_ids(orders), [1, 2, 3, 5])
+
+    def test_match_passing_midnight(self):
+        orders = self.columns.match([(time(hour=1), time(hour=3))])
+        self.assertEqual(self.get_ids(orders), [4])
+        orders = self.columns.match([(time(hour=22), time(hour=23))])
+        self.assertEqual(self.get_ids(orders), [])
+
+    def test_take(self):
+        self.columns.take([self.orders[0], self.orders[4]])
+        orders = self.columns.match([(time(hour=8), time(hour=12))])
+        self.assertEqual(self.get_ids(orders), [2, 3])
+
+    def test_match_is_the_same_as_masks(self):
+        rand = random.Random(0)
+        orders = [Item(order_id, Decimal(rand.randint(1, 5000)) / 100)
+                  for order_id in range(1, 301)]
+        windows = [(order.order_id, *get_random_interval(rand))
+                   for order in orders for _ in range(rand.randint(1, 3))]
+        columns = OrderColumns(
+            orders, [rand.randint(1, 5) for _ in orders], windows)
+
+        for _ in range(20):
+            working_hours = [get_random_interval(rand)
+                             for _ in range(rand.randint(1, 3))]
+            working_hours_mask = get_hours_mask(working_hours)
+            expected_ids = [
+                order.order_id for order in orders
+                if have_intersecting_hours(working_hours_mask, get_hours_mask(
+                    (start, end) for order_id, start, end in windows
+                    if order_id == order.order_id))
+            ]
+            self.assertEqual(self.get_ids(columns.match(working_hours)),
+                             expected_ids)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class VectorizedAssignmentTestCase(TestCase):
+    """
+    The test case for the assignment with the vectorized matching.
+    """
+
+    def setUp(self):
+        serializer = CourierItemPostSerializer(data=[
+            {'courier_id': 1, 'courier_type': 'foot', 'regions': [1, 2],
+             'working_hours': ['09:00-12:00']},
+            {'courier_id': 2, 'courier_type': 'car', 'regions': [2, 3],
+             'working_hours': ['11:00-14:00', '18:00-20:00']},
+        ], many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        serializer = OrderSerializer(data=[
+            {'order_id': 1, 'weight': 4, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 2, 'weight': 11, 'region': 2,
+             'delivery_hours': ['11:30-12:30']},
+            {'order_id': 3, 'weight': 4, 'region': 2,
+             'delivery_hours': ['08:00-09:00', '19:00-20:00']},
+            {'order_id': 4, 'weight': 4, 'region': 3,
+             'delivery_hours': ['13:00-15:00']},
+            {'order_id': 5, 'weight': 5, 'region': 2,
+             'delivery_hours': ['11:00-11:30']},
+        ], many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def get_matching_ids(self, courier):
+        return [order.order_id for order in courier.find_matching_orders()]
+
+    def test_find_matching_orders(self):
+        for courier in Courier.objects.all():
+            expected_ids = self.get_matching_ids(courier)
+            with override_settings(ORDER_MATCHING_VECTORIZED=True):
+                self.assertEqual(self.get_matching_ids(courier), expected_ids)
+
+    def test_find_matching_orders_with_random_hours(self):
+        # The random hours pass midnight or are empty sometimes
+        rand = random.Random(0)
+        for order_id in range(6, 106):
+            order = Order.objects.create(
+                order_id=order_id, weight=1, region_id=rand.randint(1, 3))
+            for _ in range(rand.randint(1, 2)):
+                start, end = get_random_interval(rand)
+                DeliveryHours.objects.create(start=start, end=end, order=order)
+
+        courier = Courier.objects.get(courier_id=2)
+        for _ in range(10):
+            courier.working_hours.all().delete()
+            for _ in range(rand.randint(1, 2)):
+                start, end = get_random_interval(rand)
+                WorkingHours.objects.create(
+                    start=start, end=end, courier=courier)
+            expected_ids = self.get_matching_ids(courier)
+            with override_settings(ORDER_MATCHING_VECTORIZED=True):
+                self.assertEqual(self.get_matching_ids(courier), expected_ids)
+
+    @override_settings(ORDER_MATCHING_VECTORIZED=True)
+    def test_batch_assign_orders(self):
+        order_sets = Courier.objects.all().assign_orders()
+
+        assigned_ids = {
+            courier.courier_id: set(order_set.notstarted_orders.values_list(
+                'order_id', flat=True))
+            for courier, order_set in order_sets.items()
+        }
+        self.assertEqual(assigned_ids, {1: {1, 5}, 2: {2, 3, 4}})
+        self.assertFalse(Order.objects.filter(status='new').exists())
+
+    @override_settings(ORDER_MATCHING_VECTORIZED=True)
+    def test_remove_unsuitable_orders(self):
+        courier = Courier.objects.get(courier_id=2)
+        order_set = courier.assign_orders()
+        for order_id in range(6, 56):
+            Order.objects.create(order_id=order_id, weight=1, region_id=2,
+                                 set_of_orders=order_set, status='assigned')
+        courier.working_hours.all().delete()
+        WorkingHours.objects.create(
+            start=time(hour=11), end=time(hour=12), courier=courier)
+
+        # The orders of the set are loaded with 2 queries, whatever
+        # the size of the set
+        with self.assertNumQueries(7):
+            courier.remove_unsuitable_orders()
+        self.assertEqual(
+            list(order_set.notstarted_orders.values_list(
+                'order_id', flat=True)), [2, 5])
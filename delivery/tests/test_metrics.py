@@ -0,0 +1,137 @@
+"""
+The tests of the Prometheus metrics.
+"""
+
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from ..cache import get_courier_cache
+from ..metrics import registry
+from ..timing import measure_serializers, observe_serializer
+
+
+def get_value(name, **labels):
+    return registry.get_sample_value(name, labels) or 0
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTestCase(TransactionTestCase):
+    """
+    The test case for MetricsMiddleware and the metrics endpoint.
+    """
+
+    def setUp(self):
+        get_courier_cache().clear()
+        # The middleware is loaded by the first request of a client
+        self.client = self.client_class()
+        self.client.post(reverse('couriers'), {'data': [
+            {'courier_id': 1, 'courier_type': 'foot', 'regions': [1],
+             'working_hours': ['09:00-18:00']},
+        ]}, content_type='application/json')
+        self.client.post(reverse('orders'), {'data': [
+            {'order_id': 1, 'weight': 1, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 2, 'weight': 2, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 3, 'weight': 3, 'region': 2,
+             'delivery_hours': ['10:00-11:00']},
+        ]}, content_type='application/json')
+
+    def test_request_metrics(self):
+        labels = {'view': 'courier-item', 'method': 'GET'}
+        counts = {
+            name: get_value(f'{name}_count', **labels)
+            for name in ['delivery_request_duration_seconds',
+                         'delivery_db_duration_seconds',
+                         'delivery_serializer_duration_seconds']
+        }
+        db_time = get_value('delivery_db_duration_seconds_sum', **labels)
+        serializer_time = get_value(
+            'delivery_serializer_duration_seconds_sum', **labels)
+
+        response = self.client.get(reverse('courier-item', args=[1]))
+        self.assertEqual(response.status_code, 200)
+
+        for name, count in counts.items():
+            self.assertEqual(get_value(f'{name}_count', **labels), count + 1)
+        # The details aren't cached yet, so they are read and serialized
+        self.assertGreater(
+            get_value('delivery_db_duration_seconds_sum', **labels), db_time)
+        self.assertGreater(
+            get_value('delivery_serializer_duration_seconds_sum', **labels),
+            serializer_time)
+
+    def test_orders_counters(self):
+        assigned = get_value('delivery_orders_assigned_total')
+        completed = get_value('delivery_orders_completed_total')
+
+        response = self.client.post(reverse('orders-assign'),
+                                    {'courier_id': 1},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_value('delivery_orders_assigned_total'),
+                         assigned + 2)
+
+        response = self.client.post(reverse('orders-complete'), {
+            'courier_id': 1, 'order_id': 1,
+            'complete_time': '2021-01-10T10:33:01.42Z',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        # The failed completion isn't counted
+        self.client.post(reverse('orders-complete'), {
+            'courier_id': 1, 'order_id': 3,
+            'complete_time': '2021-01-10T10:33:01.42Z',
+        }, content_type='application/json')
+        self.assertEqual(get_value('delivery_orders_completed_total'),
+                         completed + 1)
+
+    def test_cache_counters(self):
+        hits = get_value('delivery_courier_cache_hits_total')
+        misses = get_value('delivery_courier_cache_misses_total')
+
+        for _ in range(3):
+            self.client.get(reverse('courier-item', args=[1]))
+        self.assertEqual(get_value('delivery_courier_cache_hits_total'),
+                         hits + 2)
+        self.assertEqual(get_value('delivery_courier_cache_misses_total'),
+                         misses + 1)
+
+    def test_endpoint(self):
+        self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                         content_type='application/json')
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn('delivery_pending_orders 1.0', content)
+        self.assertIn('delivery_request_duration_seconds_bucket{'
+                      'le="0.0005",method="POST",view="orders-assign"}',
+                      content)
+        self.assertIn('delivery_orders_assigned_total', content)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.client = self.client_class()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 404)
+
+
+class SerializerTimerTestCase(SimpleTestCase):
+    """
+    The test case for the time of the serializers of a request.
+    """
+
+    def test_nested_serializers_are_counted_once(self):
+        with measure_serializers() as timer:
+            with observe_serializer():
+                with observe_serializer():
+                    pass
+                inner_duration = timer.duration
+        self.assertEqual(inner_duration, 0)
+        self.assertGreater(timer.duration, 0)
+        self.assertEqual(timer.depth, 0)
+
+    def test_not_measured(self):
+        with observe_serializer():
+            pass
@@ -0,0 +1,161 @@
+"""
+The tests of the middleware.
+"""
+
+import os
+import pstats
+import re
+import tempfile
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from ..cache import get_courier_cache
+from ..middleware import QueryStats
+
+
+class QueryStatsMiddlewareTestCase(APITestCase):
+    """
+    The test case for QueryStatsMiddleware.
+    """
+
+    def setUp(self):
+        get_courier_cache().clear()
+        self.client.post(reverse('couriers'), {'data': [
+            {'courier_id': 1, 'courier_type': 'foot', 'regions': [1, 2],
+             'working_hours': ['09:00-18:00']},
+        ]}, format='json')
+
+    @override_settings(QUERY_STATS_ENABLED=True)
+    def test_server_timing_and_log(self):
+        # The middleware is loaded by the first request of a client
+        self.client = self.client_class()
+        url = reverse('courier-item', args=[1])
+        with self.assertLogs('delivery.queries', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        match = re.fullmatch(
+            r'db;desc="(\d+) queries";dur=[\d.]+, db-slowest;dur=[\d.]+',
+            response['Server-Timing'])
+        self.assertIsNotNone(match)
+        self.assertEqual(int(match.group(1)), len(queries))
+
+        self.assertEqual(len(logs.records), 1)
+        query_stats = logs.records[0].query_stats
+        self.assertEqual(query_stats['path'], url)
+        self.assertEqual(query_stats['status'], 200)
+        self.assertEqual(query_stats['queries'], len(queries))
+        self.assertIn('SELECT', query_stats['slowest_sql'])
+        self.assertIn(f'queries={len(queries)}', logs.output[0])
+
+    def test_disabled(self):
+        response = self.client.get(reverse('courier-item', args=[1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class QueryStatsTestCase(APITestCase):
+    """
+    The test case for QueryStats.
+    """
+
+    def test_failed_query_is_counted(self):
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            with self.assertRaises(Exception):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT * FROM unknown_table')
+
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.slowest_sql, 'SELECT * FROM unknown_table')
+
+
+class ProfilingMiddlewareTestCase(APITestCase):
+    """
+    The test case for ProfilingMiddleware.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            PROFILING_DIR=self.directory.name)
+        self.settings_override.enable()
+        # The middleware is loaded by the first request of a client
+        self.client = self.client_class()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def get_profiles(self):
+        return sorted(name for name in os.listdir(self.directory.name)
+                      if name.endswith('.pstats'))
+
+    @override_settings(PROFILING_SECRET='secret')
+    def test_profile_header(self):
+        self.client = self.client_class()
+        response = self.client.get(reverse('courier-item', args=[1]))
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual(self.get_profiles(), [])
+
+        response = self.client.get(reverse('courier-item', args=[1]),
+                                   HTTP_X_PROFILE='secret')
+        self.assertEqual(response.status_code, 404)
+        filename = response['X-Profile']
+        self.assertEqual(self.get_profiles(), [filename])
+        self.assertTrue(filename.startswith('courier-item.'))
+
+        stats = pstats.Stats(os.path.join(self.directory.name, filename))
+        self.assertTrue(any(function == 'get' for _, _, function
+                            in stats.stats))
+
+    def test_profile_header_is_ignored(self):
+        # Without DEBUG and PROFILING_SECRET
+        response = self.client.get(reverse('courier-item', args=[1]),
+                                   HTTP_X_PROFILE='1')
+        self.assertFalse(response.has_header('X-Profile'))
+
+        with self.settings(PROFILING_SECRET='secret'):
+            self.client = self.client_class()
+            response = self.client.get(reverse('courier-item', args=[1]),
+                                       HTTP_X_PROFILE='1')
+        self.assertFalse(response.has_header('X-Profile'))
+        self.assertEqual(self.get_profiles(), [])
+
+    @override_settings(DEBUG=True)
+    def test_profile_header_with_debug(self):
+        self.client = self.client_class()
+        response = self.client.get(reverse('courier-item', args=[1]),
+                                   HTTP_X_PROFILE='1')
+        self.assertEqual(self.get_profiles(), [response['X-Profile']])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sample_rate(self):
+        self.client = self.client_class()
+        self.client.get(reverse('courier-item', args=[1]))
+        self.client.post(reverse('orders-assign'), {'courier_id': 1},
+                         format='json')
+
+        profiles = self.get_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual({name.split('.')[0] for name in profiles},
+                         {'courier-item', 'orders-assign'})
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_MAX_SIZE=1)
+    def test_max_size(self):
+        self.client = self.client_class()
+        for _ in range(3):
+            self.client.get(reverse('courier-item', args=[1]))
+        self.assertEqual(self.get_profiles(), [])
+
+    @override_settings(PROFILING_DIR='')
+    def test_disabled(self):
+        self.client = self.client_class()
+        response = self.client.get(reverse('courier-item', args=[1]),
+                                   HTTP_X_PROFILE='1')
+        self.assertFalse(response.has_header('X-Profile'))
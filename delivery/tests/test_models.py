@@ -2,13 +2,17 @@
 The tests of models.
 """
 
+import random
 from datetime import datetime, time, timezone, timedelta
 
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import FieldError
 
 from ..models import (
-    Courier, Region, WorkingHours, Order, DeliveryHours, AssignedOrderSet
+    Courier, Region, WorkingHours, Order, DeliveryHours, AssignedOrderSet,
+    CourierRegionStats, get_hours_mask, have_intersecting_hours,
 )
 
 
@@ -116,7 +120,10 @@ class CourierAssignOrdersTestCase(TestCase):
             courier=self.courier, courier_type=self.courier.courier_type)
 
     def test_assign_orders_when_current_set_of_orders_isnt_empty(self):
-        self.order_set.notstarted_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.set_of_orders = self.order_set
+            order.status = 'assigned'
+            order.save()
         self.courier.current_set_of_orders = self.order_set
         self.courier.save()
         order_set = self.courier.assign_orders()
@@ -233,6 +240,181 @@ class CourierAssignOrdersTestCase(TestCase):
         orders = self.courier.find_matching_orders()
         self.assertEqual(len(orders), 1)
 
+    def test_find_orders_delivery_hours_filter_does_not_duplicate(self):
+        DeliveryHours.objects.create(
+            start=time(hour=10), end=time(hour=11), order=self.order_1)
+        DeliveryHours.objects.create(
+            start=time(hour=19), end=time(hour=20), order=self.order_1)
+        orders = self.courier.find_matching_orders()
+        self.assertEqual(list(orders), [self.order_1])
+
+    def test_find_orders_makes_one_query(self):
+        for order_id in range(3, 13):
+            order = Order.objects.create(
+                order_id=order_id, weight=1, region=self.region_1)
+            DeliveryHours.objects.create(
+                start=time(hour=10), end=time(hour=11), order=order)
+        with self.assertNumQueries(1):
+            orders = list(self.courier.find_matching_orders())
+        self.assertEqual(len(orders), 11)
+
+
+class HoursMaskTestCase(TestCase):
+    """
+    The test case for the hours masks of couriers and orders.
+    """
+
+    def setUp(self):
+        self.region = Region.objects.create(id=1)
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='foot')
+        self.courier.regions.set([self.region])
+        WorkingHours.objects.create(
+            start=time(hour=9), end=time(hour=12), courier=self.courier)
+        WorkingHours.objects.create(
+            start=time(hour=18), end=time(hour=20), courier=self.courier)
+        self.courier.update_working_hours_mask()
+        self.order = Order.objects.create(
+            order_id=1, weight=1, region=self.region)
+
+    def set_delivery_hours(self, *intervals):
+        self.order.delivery_hours.all().delete()
+        for start, end in intervals:
+            DeliveryHours.objects.create(start=start, end=end, order=self.order)
+        self.order.update_delivery_hours_mask()
+
+    def test_get_hours_mask(self):
+        mask = get_hours_mask([(time(hour=0), time(hour=0, minute=2))])
+        self.assertEqual(len(mask), 180)
+        self.assertEqual(int.from_bytes(mask, 'big'), 0b11)
+
+    def test_get_hours_mask_passing_midnight(self):
+        mask = get_hours_mask([(time(hour=23, minute=59), time(minute=1))])
+        self.assertEqual(int.from_bytes(mask, 'big'), (1 << 1439) | 1)
+
+    def test_have_intersecting_hours(self):
+        mask_1 = get_hours_mask([(time(hour=9), time(hour=12))])
+        mask_2 = get_hours_mask([(time(hour=11, minute=59), time(hour=13))])
+        mask_3 = get_hours_mask([(time(hour=12), time(hour=13))])
+        self.assertTrue(have_intersecting_hours(mask_1, mask_2))
+        self.assertFalse(have_intersecting_hours(mask_1, mask_3))
+
+    def test_mask_check_matches_sql_check(self):
+        cases = [
+            [(time(hour=8), time(hour=9)), (time(hour=17), time(hour=18))],
+            [(time(hour=8), time(hour=9, minute=1))],
+            [(time(hour=12), time(hour=14)), (time(hour=20), time(hour=21))],
+            [(time(hour=11, minute=59), time(hour=13))],
+            [(time(hour=10), time(hour=11))],
+            [(time(hour=7), time(hour=22))],
+            [(time(hour=9), time(hour=12))],
+            [(time(hour=21), time(hour=9, minute=1))],
+            [(time(hour=20), time(hour=9))],
+            [(time(hour=10), time(hour=10))],
+        ]
+        for intervals in cases:
+            self.set_delivery_hours(*intervals)
+            in_sql = self.order in self.courier.find_matching_orders()
+            in_memory = self.courier._has_intersecting_hours_mask(self.order)
+            self.assertEqual(in_sql, in_memory, intervals)
+
+    def test_hours_passing_midnight(self):
+        self.courier.working_hours.all().delete()
+        WorkingHours.objects.create(
+            start=time(hour=22), end=time(hour=2), courier=self.courier)
+        self.courier.update_working_hours_mask()
+
+        cases = [
+            ([(time(hour=1), time(hour=3))], True),
+            ([(time(hour=21), time(hour=22, minute=1))], True),
+            ([(time(hour=23), time(hour=1))], True),
+            ([(time(hour=2), time(hour=22))], False),
+            ([(time(hour=3), time())], True),
+            ([(time(hour=2, minute=1), time(hour=21))], False),
+            ([(time(hour=3), time(hour=3))], False),
+        ]
+        for intervals, expected in cases:
+            self.set_delivery_hours(*intervals)
+            in_sql = self.order in self.courier.find_matching_orders()
+            in_memory = self.courier._has_intersecting_hours_mask(self.order)
+            self.assertEqual(in_sql, expected, intervals)
+            self.assertEqual(in_memory, expected, intervals)
+
+
+class CourierQuerySetAssignOrdersTestCase(TestCase):
+    """
+    The test case for assign_orders() of many couriers at once.
+    """
+
+    def setUp(self):
+        for region_number in (1, 2):
+            Region.objects.create(id=region_number)
+
+        couriers = [
+            (1, 'foot', [1, 2], [(time(hour=22), time(hour=2))]),
+            (2, 'bike', [1], [(time(hour=9), time(hour=12))]),
+            (3, 'car', [2], [(time(hour=23), time(hour=23)),
+                             (time(hour=10), time(hour=11))]),
+        ]
+        for courier_id, courier_type, regions, working_hours in couriers:
+            courier = Courier.objects.create(
+                courier_id=courier_id, courier_type=courier_type)
+            courier.regions.set(regions)
+            for start, end in working_hours:
+                WorkingHours.objects.create(
+                    start=start, end=end, courier=courier)
+            courier.update_working_hours_mask()
+
+        orders = [
+            (1, 3, 1, (time(hour=1), time(hour=3))),
+            (2, 3, 1, (time(hour=23, minute=30), time(minute=30))),
+            (3, 4, 1, (time(hour=10), time(hour=11))),
+            (4, 2, 2, (time(hour=11, minute=30), time(hour=12))),
+            (5, 5, 2, (time(hour=10, minute=30), time(hour=10, minute=45))),
+            (6, 1, 2, (time(hour=5), time(hour=5))),
+        ]
+        for order_id, weight, region, (start, end) in orders:
+            order = Order.objects.create(
+                order_id=order_id, weight=weight, region_id=region)
+            DeliveryHours.objects.create(start=start, end=end, order=order)
+            order.update_delivery_hours_mask()
+
+    def get_assigned_ids(self):
+        assigned_ids = {}
+        for courier_id, order_id in Order.objects.filter(
+                status='assigned').values_list(
+                'set_of_orders__courier', 'order_id'):
+            assigned_ids.setdefault(courier_id, set()).add(order_id)
+        return assigned_ids
+
+    def test_batch_and_single_assignment_pick_the_same_orders(self):
+        with transaction.atomic():
+            Courier.objects.all().assign_orders()
+            batch_ids = self.get_assigned_ids()
+            transaction.set_rollback(True)
+
+        # The couriers with smaller load capacity choose first
+        for courier_id in (1, 2, 3):
+            Courier.objects.get(courier_id=courier_id).assign_orders()
+        self.assertEqual(batch_ids, self.get_assigned_ids())
+        self.assertEqual(batch_ids, {1: {1, 2}, 2: {3}, 3: {5}})
+
+    def test_pending_orders_are_loaded_once(self):
+        def count_queries():
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as context:
+                    Courier.objects.all().assign_orders()
+                transaction.set_rollback(True)
+            return len(context)
+
+        queries = count_queries()
+        for courier_id in range(4, 14):
+            courier = Courier.objects.create(
+                courier_id=courier_id, courier_type='foot')
+            courier.regions.set([2])
+        # The new couriers don't match any order, so they cost nothing
+        self.assertEqual(count_queries(), queries)
+
 
 class CourierRatingTestCase(TestCase):
     """
@@ -292,23 +474,31 @@ class CourierRatingTestCase(TestCase):
         # Create order set
         self.order_set_1 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_1.finished_orders.set([self.order_1])
+        for order in [self.order_1]:
+            order.status = 'finished'
+            order.save()
 
         # Create order set
         self.order_set_2 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_2.finished_orders.set([self.order_2])
+        for order in [self.order_2]:
+            order.status = 'finished'
+            order.save()
 
         # Create order set
         self.order_set_3 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_3.finished_orders.set([self.order_3])
+        for order in [self.order_3]:
+            order.status = 'finished'
+            order.save()
 
         # Create order set
         self.order_set_4 = AssignedOrderSet.objects.create(
             courier=self.another_courier,
             courier_type=self.another_courier.courier_type)
-        self.order_set_4.finished_orders.set([self.order_4])
+        for order in [self.order_4]:
+            order.status = 'finished'
+            order.save()
 
     def test__find_average_time_for_orders_when_3_given_orders(self):
         self.order_set_2.assign_time = self.time - self.time_delta
@@ -386,6 +576,63 @@ class CourierRatingTestCase(TestCase):
 
         self.assertIsNone(self.courier.rating)
 
+    def test_get_average_delivery_times_in_one_query(self):
+        # Set order 1 as complete
+        self.order_1.set_of_orders = self.order_set_1
+        self.order_1.save()
+
+        # Set order_2 and order_3 as complete in one set
+        self.order_2.set_of_orders = self.order_set_2
+        self.order_2.save()
+        self.order_3.set_of_orders = self.order_set_2
+        self.order_3.save()
+
+        with self.assertNumQueries(1):
+            average_times, t = self.courier.get_average_delivery_times()
+
+        orders = list(self.courier.get_finished_orders())
+        self.assertEqual(average_times, {
+            1: self.courier._find_average_time_for_orders(orders[:1]),
+            2: self.courier._find_average_time_for_orders(orders[1:]),
+        })
+        self.assertEqual(
+            t, self.courier._calculate_minimum_average_time_for_all_regions(
+                orders))
+
+    def test_get_average_delivery_times_matches_python_formula(self):
+        rand = random.Random(0)
+        order_sets = [self.order_set_1, self.order_set_2, self.order_set_3]
+        for order_set in order_sets:
+            # assign_time is auto_now, so it's changed with update()
+            AssignedOrderSet.objects.filter(id=order_set.id).update(
+                assign_time=self.time - timedelta(
+                    seconds=rand.randint(0, 3600),
+                    microseconds=rand.randint(0, 10**6)))
+
+        for order_id in range(10, 60):
+            complete_time = self.time + timedelta(
+                seconds=rand.randint(0, 3600), microseconds=rand.randint(0, 10**6))
+            Order.objects.create(
+                order_id=order_id, weight=1, region_id=rand.randint(1, 5),
+                set_of_orders=rand.choice(order_sets),
+                # Some orders are completed at the same time
+                complete_time=(complete_time if order_id % 7
+                               else self.time + self.time_delta))
+
+        orders = list(self.courier.get_finished_orders())
+        average_times, t = self.courier.get_average_delivery_times()
+        for region_id, average_time in average_times.items():
+            self.assertEqual(
+                average_time, self.courier._find_average_time_for_orders(
+                    [order for order in orders if order.region_id == region_id]))
+        self.assertEqual(
+            t, self.courier._calculate_minimum_average_time_for_all_regions(
+                orders))
+        self.assertEqual(self.courier.rating, self.courier._calculate_rating(t))
+
+    def test_get_average_delivery_times_when_not_finished_orders(self):
+        self.assertEqual(self.courier.get_average_delivery_times(), ({}, None))
+
 
 class CourierEarningsTestCase(TestCase):
     """
@@ -445,7 +692,9 @@ class CourierEarningsTestCase(TestCase):
         # Create order set
         self.order_set_1 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_1.finished_orders.set([self.order_1])
+        for order in [self.order_1]:
+            order.status = 'finished'
+            order.save()
         self.order_1.complete_time = self.time
         self.order_1.set_of_orders = self.order_set_1
         self.order_1.save()
@@ -453,7 +702,9 @@ class CourierEarningsTestCase(TestCase):
         # Create order set
         self.order_set_2 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_2.finished_orders.set([self.order_2])
+        for order in [self.order_2]:
+            order.status = 'finished'
+            order.save()
         self.order_2.complete_time = self.time
         self.order_2.set_of_orders = self.order_set_2
         self.order_2.save()
@@ -461,13 +712,17 @@ class CourierEarningsTestCase(TestCase):
         # Create order set
         self.order_set_3 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_3.finished_orders.set([self.order_3])
+        for order in [self.order_3]:
+            order.status = 'finished'
+            order.save()
 
         # Create order set
         self.order_set_4 = AssignedOrderSet.objects.create(
             courier=self.another_courier,
             courier_type=self.another_courier.courier_type)
-        self.order_set_4.finished_orders.set([self.order_4])
+        for order in [self.order_4]:
+            order.status = 'finished'
+            order.save()
 
     def test_earnings_when_first_two_orders_and_courier_is_foot(self):
         excpected_earnings = 2000
@@ -501,6 +756,21 @@ class CourierEarningsTestCase(TestCase):
         excpected_earnings = 0
         self.assertEqual(self.courier.earnings, excpected_earnings)
 
+    def test_earnings_in_one_query(self):
+        self.order_set_2.courier_type = 'car'
+        self.order_set_2.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.courier.earnings, 5500)
+
+    def test_earnings_with_annotation(self):
+        self.order_set_2.courier_type = 'car'
+        self.order_set_2.save()
+        Courier.objects.create(courier_id=3, courier_type='car')
+        with self.assertNumQueries(1):
+            earnings = {courier.courier_id: courier.earnings
+                        for courier in Courier.objects.with_earnings()}
+        self.assertEqual(earnings, {1: 5500, 2: 0, 3: 0})
+
 
 class CourierChangedPropertiesTestCase(TestCase):
     """
@@ -572,7 +842,10 @@ class CourierChangedPropertiesTestCase(TestCase):
         # Create order set
         self.order_set_1 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_1.notstarted_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.set_of_orders = self.order_set_1
+            order.status = 'assigned'
+            order.save()
         self.order_1.set_of_orders = self.order_set_1
         self.order_1.save()
         self.order_2.set_of_orders = self.order_set_1
@@ -583,13 +856,19 @@ class CourierChangedPropertiesTestCase(TestCase):
         # Create order set
         self.order_set_3 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_3.notstarted_orders.set([self.order_3])
+        for order in [self.order_3]:
+            order.set_of_orders = self.order_set_3
+            order.status = 'assigned'
+            order.save()
 
         # Create order set
         self.order_set_4 = AssignedOrderSet.objects.create(
             courier=self.another_courier,
             courier_type=self.another_courier.courier_type)
-        self.order_set_4.notstarted_orders.set([self.order_4])
+        for order in [self.order_4]:
+            order.set_of_orders = self.order_set_4
+            order.status = 'assigned'
+            order.save()
 
     def test_notstarted_orders_when_change_courier_regions(self):
         notstarted_orders = self.courier.current_set_of_orders.notstarted_orders.all()
@@ -628,6 +907,27 @@ class CourierChangedPropertiesTestCase(TestCase):
         notstarted_orders = self.courier.current_set_of_orders.notstarted_orders.all()
         self.assertEqual(list(notstarted_orders), [self.order_1, self.order_2])
 
+    def test_notstarted_orders_when_downgrade_courier_type(self):
+        self.courier.courier_type = 'car'
+        self.courier.save()
+        order = Order.objects.create(
+            order_id=5, weight=9, region=self.region_1,
+            set_of_orders=self.order_set_1, status='assigned')
+        DeliveryHours.objects.create(
+            start=time(hour=9), end=time(hour=12), order=order)
+
+        # Each order fits the load capacity, but all of them don't
+        self.courier.courier_type = 'foot'
+        self.courier.remove_unsuitable_orders()
+        notstarted_orders = list(self.order_set_1.notstarted_orders.all())
+        self.assertLessEqual(
+            sum(order.weight for order in notstarted_orders),
+            self.courier.load_capacity)
+        self.assertEqual(Order.objects.filter(
+            order_id__in=[1, 2, 5], set_of_orders=None,
+            status='new').count(), 3 - len(notstarted_orders))
+        self.assertLess(len(notstarted_orders), 3)
+
     def test_notstarted_orders_when_change_courier_working_hours(self):
         notstarted_orders = self.courier.current_set_of_orders.notstarted_orders.all()
         self.assertEqual(list(notstarted_orders), [self.order_1, self.order_2])
@@ -644,7 +944,9 @@ class CourierChangedPropertiesTestCase(TestCase):
         self.assertIsNone(self.order_1.set_of_orders)
         
     def test_if_courier_does_not_have_notstarted_orders(self):
-        self.order_set_1.finished_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.status = 'finished'
+            order.save()
         self.order_set_1.save()
         self.courier.refresh_from_db()
         self.courier.remove_unsuitable_orders()
@@ -657,7 +959,27 @@ class CourierChangedPropertiesTestCase(TestCase):
         self.courier.remove_unsuitable_orders()
         self.courier.refresh_from_db()
         self.assertIsNone(self.courier.current_set_of_orders)
-        
+
+    def test_remove_many_unsuitable_orders_in_constant_queries(self):
+        for order_id in range(10, 60):
+            Order.objects.create(order_id=order_id, weight=1,
+                                 region=self.region_4,
+                                 set_of_orders=self.order_set_1,
+                                 status='assigned')
+
+        # 2 SELECT of ids, 1 UPDATE of orders
+        # and 1 UPDATE + 1 SELECT of the version of the set
+        with self.assertNumQueries(5):
+            self.courier.remove_unsuitable_orders()
+        self.assertEqual(
+            list(self.order_set_1.notstarted_orders.all()),
+            [self.order_1, self.order_2])
+        self.assertEqual(
+            Order.objects.filter(region=self.region_4,
+                                 set_of_orders=None).count(), 50)
+        self.order_set_1.refresh_from_db()
+        self.assertEqual(self.order_set_1.version, 2)
+
 
 class CourierGetFinishedOrdersTestCase(TestCase):
     """
@@ -713,7 +1035,9 @@ class CourierGetFinishedOrdersTestCase(TestCase):
         # Create order set
         self.order_set_1 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_1.finished_orders.set([self.order_1])
+        for order in [self.order_1]:
+            order.status = 'finished'
+            order.save()
         self.order_1.complete_time = self.time
         self.order_1.set_of_orders = self.order_set_1
         self.order_1.save()
@@ -721,7 +1045,9 @@ class CourierGetFinishedOrdersTestCase(TestCase):
         # Create order set
         self.order_set_2 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_2.finished_orders.set([self.order_2])
+        for order in [self.order_2]:
+            order.status = 'finished'
+            order.save()
         self.order_2.complete_time = self.time
         self.order_2.set_of_orders = self.order_set_2
         self.order_2.save()
@@ -729,13 +1055,17 @@ class CourierGetFinishedOrdersTestCase(TestCase):
         # Create order set
         self.order_set_3 = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set_3.finished_orders.set([self.order_3])
+        for order in [self.order_3]:
+            order.status = 'finished'
+            order.save()
 
         # Create order set
         self.order_set_4 = AssignedOrderSet.objects.create(
             courier=self.another_courier,
             courier_type=self.another_courier.courier_type)
-        self.order_set_4.finished_orders.set([self.order_4])
+        for order in [self.order_4]:
+            order.status = 'finished'
+            order.save()
 
     def test_get_finished_orders_for_courier(self):
         orders = self.courier.get_finished_orders()
@@ -927,7 +1257,9 @@ class AssignedOrderSetTestCase(TestCase):
         # Create order set
         self.order_set = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set.notstarted_orders.add(self.order)
+        self.order.set_of_orders = self.order_set
+        self.order.status = 'assigned'
+        self.order.save()
 
     def test_str_function(self):
         excpected_str = 'Order set (id={}, courier_id=1)'.format(
@@ -988,7 +1320,10 @@ class OrderCompleteTestCase(TestCase):
         # Create order set
         self.order_set = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set.notstarted_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.set_of_orders = self.order_set
+            order.status = 'assigned'
+            order.save()
         self.order_1.set_of_orders = self.order_set
         self.order_1.save()
         self.order_2.set_of_orders = self.order_set
@@ -1028,3 +1363,128 @@ class OrderCompleteTestCase(TestCase):
             list(self.order_set.notstarted_orders.all()), [self.order_2])
         self.assertEqual(
             list(self.order_set.finished_orders.all()), [self.order_1])
+
+    def test_complete_order_1_queries(self):
+        # Update the order, its set and the courier, select and insert
+        # the statistics of the courier
+        with self.assertNumQueries(5):
+            status, msg = self.order_1.complete(
+                courier=self.courier, complete_time=self.complete_time)
+        self.assertEqual(status, True)
+
+    def test_complete_order_1_released_after_reading(self):
+        # The order was released by PATCH of the courier
+        Order.objects.filter(order_id=1).update(
+            set_of_orders=None, status='new')
+
+        status, msg = self.order_1.complete(
+            courier=self.courier, complete_time=self.complete_time)
+        self.assertEqual(status, False)
+        self.assertEqual(msg, 'The order was not assigned')
+        self.order_1.refresh_from_db()
+        self.assertIsNone(self.order_1.complete_time)
+        self.assertEqual(list(self.order_set.finished_orders.all()), [])
+
+    def test_complete_order_1_reassigned_after_reading(self):
+        # The order was released and assigned to the courier again
+        new_order_set = AssignedOrderSet.objects.create(
+            courier=self.courier, courier_type=self.courier.courier_type)
+        Order.objects.filter(order_id=1).update(set_of_orders=new_order_set)
+
+        status, msg = self.order_1.complete(
+            courier=self.courier, complete_time=self.complete_time)
+        self.assertEqual(status, True)
+        self.assertEqual(
+            list(new_order_set.finished_orders.all()), [self.order_1])
+        self.assertEqual(list(new_order_set.notstarted_orders.all()), [])
+
+    def test_complete_order_1_again(self):
+        self.order_1.complete(
+            courier=self.courier, complete_time=self.complete_time)
+        later_complete_time = self.complete_time + timedelta(minutes=10)
+        status, msg = self.order_1.complete(
+            courier=self.courier, complete_time=later_complete_time)
+        self.assertEqual(status, True)
+        self.order_1.refresh_from_db()
+        self.assertEqual(self.order_1.complete_time, later_complete_time)
+        self.assertEqual(
+            list(self.order_set.finished_orders.all()), [self.order_1])
+
+
+class CourierRegionStatsTestCase(TestCase):
+    """
+    The test case for the incremental statistics of couriers.
+    """
+
+    def setUp(self):
+        for region_number in (1, 2):
+            Region.objects.create(id=region_number)
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='bike')
+        self.courier.regions.set([1, 2])
+
+        self.order_set = AssignedOrderSet.objects.create(
+            courier=self.courier, courier_type='bike')
+        self.assign_time = datetime(
+            year=2020, month=10, day=1, hour=10, tzinfo=timezone.utc)
+        AssignedOrderSet.objects.filter(id=self.order_set.id).update(
+            assign_time=self.assign_time)
+        self.order_set.refresh_from_db()
+
+        self.orders = []
+        for order_id in range(1, 7):
+            order = Order.objects.create(
+                order_id=order_id, weight=1, region_id=order_id % 2 + 1,
+                set_of_orders=self.order_set)
+            self.orders.append(order)
+        for order in self.orders:
+            order.set_of_orders = self.order_set
+            order.status = 'assigned'
+            order.save()
+
+    def complete(self, order, minutes):
+        status, _ = order.complete(
+            courier=self.courier,
+            complete_time=self.assign_time + timedelta(minutes=minutes))
+        self.assertTrue(status)
+
+    def assert_stats_match_finished_orders(self):
+        self.courier.refresh_from_db()
+        self.assertEqual(self.courier.get_rating_and_earnings(),
+                         (self.courier.rating, self.courier.earnings))
+
+    def test_no_finished_orders(self):
+        self.assertEqual(self.courier.get_rating_and_earnings(), (None, 0))
+
+    def test_complete_orders(self):
+        for minutes, order in zip([5, 12, 20, 31, 40, 55], self.orders):
+            self.complete(order, minutes)
+            self.assert_stats_match_finished_orders()
+
+        stats = CourierRegionStats.objects.get(courier=self.courier, region=1)
+        self.assertEqual(stats.orders_count, 3)
+        self.assertEqual(stats.delivery_time_sum, timedelta(minutes=55))
+        self.assertEqual(stats.earnings, 3 * 500 * 5)
+
+    def test_complete_orders_not_in_order_of_completion(self):
+        for minutes, order in zip([40, 12, 55, 5, 20, 31], self.orders):
+            self.complete(order, minutes)
+            self.assert_stats_match_finished_orders()
+
+    def test_complete_order_again(self):
+        self.complete(self.orders[0], 10)
+        self.complete(self.orders[2], 20)
+        self.complete(self.orders[0], 30)
+        self.assert_stats_match_finished_orders()
+        stats = CourierRegionStats.objects.get(courier=self.courier, region=2)
+        self.assertEqual(stats.orders_count, 2)
+        self.assertEqual(stats.delivery_time_sum, timedelta(minutes=30))
+
+    def test_rebuild(self):
+        for minutes, order in zip([5, 12, 20], self.orders):
+            self.complete(order, minutes)
+        CourierRegionStats.objects.all().delete()
+
+        CourierRegionStats.objects.rebuild(self.courier)
+        self.assertEqual(self.courier.region_stats.count(), 2)
+        self.assert_stats_match_finished_orders()
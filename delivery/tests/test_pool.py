@@ -0,0 +1,290 @@
+"""
+The tests of the in-memory pool of pending orders.
+"""
+
+import multiprocessing
+import unittest
+from collections import namedtuple
+from datetime import time
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from ..models import AssignedOrderSet, Courier, Order, get_hours_mask
+from ..pool import (
+    OrderPool, SharedOrderPool, get_order_pool, reset_order_pool)
+from ..serializers import (
+    CourierItemPostSerializer, CourierItemPatchSerializer, OrderSerializer)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+Item = namedtuple(
+    'Item', ['order_id', 'weight', 'region_id', 'delivery_hours_mask'])
+
+MORNING = get_hours_mask([(time(hour=9), time(hour=12))])
+EVENING = get_hours_mask([(time(hour=18), time(hour=20))])
+
+
+class OrderPoolTestCase(SimpleTestCase):
+    """
+    The test case for OrderPool.
+    """
+
+    def create_pool(self):
+        return OrderPool()
+
+    def setUp(self):
+        self.pool = self.create_pool()
+        self.pool.add([
+            Item(1, Decimal('5'), 1, MORNING),
+            Item(2, Decimal('0.5'), 1, MORNING),
+            Item(3, Decimal('12'), 1, MORNING),
+            Item(4, Decimal('1'), 1, EVENING),
+            Item(5, Decimal('2'), 2, MORNING),
+        ])
+
+    def get_ids(self, orders):
+        return [order.order_id for order in orders]
+
+    def test_find_matching_orders(self):
+        orders = self.pool.find_matching_orders([1, 2], 10, MORNING)
+        self.assertEqual(self.get_ids(orders), [2, 1, 5])
+
+        orders = self.pool.find_matching_orders([1], 50, EVENING)
+        self.assertEqual(self.get_ids(orders), [4])
+
+        self.assertEqual(self.pool.find_matching_orders([3], 50, MORNING), [])
+
+    def test_capacity_is_inclusive(self):
+        orders = self.pool.find_matching_orders([1], Decimal('5'), MORNING)
+        self.assertEqual(self.get_ids(orders), [2, 1])
+
+    def test_add_and_remove(self):
+        self.pool.add([Item(6, Decimal('3'), 1, MORNING),
+                       Item(1, Decimal('5'), 1, MORNING)])
+        self.assertEqual(len(self.pool), 6)
+        self.pool.remove([1, 2, 100])
+        self.assertEqual(len(self.pool), 4)
+        self.assertNotIn(1, self.pool)
+
+        orders = self.pool.find_matching_orders([1], 50, MORNING)
+        self.assertEqual(self.get_ids(orders), [6, 3])
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class SharedOrderPoolTestCase(OrderPoolTestCase):
+    """
+    The test case for SharedOrderPool.
+    """
+
+    def create_pool(self):
+        return SharedOrderPool(8)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_weights_and_masks(self):
+        order = self.pool.find_matching_orders([1], 10, EVENING)[0]
+        self.assertEqual(order.weight, Decimal('1'))
+        self.assertEqual(order.hours_mask, int.from_bytes(EVENING, 'big'))
+
+    def test_slots_are_reused(self):
+        self.pool.remove([1, 2])
+        self.pool.add([Item(6, Decimal('3'), 1, MORNING),
+                       Item(7, Decimal('3'), 1, MORNING),
+                       Item(8, Decimal('3'), 1, MORNING),
+                       Item(9, Decimal('3'), 1, MORNING)])
+        self.assertEqual(len(self.pool), 7)
+        self.assertFalse(self.pool.overflowed)
+
+        self.pool.add([Item(10, Decimal('3'), 1, MORNING),
+                       Item(11, Decimal('3'), 1, MORNING)])
+        self.assertTrue(self.pool.overflowed)
+        self.assertEqual(len(self.pool), 7)
+
+    def test_removed_slots_are_filled_by_the_last_orders(self):
+        self.pool.remove([1, 3])
+        self.assertEqual(len(self.pool), 3)
+        self.assertEqual(sorted(self.pool._order_ids[:3].tolist()), [2, 4, 5])
+        self.pool.remove([5])
+        self.assertEqual(sorted(self.pool._order_ids[:2].tolist()), [2, 4])
+
+        orders = self.pool.find_matching_orders([1, 2], 10, MORNING)
+        self.assertEqual(self.get_ids(orders), [2])
+
+    def test_rebuild(self):
+        new_orders = [Item(6, Decimal('3'), 1, MORNING)]
+        self.assertFalse(self.pool.rebuild(new_orders))
+
+        self.pool.add([Item(order_id, Decimal('1'), 3, MORNING)
+                       for order_id in range(6, 10)])
+        self.assertTrue(self.pool.overflowed)
+        self.assertFalse(self.pool.rebuild(new_orders, min_interval=60))
+        self.assertTrue(self.pool.rebuild(new_orders))
+        self.assertFalse(self.pool.overflowed)
+        self.assertEqual(len(self.pool), 1)
+        self.assertIn(6, self.pool)
+        self.assertNotIn(1, self.pool)
+
+    def test_rejected_orders_dont_postpone_rebuild(self):
+        with mock.patch('time.time', return_value=1000):
+            self.pool.add([Item(order_id, Decimal('1'), 3, MORNING)
+                           for order_id in range(6, 10)])
+        with mock.patch('time.time', return_value=1059):
+            self.pool.add([Item(10, Decimal('1'), 3, MORNING)] * 5)
+        with mock.patch('time.time', return_value=1060):
+            self.assertTrue(self.pool.rebuild([], min_interval=60))
+
+    def test_pool_is_shared_by_processes(self):
+        context = multiprocessing.get_context('fork')
+        process = context.Process(target=self.pool.add, args=(
+            [Item(6, Decimal('3'), 2, MORNING)],))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+        orders = self.pool.find_matching_orders([2], 10, MORNING)
+        self.assertEqual(self.get_ids(orders), [5, 6])
+
+
+@override_settings(ORDER_POOL_ENABLED=True)
+class OrderPoolAssignmentTestCase(TransactionTestCase):
+    """
+    The test case for the assignment using the pool.
+    """
+
+    def setUp(self):
+        reset_order_pool()
+        serializer = CourierItemPostSerializer(data=[
+            {'courier_id': courier_id, 'courier_type': 'foot',
+             'regions': [1, 2], 'working_hours': ['09:00-18:00']}
+            for courier_id in (1, 2)
+        ], many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.create_orders([
+            {'order_id': 1, 'weight': 4, 'region': 1,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 2, 'weight': 4, 'region': 2,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 3, 'weight': 4, 'region': 2,
+             'delivery_hours': ['10:00-11:00']},
+            {'order_id': 4, 'weight': 4, 'region': 1,
+             'delivery_hours': ['20:00-21:00']},
+        ])
+
+    def tearDown(self):
+        reset_order_pool()
+
+    def create_orders(self, orders):
+        serializer = OrderSerializer(data=orders, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    def test_pool_is_filled_and_updated_by_orders(self):
+        pool = get_order_pool()
+        self.assertEqual(len(pool), 4)
+
+        serializer = OrderSerializer(data={
+            'order_id': 5, 'weight': 1, 'region': 3,
+            'delivery_hours': ['10:00-11:00']})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.create_orders([{'order_id': 6, 'weight': 1, 'region': 3,
+                             'delivery_hours': ['10:00-11:00']}])
+        self.assertIn(5, pool)
+        self.assertIn(6, pool)
+
+    def test_assign_orders(self):
+        pool = get_order_pool()
+        order_set = Courier.objects.get(courier_id=1).assign_orders()
+
+        assigned_ids = set(order_set.notstarted_orders.values_list(
+            'order_id', flat=True))
+        self.assertEqual(len(assigned_ids), 2)
+        self.assertNotIn(4, assigned_ids)
+        self.assertFalse(any(order_id in pool for order_id in assigned_ids))
+        self.assertEqual(len(pool), 2)
+
+    def test_batch_assign_orders(self):
+        pool = get_order_pool()
+        order_sets = Courier.objects.all().assign_orders()
+
+        assigned_ids = set(Order.objects.filter(
+            status='assigned').values_list('order_id', flat=True))
+        self.assertEqual(assigned_ids, {1, 2, 3})
+        self.assertTrue(all(order_sets.values()))
+        self.assertEqual([order_id for order_id in (1, 2, 3, 4)
+                          if order_id in pool], [4])
+
+    def test_stale_orders_are_dropped(self):
+        pool = get_order_pool()
+        # Another process assigns the orders, the pool doesn't know it
+        courier = Courier.objects.get(courier_id=2)
+        order_set = AssignedOrderSet.objects.create(
+            courier=courier, courier_type=courier.courier_type)
+        Order.objects.filter(order_id__in=[1, 2, 3]).update(
+            set_of_orders=order_set, status='assigned')
+
+        self.assertIsNone(Courier.objects.get(courier_id=1).assign_orders())
+        # The packed orders are dropped and packed again from the rest
+        # of the candidates until none of them is left
+        self.assertEqual(len(pool), 1)
+        self.assertIn(4, pool)
+
+    def test_released_orders_return_to_pool(self):
+        pool = get_order_pool()
+        courier = Courier.objects.get(courier_id=1)
+        order_set = courier.assign_orders()
+        assigned_ids = set(order_set.notstarted_orders.values_list(
+            'order_id', flat=True))
+
+        serializer = CourierItemPatchSerializer(
+            courier, data={'regions': [3]}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.assertTrue(all(order_id in pool for order_id in assigned_ids))
+        self.assertEqual(len(pool), 4)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+@override_settings(ORDER_POOL_SHARED=True, ORDER_POOL_SHARED_SIZE=10)
+class SharedOrderPoolAssignmentTestCase(OrderPoolAssignmentTestCase):
+    """
+    The test case for the assignment using the pool in shared memory.
+    """
+
+    def test_overflowed_pool_is_not_used(self):
+        self.assertIsNotNone(get_order_pool())
+        self.create_orders([
+            {'order_id': order_id, 'weight': 1, 'region': 1,
+             'delivery_hours': ['10:00-11:00']}
+            for order_id in range(5, 12)
+        ])
+        self.assertIsNone(get_order_pool())
+
+        order_set = Courier.objects.get(courier_id=1).assign_orders()
+        self.assertEqual(order_set.notstarted_orders.count(), 4)
+
+    @override_settings(ORDER_POOL_REBUILD_INTERVAL=0)
+    def test_overflowed_pool_is_rebuilt(self):
+        self.create_orders([
+            {'order_id': order_id, 'weight': 1, 'region': 1,
+             'delivery_hours': ['10:00-11:00']}
+            for order_id in range(5, 12)
+        ])
+        self.assertIsNone(get_order_pool())
+
+        # The pool is filled from the database when the orders fit it
+        Order.objects.filter(order_id__gte=10).delete()
+        pool = get_order_pool()
+        self.assertIsNotNone(pool)
+        self.assertEqual(len(pool), 9)
+        self.assertNotIn(10, pool)
@@ -4,14 +4,17 @@ Test serializers.
 
 from datetime import time
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from ..serializers import (
     CourierItemPostSerializer, 
     OrderSerializer,
     AssignOrderSetSerializer)
 from ..models import (
-    Courier, Region, WorkingHours, Order, DeliveryHours, AssignedOrderSet)
+    Courier, Region, WorkingHours, Order, DeliveryHours, AssignedOrderSet,
+    get_hours_mask)
 
 
 class CourierItemPostSerializerTestCase(TestCase):
@@ -72,6 +75,11 @@ class CourierItemPostSerializerTestCase(TestCase):
         self.assertEqual(str(WorkingHours.objects.all()[0]), "09:00-18:00")
         self.assertEqual(str(WorkingHours.objects.all()[1]), "20:00-22:10")
 
+        # Test working hours mask
+        expected_mask = get_hours_mask(
+            courier.working_hours.values_list('start', 'end'))
+        self.assertEqual(bytes(courier.working_hours_mask), expected_mask)
+
     def test_save_two_valide_courier(self):
         serializer = CourierItemPostSerializer(
             data=self.input_many_data, many=True)
@@ -106,6 +114,61 @@ class CourierItemPostSerializerTestCase(TestCase):
         self.assertEqual(WorkingHours.objects.all()[2].courier, courier_bike)
 
 
+class CourierListSerializerTestCase(TestCase):
+    """
+    The test case for CourierListSerializer class (bulk creating couriers).
+    """
+
+    def get_input_data(self, courier_ids):
+        return [
+            {
+                'courier_id': courier_id,
+                'courier_type': 'bike',
+                'regions': [courier_id % 3 + 1, 4, 4],
+                'working_hours': ["09:00-18:00", "20:00-22:10"],
+            }
+            for courier_id in courier_ids
+        ]
+
+    def test_queries_dont_depend_on_number_of_couriers(self):
+        Region.objects.create(id=1)
+        serializer = CourierItemPostSerializer(
+            data=self.get_input_data(range(1, 201)), many=True)
+        # Validation: 1 query, creating: regions, couriers, couriers
+        # regions and working hours
+        # (a database can split a bulk insert into a few queries)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(serializer.is_valid())
+            couriers = serializer.save()
+        self.assertLessEqual(len(queries), 10)
+
+        self.assertEqual(len(couriers), 200)
+        self.assertEqual(Courier.objects.count(), 200)
+        self.assertEqual(Region.objects.count(), 4)
+        self.assertEqual(WorkingHours.objects.count(), 400)
+
+        courier = Courier.objects.get(courier_id=5)
+        self.assertEqual(courier.courier_type, 'bike')
+        self.assertEqual(list(courier.regions.values_list('id', flat=True)),
+                         [3, 4])
+        self.assertEqual(
+            [str(hours) for hours in courier.working_hours.all()],
+            ["09:00-18:00", "20:00-22:10"])
+        self.assertEqual(
+            bytes(courier.working_hours_mask),
+            get_hours_mask(courier.working_hours.values_list('start', 'end')))
+
+    def test_existing_courier_id(self):
+        Courier.objects.create(courier_id=1, courier_type='foot')
+        serializer = CourierItemPostSerializer(
+            data=self.get_input_data([2, 1, 2]), many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[0], {})
+        self.assertEqual(serializer.errors[1]['courier_id'],
+                         ['courier with this courier id already exists.'])
+        self.assertIn('courier_id', serializer.errors[2])
+
+
 class OrderSerializerTestCase(TestCase):
     """
     The test case for OrderSerializer class.
@@ -187,6 +250,74 @@ class OrderSerializerTestCase(TestCase):
         self.assertEqual(str(DeliveryHours.objects.all()[0]), data['delivery_hours'][0])
         self.assertEqual(str(DeliveryHours.objects.all()[1]), data['delivery_hours'][1])
 
+        # Test delivery hours mask
+        expected_mask = get_hours_mask(
+            order.delivery_hours.values_list('start', 'end'))
+        order.refresh_from_db()
+        self.assertEqual(bytes(order.delivery_hours_mask), expected_mask)
+
+
+class OrderListSerializerTestCase(TestCase):
+    """
+    The test case for OrderListSerializer class (bulk creating orders).
+    """
+
+    def get_input_data(self, order_ids):
+        return [
+            {
+                "order_id": order_id,
+                "weight": 1.5,
+                "region": order_id % 3 + 1,
+                "delivery_hours": ["09:00-12:00", "16:00-21:30"],
+            }
+            for order_id in order_ids
+        ]
+
+    def test_queries_dont_depend_on_number_of_orders(self):
+        Region.objects.create(id=1)
+        serializer = OrderSerializer(
+            data=self.get_input_data(range(1, 201)), many=True)
+        # Validation: 1 query, creating: regions, orders, delivery hours
+        # (a database can split a bulk insert into a few queries)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(serializer.is_valid())
+            orders = serializer.save()
+        self.assertLessEqual(len(queries), 8)
+
+        self.assertEqual(len(orders), 200)
+        self.assertEqual(Order.objects.count(), 200)
+        self.assertEqual(Region.objects.count(), 3)
+        self.assertEqual(DeliveryHours.objects.count(), 400)
+
+        order = Order.objects.get(order_id=5)
+        self.assertEqual(order.region_id, 3)
+        self.assertEqual(
+            [str(hours) for hours in order.delivery_hours.all()],
+            ["09:00-12:00", "16:00-21:30"])
+        self.assertEqual(
+            bytes(order.delivery_hours_mask),
+            get_hours_mask(order.delivery_hours.values_list('start', 'end')))
+
+    def test_existing_order_id(self):
+        serializer = OrderSerializer(
+            data=self.get_input_data([1]), many=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        serializer = OrderSerializer(
+            data=self.get_input_data([2, 1]), many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[0], {})
+        self.assertEqual(serializer.errors[1]['order_id'],
+                         ['order with this order id already exists.'])
+
+    def test_repeated_order_id(self):
+        serializer = OrderSerializer(
+            data=self.get_input_data([1, 2, 1]), many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[:2], [{}, {}])
+        self.assertIn('order_id', serializer.errors[2])
+
 
 class AssignOrdersSetSerializerTestCase(TestCase):
     """
@@ -233,7 +364,10 @@ class AssignOrdersSetSerializerTestCase(TestCase):
         # Create order set
         self.order_set = AssignedOrderSet.objects.create(
             courier=self.courier, courier_type=self.courier.courier_type)
-        self.order_set.notstarted_orders.set([self.order_1, self.order_2])
+        for order in [self.order_1, self.order_2]:
+            order.set_of_orders = self.order_set
+            order.status = 'assigned'
+            order.save()
         
     def test_field_count(self):
         orders = Order.objects.all()
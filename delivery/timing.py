@@ -0,0 +1,62 @@
+"""
+The time of the serializers of a request.
+
+The serializers add their time to the timer of the current request,
+it's observed in the metrics by MetricsMiddleware.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# The time of the serializers of the current request, it's None if
+# the request isn't measured
+_serializer_timer = ContextVar('serializer_timer', default=None)
+
+
+class SerializerTimer:
+    """
+    The total time of the serializers of the request. The nested
+    serializers are counted once as a part of the outer one.
+    """
+
+    def __init__(self):
+        self.duration = 0.0
+        self.depth = 0
+
+
+@contextmanager
+def observe_serializer():
+    """
+    Add the time of the block to the serializer time of the request.
+    """
+
+    timer = _serializer_timer.get()
+    if timer is None:
+        yield
+        return
+
+    timer.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        if not timer.depth:
+            timer.duration += time.perf_counter() - start
+
+
+@contextmanager
+def measure_serializers():
+    """
+    Collect the serializer time of the request into the returned
+    SerializerTimer.
+    """
+
+    timer = SerializerTimer()
+    token = _serializer_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _serializer_timer.reset(token)
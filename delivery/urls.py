@@ -4,7 +4,7 @@ URL Configuration.
 
 from django.urls import path
 
-from . import api
+from . import api, metrics
 
 
 urlpatterns = [
@@ -12,5 +12,10 @@ urlpatterns = [
     path('couriers/<int:pk>', api.CourierItemAPI.as_view(), name='courier-item'),
     path('orders', api.OrderListAPI.as_view(), name='orders'),
     path('orders/assign', api.OrdersAssignAPI.as_view(), name='orders-assign'),
-    path('orders/complete', api.OrdersCompleteAPI.as_view(), name='orders-complete')
+    path('orders/assign/batch', api.OrdersBatchAssignAPI.as_view(),
+         name='orders-assign-batch'),
+    path('orders/complete', api.OrdersCompleteAPI.as_view(), name='orders-complete'),
+    path('orders/complete/batch', api.OrdersBatchCompleteAPI.as_view(),
+         name='orders-complete-batch'),
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
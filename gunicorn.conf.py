@@ -0,0 +1,52 @@
+"""
+The configuration of gunicorn, it's read from the working directory.
+
+If the pool of pending orders is kept in shared memory
+(ORDER_POOL_SHARED), the master process fills it before forking
+the workers, so all the workers use one copy of the pool.
+
+If PROMETHEUS_MULTIPROC_DIR is set, the workers write their metrics
+to that directory (see delivery/metrics.py). It's emptied at the start
+and the files of the exited workers are marked as dead.
+"""
+
+import glob
+import os
+
+
+def on_starting(server):
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        for path in glob.glob(os.path.join(multiproc_dir, '*.db')):
+            os.remove(path)
+
+    # The settings are read like in YandexCandyREST/settings.py, Django
+    # is set up in the master only to fill the pool
+    from decouple import config
+
+    if not (config('ORDER_POOL_ENABLED', default=False, cast=bool)
+            and config('ORDER_POOL_SHARED', default=False, cast=bool)):
+        return
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'YandexCandyREST.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connections
+    from delivery.pool import create_shared_order_pool
+
+    create_shared_order_pool()
+    # The workers must not inherit the connection of the master
+    connections.close_all()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    from delivery.pool import reset_order_pool
+    reset_order_pool()